@@ -0,0 +1,519 @@
+#-------------------------------------------------------------------------------
+# Name:         AB_Benchmark.py
+# Purpose:      A reproducible performance workload: writes a synthetic GTFS
+#               feed (AB_SyntheticGTFS.py), builds its database one populate*
+#               stage at a time (AB_GTFStoSQL.py), then times the main
+#               AB_Class.py queries against it.
+#               With --trajectories, also times interval generation (the
+#               position engine of PTTrip.whereIsVehicle) phase by phase,
+#               on the synthetic database or an existing one (--db).
+#               With --compare, also checks the fast code paths against the
+#               ones they replaced: the numpy position engine against the
+#               legacy one, LinearReference against Shapely, IntervalIndex
+#               against a scan of every interval, and the EntityCache's
+#               identities, within a tolerance; the script exits with
+#               status 1 if any check fails.
+#               Results are written as JSON, so that runs of different
+#               versions of the code can be compared.
+#
+# Inputs:       The size of the synthetic feed, and a working folder.
+# Outputs:      A JSON file of timings, e.g.
+#               {"feed": {...}, "ingest": {"stop_times": {"rows": 10000, "seconds": 0.14}, ...},
+#                "queries": {"PTTrip.doesTripRunOn": {"calls": 50, "seconds": 0.01}, ...},
+#                "trajectories": {"rows": 21000, "rows_per_second": 90000.0,
+#                                 "phases": {"PTTrip.getPatternTrajectory": {"calls": 50, "seconds": 0.02, "gc_objects": 1200}, ...}},
+#                "comparisons": {"engines": {"positions": 21000, "max_deviation": 2e-09, "passed": true, ...}, ...}}
+#
+# Created:            20261018
+#-------------------------------------------------------------------------------
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import resource
+import sqlite3
+import datetime
+import platform
+
+import AB_GTFStoSQL
+import AB_SyntheticGTFS
+
+# A weekday, a Saturday and a Sunday inside the synthetic feed's date range
+DAYS = [datetime.datetime(2013, 12, 9), datetime.datetime(2013, 12, 14), datetime.datetime(2013, 12, 15)]
+
+TOLERANCE = 0.001 # Metres (projected) that the fast code paths may deviate from those they replaced, for --compare
+
+def benchmarkIngest(GTFSLocation, dbPath, batchsize=None):
+  '''
+  Builds the database <dbPath> from the GTFS feed at <GTFSLocation> as
+  AB_GTFStoSQL.py does, timing each populate* stage and the indexes.
+  Returns (database, {stage: {"rows": Integer, "seconds": Float}}).
+  '''
+  G = AB_GTFStoSQL
+  database = G.createGTSFtoSQL_database(dbPath)
+  stages = [
+    ("routes", G.populateRoutes, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("agency", G.populateAgency, (GTFSLocation, database, "Oceania", "New Zealand", "Synthetic"), {"batchsize": batchsize}),
+    ("calendar", G.populateCalendar, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("calendar_dates", G.populateCalendarDates, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("trips", G.populateTrips, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("shapes", G.populateShapes, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("feed_info", G.populateFeedInfo, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("stops", G.populateStops, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("stop_times", G.populateStopTimes, (GTFSLocation, database), {"batchsize": batchsize}),
+    ("stop_times_amended", G.populateStopTimesAmended, (database,), {}),
+    ("trip_summary", G.populateTripSummary, (database,), {}),
+    ("service_dates", G.populateServiceDates, (database,), {}),
+    ]
+  results = {}
+  for tableName, populate, args, kwargs in stages:
+    rows, seconds = G.timeTable(database, tableName, populate, *args, **kwargs)
+    results[tableName] = {"rows": rows, "seconds": seconds}
+
+  start = time.time()
+  G.createIndexes(database)
+  results["indexes"] = {"rows": len(G.INDEXES), "seconds": time.time() - start}
+
+  return database, results
+
+def timeCalls(results, name, function, calls):
+  '''
+  Calls <function>(*args) for each args tuple in <calls>, and records
+  the number of calls and the total seconds under <name> in <results>.
+  '''
+  start = time.time()
+  for args in calls:
+    function(*args)
+  results[name] = {"calls": len(calls), "seconds": time.time() - start}
+
+def benchmarkQueries(database, samples=50, seed=0):
+  '''
+  Times the main AB_Class queries against <database>, a database built
+  from a synthetic feed, on each day of DAYS and <samples> trips and
+  stops chosen at random with <seed>.
+  Returns {query: {"calls": Integer, "seconds": Float}}.
+  '''
+  # AB_Class needs the plotting and projection libraries, so is only imported when the queries are timed
+  import AB_Class as C
+
+  rand = random.Random(seed)
+  cur = database.cursor()
+  cur.execute('SELECT trip_id FROM trips')
+  tripids = [trip[0] for trip in cur.fetchall()]
+  tripids = rand.sample(tripids, min(samples, len(tripids)))
+  cur.execute('SELECT trip_id, stop_id FROM stop_times')
+  stoptrips = cur.fetchall()
+  stoptrips = rand.sample(stoptrips, min(samples, len(stoptrips)))
+
+  days = [C.Day(database, day) for day in DAYS]
+  trips = [C.PTTrip(database, trip_id) for trip_id in tripids]
+  results = {}
+  timeCalls(results, "PTTrip.__init__", C.PTTrip, [(database, trip_id) for trip_id in tripids])
+  timeCalls(results, "Day.getAllTrips", C.Day.getAllTrips, [(day,) for day in days])
+  timeCalls(results, "Day.getServicesDay", C.Day.getServicesDay, [(day,) for day in days])
+  timeCalls(results, "Day.getCanxServices", C.Day.getCanxServices, [(day,) for day in days])
+  timeCalls(results, "Day.getSittingStops", C.Day.getSittingStops, [(day, datetime.time(hour, 0)) for day in days for hour in [8, 12, 17]])
+  timeCalls(results, "PTTrip.doesTripRunOn", C.PTTrip.doesTripRunOn, [(trip, day) for trip in trips for day in days])
+  timeCalls(results, "PTTrip.getTripStartTime", C.PTTrip.getTripStartTime, [(trip, day) for trip in trips for day in days])
+  timeCalls(results, "PTTrip.getTripEndTime", C.PTTrip.getTripEndTime, [(trip, day) for trip in trips for day in days])
+  timeCalls(results, "PTTrip.getTripDuration", C.PTTrip.getTripDuration, [(trip, day) for trip in trips for day in days])
+  timeCalls(results, "PTTrip.getStopsInSequence", C.PTTrip.getStopsInSequence, [(trip,) for trip in trips])
+  timeCalls(results, "PTTrip.getPositionArrays", C.PTTrip.getPositionArrays, [(trip, day) for trip in trips for day in days])
+  timeCalls(results, "PTTrip.getShapelyLine", C.PTTrip.getShapelyLine, [(trip,) for trip in trips])
+  timeCalls(results, "Stop.getStopTime", lambda stop_id, trip_id, day: C.Stop(database, stop_id).getStopTime(C.PTTrip(database, trip_id), day), [(stop_id, trip_id, day) for trip_id, stop_id in stoptrips for day in days])
+  timeCalls(results, "Stop.getShapelyPoint", lambda stop_id: C.Stop(database, stop_id).getShapelyPoint(), [(stop_id,) for trip_id, stop_id in stoptrips])
+
+  return results
+
+# The methods that interval generation is timed by, each as a phase.
+# A phase's time excludes that of the phases it calls, so what is left
+# to the engines' own methods is their inline work: for the "numpy"
+# engine, PTTrip.getTrajectory's trip_dates query and
+# PTTrip.getPositionArrays' per-second interpolation; for the "legacy"
+# engine, PTTrip.whereIsVehicleLegacy's stop_times fetch and its
+# per-second loop.
+PHASES = [
+  ("PTTrip", "getIntervalRows"), # Building the rows
+  ("PTTrip", "whereIsVehicle"),
+  ("PTTrip", "whereIsVehicleLegacy"),
+  ("PTTrip", "getPositionArrays"),
+  ("PTTrip", "getTrajectory"),
+  ("PTTrip", "getTripPattern"), # The stop_times fetch
+  ("PTTrip", "getPatternTrajectory"),
+  ("PTTrip", "getShapelyLineProjected"), # OGR projection
+  ("PTTrip", "getShapelyLine"), # The shapes fetch
+  ("PTTrip", "getShapeID"),
+  ("PTTrip", "getTripStartTime"),
+  ("PTTrip", "getTripEndTime"),
+  ("PTTrip", "getRoute"),
+  ("Route", "getMode"),
+  ("Route", "getAgencyID"),
+  ("Stop", "getStopTime"),
+  ("Stop", "getGivenDistanceAlong"),
+  ("LinearReference", "__init__"), # cutLineAtMultiple
+  ("LinearReference", "substring"), # cutLineAtMultiple
+  ]
+
+def timePhases(module, phases, results):
+  '''
+  Wraps each (class, method) of <phases> in <module> so that every call
+  adds to results["Class.method"]: its "calls", the "seconds" spent in
+  it less those of any phase it calls, and "gc_objects", the net number
+  of objects tracked by the garbage collector that it created (a proxy
+  for its allocations, counted while the collector is disabled).
+  Returns a function that puts the original methods back.
+  '''
+  stack = [] # [seconds, gc_objects] spent in the phases called by each phase running
+  originals = []
+  def wrap(name, method):
+    def timed(*args, **kwargs):
+      stack.append([0.0, 0])
+      start, objects = time.time(), gc.get_count()[0]
+      try:
+        return method(*args, **kwargs)
+      finally:
+        seconds, objects = time.time() - start, gc.get_count()[0] - objects
+        inner = stack.pop()
+        phase = results.setdefault(name, {"calls": 0, "seconds": 0.0, "gc_objects": 0})
+        phase["calls"] += 1
+        phase["seconds"] += seconds - inner[0]
+        phase["gc_objects"] += objects - inner[1]
+        if stack:
+          stack[-1][0] += seconds
+          stack[-1][1] += objects
+    return timed
+  for className, methodName in phases:
+    cls = getattr(module, className)
+    method = cls.__dict__.get(methodName)
+    if method is not None:
+      originals.append((cls, methodName, method))
+      setattr(cls, methodName, wrap("%s.%s" % (className, methodName), method))
+  def restore():
+    for cls, methodName, method in originals:
+      setattr(cls, methodName, method)
+  return restore
+
+def sampleTrips(database, DayObj, samples=50, seed=0):
+  '''
+  Returns a list of <samples> trip_ids chosen at random with <seed> from
+  those that run on <DayObj> in <database>.
+  '''
+  rand = random.Random(seed)
+  cur = database.cursor()
+  cur.execute('SELECT DISTINCT trip_id FROM trip_dates WHERE date_int = ? ORDER BY trip_id', (DayObj.dateInt,))
+  tripids = [trip[0] for trip in cur.fetchall()]
+  return rand.sample(tripids, min(samples, len(tripids)))
+
+def benchmarkTrajectories(database, samples=50, seed=0, day=DAYS[0], engine="numpy", patterns=True):
+  '''
+  Times interval generation (PTTrip.getIntervalRows, as
+  Database.populateIntervals runs it) for <samples> trips chosen at
+  random with <seed> from those that run on <day> in <database>, with
+  the position <engine> ("numpy", "continuous" or "legacy"; with
+  <patterns>, the numpy and continuous engines share trip pattern
+  trajectories between trips as populateIntervals does).
+  Returns {"engine", "day", "trips", "rows", "seconds",
+  "rows_per_second", "maxrss_kib", "phases": {phase: {"calls",
+  "seconds", "gc_objects"}}}, the phases being those of PHASES.
+  '''
+  import AB_Class as C
+
+  DayObj = C.Day(database, day)
+  tripids = sampleTrips(database, DayObj, samples, seed)
+
+  phases = {}
+  cache = {} if patterns and engine in ["numpy", "continuous"] else None
+  restore = timePhases(C, PHASES, phases)
+  gc.collect()
+  gc.disable()
+  try:
+    rows = 0
+    start = time.time()
+    for trip_id in tripids:
+      rows += len(C.PTTrip(database, trip_id).getIntervalRows(DayObj, engine=engine, patterns=cache))
+    seconds = time.time() - start
+  finally:
+    gc.enable()
+    restore()
+
+  return {
+    "engine": engine,
+    "patterns": cache is not None,
+    "day": day.strftime("%Y-%m-%d"),
+    "trips": len(tripids),
+    "rows": rows,
+    "seconds": seconds,
+    "rows_per_second": rows / seconds if seconds > 0 else None,
+    "maxrss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "phases": phases,
+    }
+
+def compareEngines(database, samples=50, seed=0, day=DAYS[0], tolerance=TOLERANCE):
+  '''
+  Checks the numpy position engine against the legacy one it replaced
+  (PTTrip.whereIsVehicle with engine="numpy" and "legacy") for <samples>
+  trips chosen at random with <seed> from those that run on <day>: they
+  must give positions at the same seconds, no more than <tolerance>
+  metres apart. The last second of each run is left out, where the
+  legacy engine puts the vehicle back at the start of the line (its
+  segment after the last stop is the whole line).
+  The "continuous" engine is compared too, but only reported: it is
+  meant to differ between stops.
+  Returns {"trips", "positions", "seconds_mismatched" (trip_ids),
+  "max_deviation", "continuous_max_deviation", "tolerance", "passed"}.
+  '''
+  import AB_Class as C
+
+  DayObj = C.Day(database, day)
+  tripids = sampleTrips(database, DayObj, samples, seed)
+  positions, mismatched, deviation, continuous = 0, [], 0.0, 0.0
+  for trip_id in tripids:
+    trip = C.PTTrip(database, trip_id)
+    legacy = dict(trip.whereIsVehicle(DayObj, engine="legacy"))
+    compared = [second for second in legacy if second + 1 in legacy] # Leaves out the last second of each run
+    numpy = dict(trip.whereIsVehicle(DayObj, engine="numpy"))
+    if sorted(numpy) != sorted(legacy):
+      mismatched.append(trip_id)
+      continue
+    positions += len(compared)
+    deviation = max([deviation] + [numpy[second].distance(legacy[second]) for second in compared])
+    smooth = dict(trip.whereIsVehicle(DayObj, engine="continuous"))
+    continuous = max([continuous] + [smooth[second].distance(legacy[second]) for second in compared if second in smooth])
+
+  return {
+    "trips": len(tripids),
+    "positions": positions,
+    "seconds_mismatched": mismatched,
+    "max_deviation": deviation,
+    "continuous_max_deviation": continuous,
+    "tolerance": tolerance,
+    "passed": len(mismatched) == 0 and deviation <= tolerance,
+    }
+
+def shapelyCut(line, distance):
+  '''
+  Cuts the Shapely LineString <line> in two at <distance> from its
+  starting point by projecting each of its vertices, as the shapely
+  manual does (and as the position engine did before LinearReference):
+  http://toblerity.org/shapely/manual.html#linear-referencing-methods
+  '''
+  from shapely.geometry import Point, LineString
+
+  if distance <= 0.0 or distance >= line.length:
+    return [LineString(line)]
+  coords = list(line.coords)
+  for i, p in enumerate(coords):
+    pd = line.project(Point(p))
+    if pd == distance:
+      return [LineString(coords[:i+1]), LineString(coords[i:])]
+    if pd > distance:
+      cp = line.interpolate(distance)
+      return [LineString(coords[:i] + [(cp.x, cp.y)]), LineString([(cp.x, cp.y)] + coords[i:])]
+
+def checkLinearReference(database, samples=50, seed=0, tolerance=TOLERANCE):
+  '''
+  Checks LinearReference against Shapely on the projected shapes of
+  <samples> trips chosen at random with <seed>, at <samples> random
+  distances and points each: interpolate against
+  LineString.interpolate, snap against the distance from the line to
+  the point, and cut and substring against shapelyCut, by the
+  Hausdorff distance between the lines. No result may be more than
+  <tolerance> metres out.
+  Returns {"shapes", "cases", "max_deviation", "tolerance", "passed"}.
+  '''
+  import AB_Class as C
+  from shapely.geometry import Point
+
+  rand = random.Random(seed)
+  cur = database.cursor()
+  cur.execute('SELECT trip_id FROM trips ORDER BY trip_id')
+  tripids = [trip[0] for trip in cur.fetchall()]
+  cases, deviation = 0, 0.0
+  for trip_id in rand.sample(tripids, min(samples, len(tripids))):
+    line = C.PTTrip(database, trip_id).getShapelyLineProjected()
+    ref = C.LinearReference(line)
+    (minx, miny, maxx, maxy) = line.bounds
+    for i in range(samples):
+      start, end = sorted([rand.uniform(0.0, line.length), rand.uniform(0.0, line.length)])
+      point = Point(rand.uniform(minx, maxx), rand.uniform(miny, maxy))
+      deviation = max([deviation,
+        ref.interpolate(start).distance(line.interpolate(start)),
+        abs(ref.snap(point).distance(point) - line.distance(point)),
+        ref.substring(start, end).hausdorff_distance(shapelyCut(shapelyCut(line, end)[0], start)[-1])]
+        + [a.hausdorff_distance(b) for a, b in zip(ref.cut(start), shapelyCut(line, start))])
+      cases += 1
+
+  return {"shapes": min(samples, len(tripids)), "cases": cases, "max_deviation": deviation, "tolerance": tolerance, "passed": deviation <= tolerance}
+
+def checkIntervalIndex(database, day=DAYS[0], step=60):
+  '''
+  Checks Day.getTripIndex (an IntervalIndex) against a scan of every
+  run of Day.getTripRuns on <day>: the trips running at every <step>th
+  second, and in each window of <step> seconds from it, must be the same.
+  Returns {"runs", "queries", "mismatched" (seconds), "passed"}.
+  '''
+  import AB_Class as C
+
+  DayObj = C.Day(database, day)
+  runs = DayObj.getTripRuns()
+  index = DayObj.getTripIndex()
+  mismatched = []
+  for second in range(0, 24 * 60 * 60, step):
+    stabbed = sorted([trip_id for trip_id, mode, start, end in runs if start <= second <= end])
+    windowed = sorted([trip_id for trip_id, mode, start, end in runs if start <= second + step and end >= second])
+    if sorted(index.at(second)) != stabbed or sorted(index.window(second, second + step)) != windowed:
+      mismatched.append(second)
+
+  return {"runs": len(runs), "queries": 2 * len(range(0, 24 * 60 * 60, step)), "mismatched": mismatched, "passed": len(mismatched) == 0}
+
+def checkEntityCache(database, samples=50, seed=0):
+  '''
+  Checks that Database.getEntity gives one object per entity, whether
+  its id is given as an integer or a string, that the memoized methods
+  of the objects give the same result each time, and that an
+  EntityCache of size <samples> keeps the most recently used objects.
+  Returns {"checks", "failed" (their names), "passed"}.
+  '''
+  import AB_Class as C
+
+  DayObj = C.Day(database, DAYS[0])
+  tripids = sampleTrips(database, DayObj, samples, seed)
+  checks = [
+    ("trip identity", all([DayObj.getEntity(C.PTTrip, trip_id, DayObj) is DayObj.getEntity(C.PTTrip, str(trip_id), DayObj) for trip_id in tripids])),
+    ("route identity", all([DayObj.getEntity(C.PTTrip, trip_id).getRoute() is DayObj.getEntity(C.PTTrip, trip_id).getRoute() for trip_id in tripids])),
+    ("memoized line", all([DayObj.getEntity(C.PTTrip, trip_id).getShapelyLine() is DayObj.getEntity(C.PTTrip, trip_id).getShapelyLine() for trip_id in tripids])),
+    ]
+  cache = C.EntityCache(size=samples)
+  objects = [cache.get(key, object) for key in range(samples)]
+  cache.get(0, object) # Now the most recently used, so 1 is evicted next
+  cache.get(samples, object)
+  checks.append(("LRU eviction", cache.get(0, object) is objects[0] and 1 not in cache.entities and len(cache) == samples))
+  failed = [name for name, passed in checks if not passed]
+
+  return {"checks": len(checks), "failed": failed, "passed": len(failed) == 0}
+
+def benchmarkComparisons(database, samples=50, seed=0, day=DAYS[0], tolerance=TOLERANCE):
+  '''
+  Runs compareEngines, checkLinearReference, checkIntervalIndex and
+  checkEntityCache on <database>.
+  Returns {"engines", "linear_reference", "interval_index",
+  "entity_cache"}, each with its "passed".
+  '''
+  return {
+    "engines": compareEngines(database, samples, seed, day, tolerance),
+    "linear_reference": checkLinearReference(database, samples, seed, tolerance),
+    "interval_index": checkIntervalIndex(database, day),
+    "entity_cache": checkEntityCache(database, samples, seed),
+    }
+
+def environment():
+  '''
+  Returns a dictionary describing where the benchmark is run, for the
+  results.
+  '''
+  return {
+    "timestamp": datetime.datetime.now().isoformat(' '),
+    "python": sys.version.split()[0],
+    "sqlite": sqlite3.sqlite_version,
+    "platform": platform.platform(),
+    }
+
+def runTrajectoryBenchmark(dbPath, samples=50, seed=0, day=DAYS[0], engines=["numpy"], compare=False, tolerance=TOLERANCE):
+  '''
+  Times interval generation (see benchmarkTrajectories) with each of
+  <engines> on the existing database at <dbPath>, e.g. one built from a
+  real feed by AB_GTFStoSQL.py, and (if <compare>) checks the fast code
+  paths (see benchmarkComparisons).
+  Returns the results as a dictionary, ready for json.dump().
+  '''
+  database = sqlite3.connect(dbPath)
+  database.text_factory = sqlite3.OptimizedUnicode
+  results = environment()
+  results["database"] = dbPath
+  results["trajectories"] = dict([(engine, benchmarkTrajectories(database, samples, seed, day, engine)) for engine in engines])
+  if compare:
+    results["comparisons"] = benchmarkComparisons(database, samples, seed, day, tolerance)
+  database.close()
+  return results
+
+def runBenchmark(workdir, routes=10, tripsPerRoute=50, stopsPerTrip=20, shapeVertices=100, midnightTrips=5, seed=0, zipped=False, batchsize=None, queries=True, samples=50, trajectories=False, engines=["numpy"], compare=False, tolerance=TOLERANCE):
+  '''
+  Writes a synthetic feed of the given size (see AB_SyntheticGTFS.syntheticTables)
+  into <workdir>, builds its database there, and times the ingest,
+  (if <queries>) the AB_Class queries and (if <trajectories>) interval
+  generation with each of <engines>, and (if <compare>) checks the fast
+  code paths (see benchmarkComparisons).
+  Returns the results as a dictionary, ready for json.dump().
+  '''
+  if not os.path.isdir(workdir):
+    os.makedirs(workdir)
+  feed = {"routes": routes, "tripsPerRoute": tripsPerRoute, "stopsPerTrip": stopsPerTrip, "shapeVertices": shapeVertices, "midnightTrips": midnightTrips, "seed": seed, "zipped": zipped}
+  name = "synthetic_%i_%i_%i_%i_%i_%i" % (routes, tripsPerRoute, stopsPerTrip, shapeVertices, midnightTrips, seed)
+  GTFSLocation = os.path.join(workdir, name + (".zip" if zipped else ""))
+  dbPath = os.path.join(workdir, name + ".db")
+  if os.path.exists(dbPath):
+    os.remove(dbPath)
+
+  start = time.time()
+  AB_SyntheticGTFS.writeSyntheticFeed(GTFSLocation, routes, tripsPerRoute, stopsPerTrip, shapeVertices, midnightTrips, seed)
+  feed["seconds"] = time.time() - start
+
+  database, ingest = benchmarkIngest(GTFSLocation, dbPath, batchsize)
+  results = environment()
+  results["feed"] = feed
+  results["ingest"] = ingest
+  if queries:
+    results["queries"] = benchmarkQueries(database, samples, seed)
+  if trajectories:
+    results["trajectories"] = dict([(engine, benchmarkTrajectories(database, samples, seed, DAYS[0], engine)) for engine in engines])
+  if compare:
+    results["comparisons"] = benchmarkComparisons(database, samples, seed, DAYS[0], tolerance)
+  database.close()
+
+  return results
+
+################################################################################
+############################### Script #########################################
+################################################################################
+
+if __name__ == "__main__":
+
+  # Used for command line argument passing
+  import argparse
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("workdir", nargs="?", default=".", help="enter the folder to write the synthetic feed and its database to (default the current folder)")
+  parser.add_argument("--json", default="benchmark.json", help="file to write the results to (default benchmark.json)")
+  parser.add_argument("--routes", type=int, default=10, help="number of routes (default 10)")
+  parser.add_argument("--trips", type=int, default=50, help="trips per route (default 50)")
+  parser.add_argument("--stops", type=int, default=20, help="stops per trip (default 20)")
+  parser.add_argument("--vertices", type=int, default=100, help="vertices per shape (default 100)")
+  parser.add_argument("--midnight", type=int, default=5, help="trips per route that run past midnight (default 5)")
+  parser.add_argument("--seed", type=int, default=0, help="random seed (default 0)")
+  parser.add_argument("--zip", action="store_true", help="write and ingest the feed as a .zip archive")
+  parser.add_argument("--batchsize", type=int, default=AB_GTFStoSQL.BATCHSIZE, help="rows per executemany() batch (default %i)" % AB_GTFStoSQL.BATCHSIZE)
+  parser.add_argument("--samples", type=int, default=50, help="trips and stops to time the AB_Class queries on (default 50)")
+  parser.add_argument("--noqueries", action="store_true", help="only time the ingest")
+  parser.add_argument("--trajectories", action="store_true", help="also time interval generation, phase by phase, on <samples> trips")
+  parser.add_argument("--engine", action="append", choices=["numpy", "continuous", "legacy"], help="position engine to time interval generation with; may be given more than once (default numpy)")
+  parser.add_argument("--compare", action="store_true", help="also check the numpy engine against the legacy one, LinearReference against Shapely, IntervalIndex and the EntityCache; exits with status 1 if any check fails")
+  parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="with --compare, the metres the checked results may deviate by (default %g)" % TOLERANCE)
+  parser.add_argument("--db", help="time interval generation on this existing database instead of a synthetic one (implies --trajectories)")
+  parser.add_argument("--day", default=DAYS[0].strftime("%Y%m%d"), help="with --db, the day to generate intervals for, as YYYYMMDD (default %s)" % DAYS[0].strftime("%Y%m%d"))
+  args = parser.parse_args()
+
+  engines = args.engine or ["numpy"]
+  if args.db:
+    results = runTrajectoryBenchmark(args.db, args.samples, args.seed, datetime.datetime.strptime(args.day, "%Y%m%d"), engines, args.compare, args.tolerance)
+  else:
+    results = runBenchmark(args.workdir, args.routes, args.trips, args.stops, args.vertices, args.midnight, args.seed, args.zip, args.batchsize, not args.noqueries, args.samples, args.trajectories, engines, args.compare, args.tolerance)
+  with open(args.json, "w") as f:
+    json.dump(results, f, indent=2, sort_keys=True)
+  print "Benchmark results written: " + args.json
+  failed = [name for name, check in sorted(results.get("comparisons", {}).items()) if not check["passed"]]
+  if failed:
+    print "Comparisons failed: " + ", ".join(failed)
+    sys.exit(1)
@@ -17,22 +17,42 @@
 #      > getAllModes()                   ::Returns a list of Mode objects, one for each type of route_type_desc in the GTFS (routes table)::
 #      > getAgencies()                   ::Returns cur.fetchall() of the agency table::
 #      > checkTableEmpty(tableName="intervals") :: Checks if <tableName> (str) has any rows; returns Boolean to that effect::
-#      > populateIntervals(DayObj=None, starti=0, endtime=datetime.time(21, 30)) ::Recursively populates the intervals table of self (Database) for <DayObj>. Be careful to ensure that the DB you're populating does not already have a populated intervals table::
+#      > populateIntervals(DayObj=None, starti=0, endtime=False, processes=1, chunksize=10, resume=True, notify=True, engine="numpy", deferindexes=False, store="intervals", resolution=1) ::Recursively populates the intervals table of self (Database) for <DayObj> (its own intervals_YYYYMMDD table; or with <store>="trajectories", the trajectories table), over <processes> worker processes. Trips written are recorded in intervals_done, so a stopped run resumes where it got to. <deferindexes> drops the intervals indexes while writing, and rebuilds them after. <resolution> writes positions every N seconds (or at a list of seconds) instead of every second, and is recorded in intervals_info. Be careful to ensure that the day you're populating does not already have a populated intervals table::
+#      > writeIntervals(DayObj, tripRows, replace=True) ::Writes the intervals rows of each (trip_id, rows) in <tripRows> into <DayObj>'s intervals table with executemany, replacing the trip's old rows, and records the trips in intervals_done, in one transaction::
+#      > writeTrajectories(DayObj, tripRows) ::Writes the trajectories rows of each (trip_id, rows) in <tripRows>, replacing the trip's old rows for <DayObj>, in one transaction::
+#      > getTripPatterns(DayObj=None)    ::Returns a dictionary of {key: [trip_id, ...]} grouping the trips (of <DayObj>, if given) by pattern: the same shape, stops and relative times. populateIntervals hands out the trips to its worker processes in this order::
+#      > getIntervalsDays()              ::Returns a sorted list of datetime objects, one for each day with its own intervals table::
+#      > dropIntervals(DayObj)           ::Drops <DayObj>'s intervals table and its intervals_done and intervals_info records::
+#      > getEntity(cls, entity_id, DayObj=None) ::Returns the same Stop, PTTrip, Route or Mode object for <entity_id> each time (from self's EntityCache, which it shares with the object), so that its memoized shape line, stop point and mode are loaded once. Numeric trip_ids and stop_ids given as strings are the same as the integers::
+#      > getEntityCache()                ::Returns the EntityCache of self, shared with the objects made by self.getEntity, and released along with them::
+#      > clearEntityCache()              ::Forgets the objects in self's EntityCache::
+#      > getDatabasePath()               ::Returns the path of the database file ("" if in memory)::
 
 #    Day(Database)                       ::A date. PT runs by daily schedules, considering things like whether it is a weekday, etc::
 #      > __init__(database, datetimeObj) ::<database> is a Database object. <datetimeObj> is a datetime object::
 #      > getCanxServices()               :CAUTION:Returns a list of PTService objects that are cancelled according to the calendar_dates table. For Wellington I suspect this table is a little dodgy::
 #      > getServicesDay()                ::Returns a list of service IDs of services that are scheduled to run on self (Day). Accounts for exceptional additions and removals of services; but not the midnight bug, as a PTService is not a PTTrip::
 #      > plotModeSplitNVD3(databaseObj, city) ::Uses the Python-NVD3 library to plot a pie chart showing the breakdown of vehicle modes (num. services) in Day. Useful to compare over time, weekday vs. weekend, etc. <city> is str, used in the title of the chart::
-#      > animateDay(self, start, end, llcrnrlon, llcrnrlat, latheight, aspectratio, sourceproj=None, projected=False, targetproj=None, lat_0=None, lon_0=None, outoption="show", placetext='', skip=5, filepath='', filename='TestOut.mp4') ::See the method for parameter explanations::
-#      > getActiveTrips(second)          ::Returns a list of PTTrip objects representing those trips that are running on self (Day) at <second>. Accounts for service cancellations and the "midnight bug"::
+#      > animateDay(self, start, end, llcrnrlon, llcrnrlat, latheight, aspectratio, sourceproj=None, projected=False, targetproj=None, lat_0=None, lon_0=None, outoption="show", placetext='', skip=5, filepath='', filename='TestOut.mp4', source="intervals", resolution=None, cube=None) ::See the method for parameter explanations::
+#      > getActiveTrips(second, source="index") ::Returns a list of PTTrip objects representing those trips that are running on self (Day) at <second>. Accounts for service cancellations and the "midnight bug". <source> is "index" (see getTripIndex), "intervals" or "trajectories"::
+#      > getActiveTripsInWindow(start, end) ::Returns a list of PTTrip objects representing those trips that are running on self (Day) at any second from <start> to <end>, from getTripIndex()::
+#      > getTripRuns()                   ::Returns a list of (trip_id, route_type_desc, start_second, end_second) for each run of a trip on self (Day), in one query. Accounts for the "midnight bug"::
+#      > getTripIndex()                  ::Returns an IntervalIndex of self's trip runs, built once per Day and reused::
+#      > getIntervalsTable()             ::Returns the name of the table holding self's (Day's) intervals: intervals_YYYYMMDD, or the single intervals table of older databases::
+#      > getIntervalsResolution()        ::Returns the resolution the intervals table was populated at for self (Day): an integer N for every N seconds, or a list of seconds::
+#      > alignToResolution(second, resolution=None) ::Returns the latest second at or before <second> that the intervals table has positions for, or None::
+#      > getTrajectories(start=0, end=86399, breakpoints=True) ::Returns a list of (trip_id, route_type_desc, start_second, end_second, breakpoints) from the trajectories table, for the runs in operation on self between <start> and <end>::
+#      > getTrajectoryPositions(seconds) ::Returns a list of (trip_id, seconds, lat, lon, route_type_desc) for every vehicle at each of <seconds> on self, interpolated from the trajectories table::
+#      > exportPositionCube(folder, source="intervals", resolution=1) ::Writes the positions of every vehicle on self to <folder> as .npy column arrays sorted by second (see PositionCube), and returns the PositionCube::
 #      > countActiveTrips(second)        ::Returns an integer count of the number of trips of any mode that are operating at <second> on self (Day), according to self.getActiveTrips(<second>)::
 #      > countActiveTripsByMode(second)  ::Returns an dictionary of {mode: integer} pairs similar to self.countActiveTrips(<second>) that breaks it down by mode::
+#      > getActiveProfile(n=1)           ::Returns (seconds, {mode: counts}) numpy arrays of the number of trips of each mode in operation at every <n>th second of self (Day), from one pass over the day's trips::
 #      > bokehFrequencyByMode(n, Show=False, name="frequency.py", title="frequency.py", graphTitle="Wellington Public Transport Services, ")  ::Returns an HTML graph of the number of active service every <n> seconds, on the second, broken down by mode::
 #      > getSittingStops(second)         ::Returns a list of dictionaries which give information about any public transport stops which currently (<second>) have a vehicle sitting at them, on <DayObj>. Correctly handles post-midnight services::
 #      > getAllTrips()                   ::Returns a list of PTTrip objects representing those trips that run at least once on self (Day). Accounts for midnight bug correctly::
+#      > getTripRecords()                ::Returns a list of dictionaries of the trip_summary rows of the trips that run on self (Day), from one query. Accounts for midnight bug correctly::
 #      > hexbinStops(self, projected=False, sourceproj=4326, targetproj=2134, save=True) :INCOMPLETE:Creates a hexbin plot representing the number of stops vehicles make in Day. Saves by default.::
-#      > nvd3FrequencyByMode(n, name="frequency_nvd3.html", verbose=True) :INCOMPLETE:Creates a Python-NVD3 chart of frequency at <n> temporal resolution from 0000 to 2359 on self::
+#      > nvd3FrequencyByMode(n, name="frequency_nvd3.html", verbose=True, source="profile", cube=None) :INCOMPLETE:Creates a Python-NVD3 chart of frequency at <n> temporal resolution from 0000 to 2359 on self::
 
 #    Mode(Database)                      ::A vehicle class, like "Bus", "Rail", "Ferry" and "Cable Car"::
 #      > __init__(database, modetype)    ::<database> is a Database object. <modetype> is a string (as above) of the mode of interest::
@@ -53,8 +73,8 @@
 #      > getServices()                   ::Returns a list of the PTService objects representing the services that the agency's routes represent::
 
 #    Route(Agency)                       ::A Route is a path that a trip takes. It has a shape, including vertices and end points. Each route is operated by a single Agency::
-#      > __init__(database, route_id)    ::<database> is a Database object. <route_id> is a String (e.g. 'WBAO001I' for the incoming Number 1 bus)::
-#      > getAgencyID()                   ::Returns a String of the Agency (agency_id) that operates the route. Used to construct the Agency object that the Route object inherits from.::
+#      > __init__(database, route_id)    ::<database> is a Database object. <route_id> is a String (e.g. 'WBAO001I' for the incoming Number 1 bus). Issues no queries: agency_id is looked up on first use and cached::
+#      > getAgencyID()                   ::Returns a String of the Agency (agency_id) that operates the route. Used (lazily, as Route.agency_id) for the Agency object that the Route object inherits from.::
 #      > getShortName()                  ::Returns a String of the route_short_name attribute from the routes table representing the name displayed to passengers on bus signage etc., e.g. "130"::
 #      > getLongName()                   ::Returns a String of the route_long_name attribute from the routes table representing the full name of the route::
 #      > getTripsInDayOnRoute(DayObj)    ::Returns a list of PTTrip objects that run along the entire route. <DayObj> is a Day object::
@@ -64,7 +84,7 @@
 #      > getMode()                       ::Returns the mode of the route, as a Mode object::
 
 #    PTTrip(Route)                       ::A PTTrip is a discrete trip made by single mode along a single route::
-#      > __init__(database, trip_id, DayObj=None) ::<database> is a Database object. <trip_id> is an Integer identifying the trip uniquely. See the database. <DayObj> is a Day object; if not None, then PTTrip.runstoday can be accessed (faster than PTTrip(DB, ID).doesTripRunOn(Day))::
+#      > __init__(database, trip_id, DayObj=None) ::<database> is a Database object. <trip_id> is an Integer identifying the trip uniquely. See the database. <DayObj> is a Day object; if not None, then PTTrip.runstoday can be accessed (faster than PTTrip(DB, ID).doesTripRunOn(Day)). Issues no queries: route_id, agency_id and runstoday are looked up on first use and cached::
 #      > getRouteID()                    ::Returns the route_id (String) of the route that the trip follows. Used to construct the Route object which the Trip object inherits::
 #      > doesTripRunOn(DayObj)           ::Returns a Boolean reporting whether the PTTtrip runs on <DayObj> or not. Considers the exceptions in calendar_dates before deciding, and handles >24h time::
 #      > getRoute()                      ::Returns the Route object representing the route taken on Trip::
@@ -74,7 +94,13 @@
 #      > prettyPrintShapelyLine()        ::Prints a columised WKT representation of <self> (trip's) shape, ready tto be copy-pasted into QGIS via a TXT file::
 #      > plotShapelyLine()               ::Uses matplotlib and Shapely to plot the shape of the trip. Does not plot stops (yet?)::
 #      > getStopsInSequence()            ::Returns a list of the stops (as Stop ibjects) that the trip uses, in sequence::
-#      > whereIsVehicle(DayObj, write=False) ::<DayObj> is a Day object. Returns an ordered list of (second, shapely.geometry.Point) for the entire range of the trip in <DayObj>, every second it runs. If write=True, then write the result to the intervals table of the database::
+#      > whereIsVehicle(DayObj, write=False, engine="numpy", resolution=1) ::<DayObj> is a Day object. Returns an ordered list of (second, shapely.geometry.Point) for the entire range of the trip in <DayObj>, every second it runs (or every <resolution> seconds, or at a list of seconds). If write=True, then write the result to the intervals table of the database. <engine> is "numpy" (getPositionArrays), "continuous" (getPositionArrays with timing="departures", deviating from the legacy timing) or "legacy" (whereIsVehicleLegacy)::
+#      > getIntervalRows(DayObj, positionlist=None, engine="numpy", resolution=1, patterns=None) ::Returns the intervals table rows for the trip on <DayObj>, one tuple per second it runs::
+#      > getTripPattern()                ::Returns (key, t0): the key of the trip's pattern (shape, stops and times relative to the first departure), and its first departure::
+#      > getPatternTrajectory(key, timing="arrivals") ::Returns (first, last, breakpoints), the trajectory of the pattern <key> relative to its first departure. <timing> "arrivals" matches the legacy engine; "departures" moves the vehicle continuously from each departure to the next arrival::
+#      > getTrajectory(DayObj, patterns=None, timing="arrivals") ::Returns a list of (start_second, end_second, breakpoints) for each run of the trip on <DayObj>, breakpoints being a numpy array of the (second, x, y) at its stops and the shape's vertices. The pattern's trajectory shifted in time, looked up in (or added to) the <patterns> cache::
+#      > getTrajectoryRows(DayObj, patterns=None, timing="arrivals") ::Returns the trajectories table rows for the trip on <DayObj>, one per run::
+#      > getPositionArrays(DayObj, resolution=1, patterns=None, timing="arrivals") ::The NumPy engine of whereIsVehicle: returns numpy arrays (seconds, x, y) of the vehicle's projected position every second (of <resolution>) it runs on <DayObj>::
 #      > getShapeID()                    ::Each trip has a particular shape, this returns the ID of it (str)::
 #      > getTripStartDay(DayObj)         ::The start day of a PTTrip is either the given <DayObj>, or the day before it (or neither if it doesn't run). This method returns <DayObj> if the trip starts on <DayObj>, the Day BEFORE <DayObj> if that's right, and None in the third case. Raises an exception in the case of ambiguity::
 #      > getTripEndDay(DayObj)           ::The end day of a PTTrip is either the given <DayObj>, or the day after it (or neither if it doesn't run). This method returns <DayObj> if the trip ends on <DayObj>, the Day AFTER <DayObj> if that's right, and None in the third case. Raises an exception in the case of ambiguity:: 
@@ -92,6 +118,33 @@
 #      > getStopTime(TripObj, DayObj)    ::Returns a list of tuples of date+time objects representing the day-time(s) when the <TripObj> arrives and departs self (Stop), using <DayObj> as seed::
 #      > getStopSnappedToRoute(TripObj)  ::Returns a Shapely.geometry.point.Point object representing the originally-non-overlapping Stop as a Point overlapping (or very, very nearly overlapping) the Route shape of <TripObj>::
 
+#    LinearReference(Object)             ::Linear referencing along a Shapely LineString by binary search of its cumulative vertex distances, computed once::
+#      > __init__(line)                  ::<line> is a Shapely LineString::
+#      > interpolate(distance, normalized=False) ::Returns the Point at <distance> along the line::
+#      > interpolateArray(distances)     ::Returns numpy arrays (xs, ys) of the points at each of <distances>::
+#      > substring(start, end)           ::Returns the LineString of the line between the distances <start> and <end>::
+#      > cut(distance)                   ::Returns the line cut in two at <distance>, as a list of LineStrings::
+#      > project(point)                  ::Returns the distance along the line of its nearest point to <point>::
+#      > snap(point)                     ::Returns the Point on the line nearest to <point>::
+
+#    PositionCube(Object)                ::A day of vehicle positions as memory-mapped .npy column arrays (seconds, x, y, mode, trip), written by Day.exportPositionCube::
+#      > __init__(folder)                ::<folder> is the folder the cube was written to::
+#      > window(start, end)              ::Returns (seconds, x, y, mode, trip), zero-copy slices of the positions from <start> to <end> inclusive::
+#      > at(second)                      ::Returns window(second, second)::
+#      > getModeCode(modetype)           ::Returns the code of <modetype> in the mode column (-1 if absent)::
+#      > countByMode(seconds)            ::Returns a list of (route_type_desc, second, count) at each of <seconds>, for the frequency charts::
+#      > hexbin(start=0, end=86399, modetype=None, **kwargs) ::Plots a matplotlib hexbin of the positions from <start> to <end>::
+
+#    IntervalIndex(Object)               ::A centred interval tree over (start, end, value) intervals, built once, answering which contain a point or overlap a window in logarithmic time::
+#      > __init__(intervals)             ::<intervals> is a list of (start, end, value) tuples::
+#      > at(point)                       ::Returns a list of the values of the intervals containing <point>::
+#      > window(start, end)              ::Returns a list of the values of the intervals overlapping <start> to <end> inclusive::
+
+#    EntityCache(Object)                 ::A bounded (ENTITY_CACHE_SIZE) least-recently-used identity map of entity objects, for Database.getEntity, and of the shape lines that the trips along each shape share::
+#      > __init__(size=ENTITY_CACHE_SIZE) ::<size> is the most objects kept::
+#      > get(key, load)                  ::Returns the object kept for <key>, or calls <load>() for it and keeps that::
+#      > clear()                         ::Forgets every object kept::
+
 # Tasks for next iteration/s:
 #  > KEEP CODE DOCUMENTED THROUGHOUT
 #  > Develop the HTML and CSS for the website and embed the JavaScript graphs
@@ -126,6 +179,10 @@ Before using script change filepath for database (db_pathstr) and potentially na
 
 import time
 import os
+import traceback
+import itertools
+import json
+import multiprocessing
 
 # Used for command line argument passing
 import argparse
@@ -144,15 +201,65 @@ from math import sqrt # Snapping
 from sys import maxint # Snapping
 
 import bisect
+import collections
 
 import sqlite3 as dbapi
 
+# Used for rebuilding the intervals indexes after Database.populateIntervals(deferindexes=True)
+from AB_GTFStoSQL import createIndexes, intervalsTableName, createIntervalsTable, hasTable
+# The calendar table's day of the week columns, for Day.getCanxServices
+from AB_GTFStoSQL import WEEKDAYS
+# How often populateIntervals checks that its worker processes are still alive
+from AB_GTFStoSQL import WORKERPOLL
+from Queue import Empty
+
 class CustomException(Exception):
     def __init__(self, value):
         self.parameter = value
     def __str__(self):
         return repr(self.parameter)
 
+SERIAL_ENDTIME = datetime.time(21, 30) # When Database.populateIntervals stops a run without worker processes, unless told otherwise
+ENTITY_CACHE_SIZE = 10000 # The most Stop, PTTrip, Route and Mode objects kept per EntityCache by Database.getEntity
+
+def memoized(method):
+  '''
+  Decorates a method so that its result for each set of arguments is
+  kept in the instance's memo dictionary (see Database.__init__), and
+  later calls return it without running the method again. For entities
+  shared through Database.getEntity, whose results do not change.
+  '''
+  def memoizedMethod(self, *args, **kwargs):
+    key = (method.__name__, args, tuple(sorted(kwargs.items())))
+    if key not in self.memo:
+      self.memo[key] = method(self, *args, **kwargs)
+    return self.memo[key]
+  memoizedMethod.__name__, memoizedMethod.__doc__ = method.__name__, method.__doc__
+  return memoizedMethod
+
+def sharedByShape(method):
+  '''
+  Decorates a PTTrip method whose result depends only on the trip's
+  shape, so that its result for each shape and set of arguments is kept
+  in the instance's EntityCache (see Database.getEntityCache). Every
+  trip along the shape, on any Day, then shares the one result.
+  '''
+  def sharedMethod(self, *args, **kwargs):
+    key = (method.__name__, self.getShapeID(), args, tuple(sorted(kwargs.items())))
+    return self.getEntityCache().get(key, lambda: method(self, *args, **kwargs))
+  sharedMethod.__name__, sharedMethod.__doc__ = method.__name__, method.__doc__
+  return sharedMethod
+
+def integerID(entity_id):
+  '''
+  Returns <entity_id> as an integer if it is one (e.g. 1234 for "1234"),
+  otherwise unchanged.
+  '''
+  try:
+    return int(entity_id)
+  except (TypeError, ValueError):
+    return entity_id
+
 class Database(object):
   '''
   A GTFS feed transformed into a SQLite database.
@@ -165,6 +272,49 @@ class Database(object):
     '''
     self.database = database
     self.cur = self.database.cursor()
+    self.memo = {} # Results of the @memoized methods
+    self.entities = None # The EntityCache of self.getEntity, made on first use
+
+  def getEntityCache(self):
+    '''
+    Returns the EntityCache of self, shared with every object made by
+    self.getEntity (and so by theirs). It is not kept anywhere else, so
+    it is released, with its objects and their database connection,
+    once none of them are in use.
+    '''
+    if self.entities is None:
+      self.entities = EntityCache()
+    return self.entities
+
+  def clearEntityCache(self):
+    '''
+    Forgets the objects in self's EntityCache (see self.getEntity), e.g.
+    after changing the database's tables.
+    '''
+    self.getEntityCache().clear()
+
+  def getEntity(self, cls, entity_id, DayObj=None):
+    '''
+    Returns the <cls> object (Stop, PTTrip, Route or Mode) of <entity_id>
+    (a stop_id, trip_id, route_id or modetype) on self's database: the
+    same instance each time, while it is among the ENTITY_CACHE_SIZE
+    most recently used, so that what it has loaded (its shape line, stop
+    point, mode) is not queried again. <DayObj> is passed on to PTTrip,
+    which is cached per Day.
+    trip_ids and stop_ids are integers, so for PTTrip and Stop a numeric
+    <entity_id> given as a string is the same entity as its integer.
+    '''
+    if cls in (PTTrip, Stop):
+      entity_id = integerID(entity_id)
+    entities = self.getEntityCache()
+    def load():
+      if DayObj is None:
+        entity = cls(self.database, entity_id)
+      else:
+        entity = cls(self.database, entity_id, DayObj)
+      entity.entities = entities
+      return entity
+    return entities.get((cls, entity_id, None if DayObj is None else DayObj.dateInt), load)
 
   def checkTableEmpty(self, tableName="intervals"):
     '''
@@ -225,7 +375,7 @@ class Database(object):
     self.cur.execute('SELECT DISTINCT route_type_desc FROM routes')
     modes = self.cur.fetchall()
     for mode in modes:
-      modelist.append(Mode(self.database, mode[0]))
+      modelist.append(self.getEntity(Mode, mode[0]))
     return modelist
 
   def getAgencies(self):
@@ -238,25 +388,152 @@ class Database(object):
     self.cur.execute('SELECT * FROM agency')
     return self.cur.fetchall()
   
-  def populateIntervals(self, DB, DayObj=None, starti=0, endtime=datetime.time(21, 30)):
-    '''
-    Populates the intervals table of self (Database).
-    Be careful not to run this method for a database which already has
-    a populated intervals table (an Exception will be raised by this
-    method, so it's not dire).
+  def getDatabasePath(self):
+    '''
+    Returns the path (String) of the file that self (Database) is stored
+    in, or "" if it is in memory.
+    '''
+    self.cur.execute('PRAGMA database_list')
+    for database in self.cur.fetchall():
+      if database[1] == "main":
+        return database[2]
+
+  def writeIntervals(self, DayObj, tripRows, replace=True):
+    '''
+    Writes the intervals table rows of each (trip_id, rows) in <tripRows>
+    (as from PTTrip.getIntervalRows) into <DayObj>'s own intervals table
+    (intervals_YYYYMMDD, created with its indexes if need be), and
+    records each trip as done for <DayObj> in the intervals_done table,
+    in one transaction.
+    A trip's rows differ only in seconds, lat and lon, so just those are
+    bound row by row (executemany into a staging table), and the rest
+    are bound once per trip as they are copied into the table.
+    <replace> (Boolean, default=True) first deletes any rows the trips
+    already have on <DayObj>; populateIntervals(deferindexes=True) has
+    already done so, before dropping the index that this would need.
+    '''
+    table = intervalsTableName(DayObj.dateInt)
+    createIntervalsTable(self.database, table)
+    self.cur.execute('CREATE TABLE IF NOT EXISTS intervals_done(day DATETIME, trip_id INTEGER REFERENCES trips(trip_id), PRIMARY KEY (day, trip_id))')
+    self.cur.execute('CREATE TEMP TABLE IF NOT EXISTS intervals_positions(seconds INTEGER, lat FLOAT, lon FLOAT)')
+    day = DayObj.isoDate[0:10] # e.g. 2013-12-08
+    if replace:
+      self.cur.executemany('DELETE FROM %s WHERE trip_id = ?' % table, [(trip_id,) for trip_id, rows in tripRows])
+    for trip_id, rows in tripRows:
+      if len(rows) > 0:
+        self.cur.executemany('INSERT INTO intervals_positions VALUES (?, ?, ?)', [row[2:5] for row in rows])
+        self.cur.execute('INSERT INTO %s SELECT ?, ?, seconds, lat, lon, ?, ?, ?, ?, ?, ? FROM intervals_positions' % table, rows[0][0:2] + rows[0][5:])
+        self.cur.execute('DELETE FROM intervals_positions')
+    self.cur.executemany('INSERT OR REPLACE INTO intervals_done VALUES (?, ?)', [(day, trip_id) for trip_id, rows in tripRows])
+    self.database.commit()
+
+  def writeTrajectories(self, DayObj, tripRows):
+    '''
+    Writes the trajectories table rows of each (trip_id, rows) in
+    <tripRows> (as from PTTrip.getTrajectoryRows), over-writing any
+    the trip already has for <DayObj>, in one transaction.
+    '''
+    self.cur.execute('CREATE TABLE IF NOT EXISTS trajectories(day DATETIME, trip_id INTEGER REFERENCES trips(trip_id), start_second INTEGER, end_second INTEGER, route_type_desc TEXT REFERENCES routes(route_type_desc), agency_id TEXT REFERENCES agency(agency_id), route_id TEXT REFERENCES routes(route_id), shape_id TEXT REFERENCES shapes(shape_id), breakpoints BLOB, PRIMARY KEY (day, trip_id, start_second))')
+    day = DayObj.isoDate[0:10] # e.g. 2013-12-08
+    self.cur.executemany('DELETE FROM trajectories WHERE day = ? AND trip_id = ?', [(day, trip_id) for trip_id, rows in tripRows])
+    for trip_id, rows in tripRows:
+      self.cur.executemany('INSERT INTO trajectories VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [row[:-1] + (dbapi.Binary(row[-1]),) for row in rows])
+    self.database.commit()
+
+  def getTripPatterns(self, DayObj=None):
+    '''
+    Returns a dictionary of {key: [trip_id, ...]}, grouping every trip in
+    self (Database), or only those running on <DayObj>, by its trip
+    pattern (see tripPatternKey): trips along the same shape and stops
+    with the same relative times, which share one trajectory (see
+    PTTrip.getTrajectory).
+    '''
+    query = 'SELECT stop_times.trip_id, trips.shape_id, stop_id, arrival_secs, departure_secs, shape_dist_traveled FROM stop_times JOIN trips ON stop_times.trip_id = trips.trip_id'
+    if DayObj is not None:
+      query += ' WHERE stop_times.trip_id IN (SELECT trip_id FROM trip_dates WHERE date_int = %i)' % DayObj.dateInt
+    self.cur.execute(query + ' ORDER BY stop_times.trip_id, stop_sequence')
+    patterns = {}
+    for trip_id, stoptimes in itertools.groupby(self.cur.fetchall(), lambda stop: stop[0]):
+      stoptimes = list(stoptimes)
+      key, t0 = tripPatternKey(stoptimes[0][1], [stop[2:] for stop in stoptimes])
+      patterns.setdefault(key, []).append(trip_id)
+    return patterns
+
+  def getIntervalsDays(self):
+    '''
+    Returns a sorted list of datetime objects, one for each day that has
+    its own intervals table (see populateIntervals).
+    '''
+    self.cur.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name GLOB "intervals_[0-9]*"')
+    return sorted([datetime.datetime.strptime(table[0][-8:], "%Y%m%d") for table in self.cur.fetchall()])
+
+  def dropIntervals(self, DayObj):
+    '''
+    Drops <DayObj>'s intervals table, with its records in intervals_done
+    and intervals_info, so that the day can be populated afresh. Much
+    cheaper than deleting the rows of a table holding many days.
+    '''
+    day = DayObj.isoDate[0:10] # e.g. 2013-12-08
+    self.cur.execute('DROP TABLE IF EXISTS %s' % intervalsTableName(DayObj.dateInt))
+    for table in ["intervals_done", "intervals_info"]:
+      if hasTable(self.database, table):
+        self.cur.execute('DELETE FROM %s WHERE day = ?' % table, (day,))
+    self.database.commit()
+
+  def populateIntervals(self, DB, DayObj=None, starti=0, endtime=False, processes=1, chunksize=10, resume=True, notify=True, engine="numpy", deferindexes=False, store="intervals", resolution=1):
+    '''
+    Populates <DayObj>'s intervals table of self (Database),
+    intervals_YYYYMMDD, so that each day is kept side by side in its own
+    table, or with <store>="trajectories" the trajectories table: one row per trip (run)
+    holding the breakpoints of its path (PTTrip.getTrajectory) rather
+    than one row per trip per second, from which positions at any second
+    are interpolated when they are read (Day.getTrajectoryPositions).
+    Be careful not to run this method for a day which already has a
+    populated intervals table (a note is printed, so it's not dire).
     
     <DayObj>: the day to populate for.
     <starti>: the trip_id to begin with.
-    <endtime>: the IRL time to stop doing this (so the computer can be turned off)
+    <endtime>: the IRL time to stop doing this (so the computer can be turned off), or None to run to the end.
+    It is checked before any work is done, before each chunk is handed
+    out or computed, and before each is written; a chunk computed after
+    it passes is not written. By default (False), SERIAL_ENDTIME with
+    <processes>=1, as it always was, and None with worker processes.
+    <processes>: the number of worker processes that compute the trips'
+    positions, each with its own connection to the database. The trips
+    are handed out grouped by pattern (see getTripPatterns), a pattern
+    of up to <chunksize> trips in one job, so that few workers compute
+    the same pattern. With 1, they are computed
+    in this process. Either way, this process is the
+    single writer (SQLite allows only one), writing <chunksize> trips at
+    a time.
+    <resume>: every trip written is recorded in the intervals_done table
+    (or is in the trajectories table) in the same transaction as its
+    rows, so a run that is stopped (or killed) carries on from the first
+    trip not written. False drops <DayObj>'s intervals table (see
+    dropIntervals) or deletes its trajectories first, to start again.
+    <notify>: play a sound when done (needs pygame and test.wav).
+    <engine>: see PTTrip.whereIsVehicle. For the trajectories, "numpy"
+    (the default) or "continuous" (see engineTiming).
+    <deferindexes>: (intervals only) for regenerating a whole day, deletes the old rows of
+    every trip to be written up front, then drops the day's table's indexes
+    while the rows are written and rebuilds them at the end, which is
+    much faster than keeping them up to date row by row. If the run is
+    killed, the next run rebuilds them: at its start without
+    <deferindexes>, or at its end with it.
+    <resolution>: (intervals only) the seconds to write positions at:
+    every second, every <resolution> seconds, or a list of seconds (see
+    resolutionSeconds). It is recorded for <DayObj> in the intervals_info
+    table (see Day.getIntervalsResolution), so readers can align to it;
+    a resumed run must use the same resolution. The trajectories table
+    has no resolution: it gives positions at any second.
     '''
     if DayObj == None:
       raise CustomException("Need to specify a day for the intervals table to be populated.")
       ## Example: DayObj=Day(datetimeObj=datetime.datetime(2013, 12, 8))
       
-    if self.checkTableEmpty(tableName="intervals") == True:
-      ## If there ARE records in the table
-      print "Note, the intervals table is not blank."
-      
+    if store not in ["intervals", "trajectories"]:
+      raise CustomException('store must be "intervals" or "trajectories"')
+
     def durat(op=None, clock=[time.time()]):
       # Little timing function to test efficiency.
       # Source: http://code.activestate.com/recipes/578776-a-simple-timing-function/
@@ -265,30 +542,159 @@ class Database(object):
         print '%s finished. Duration %.6f seconds.' % (op, duration)
       clock[0] = time.time()
     
+    if endtime is False:
+      endtime = SERIAL_ENDTIME if processes == 1 else None
+    def pastEndtime():
+      return endtime is not None and datetime.datetime.now().time() >= endtime
+    if pastEndtime():
+      print "It is past", endtime, "- nothing done."
+      return
+
     durat() # Initiate timer
-    allTrips = DayObj.getAllTrips()
-    durat('DayObj.getAllTrips()') # How long did it take to get all trip objects for DayObj?
-    print len(allTrips), "to process."
-
-    for trip in allTrips: # For all trips on DayObj
-      current_time = datetime.datetime.now().time()
-      if trip.trip_id >= starti and current_time < endtime:
-        durat() # Re-initiate timer, once for each trip
-        processing =  "Processing Trip=%i" % trip.trip_id
-        print processing,
-        trip.whereIsVehicle(DayObj, write=True) # The actual workhorse
-        process="Trip=%s, i=%i, myPTTrip.whereIsVehicle(DayObj, write=True)" % (trip.trip_id, starti,)
-        durat(process) # How long did it take to process the record?
-        starti += 1 # Next index, in parallel with trip_id
-
-    # When done, play some noise to let me know
-    import pygame
-    pygame.init()
-    pygame.mixer.init()
-    sound = pygame.mixer.Sound("test.wav")
-    for i in range(0,5):
-      sound.play()
-      time.sleep(1)
+    allTrips = DayObj.getTripRecords()
+    durat('DayObj.getTripRecords()') # How long did it take to get all the trips of DayObj?
+
+    # Leave out the trips already done, unless starting again
+    day = DayObj.isoDate[0:10] # e.g. 2013-12-08
+    deferindexes = deferindexes and store == "intervals"
+    if store == "intervals":
+      table = intervalsTableName(DayObj.dateInt)
+      if resume == False:
+        self.dropIntervals(DayObj)
+      createIntervalsTable(self.database, table)
+      if not deferindexes:
+        # Rebuilds any indexes left dropped by a deferindexes run that was killed
+        createIndexes(self.database, tables=[table], analyze=False)
+      if self.checkTableEmpty(tableName=table) == True:
+        ## If there ARE records in the table
+        print "Note, the %s table is not blank." % table
+      self.cur.execute('CREATE TABLE IF NOT EXISTS intervals_done(day DATETIME, trip_id INTEGER REFERENCES trips(trip_id), PRIMARY KEY (day, trip_id))')
+      self.cur.execute('SELECT trip_id FROM intervals_done WHERE day = "%s"' % day)
+    else:
+      self.writeTrajectories(DayObj, []) # Creates the table if need be
+      if resume == False:
+        self.cur.execute('DELETE FROM trajectories WHERE day = "%s"' % day)
+        self.database.commit()
+      self.cur.execute('SELECT DISTINCT trip_id FROM trajectories WHERE day = "%s"' % day)
+    done = set([trip[0] for trip in self.cur.fetchall()])
+    if store == "intervals":
+      # Record the resolution, which must be that of any rows already written for <DayObj>
+      resolution = resolution if isinstance(resolution, (int, long)) else resolutionSeconds(resolution).tolist()
+      recorded = DayObj.getIntervalsResolution()
+      if len(done) > 0 and recorded != resolution:
+        raise CustomException("The intervals table for %s is at resolution %s: resume with that, or use resume=False to start again." % (day, json.dumps(recorded)))
+      resolutionSeconds(resolution) # Checks it
+      self.cur.execute('CREATE TABLE IF NOT EXISTS intervals_info(day DATETIME PRIMARY KEY, resolution TEXT)')
+      self.cur.execute('INSERT OR REPLACE INTO intervals_info VALUES (?, ?)', (day, json.dumps(resolution)))
+      self.database.commit()
+    tripids = [trip["trip_id"] for trip in allTrips if trip["trip_id"] >= starti and trip["trip_id"] not in done]
+    print len(tripids), "to process (%i already done)." % len(done)
+    if processes > 1:
+      # Each worker computes the trajectory of every pattern it meets, so
+      # a pattern of up to <chunksize> trips is kept to one job
+      todo = set(tripids)
+      groups = [[trip_id for trip_id in group if trip_id in todo] for group in self.getTripPatterns(DayObj).values()]
+      grouped = set(itertools.chain(*groups))
+      groups.append([trip_id for trip_id in tripids if trip_id not in grouped]) # Trips without stop_times
+      chunks = [[]]
+      for group in groups:
+        for i in range(0, len(group), chunksize):
+          if len(chunks[-1]) + len(group[i:i + chunksize]) > chunksize:
+            chunks.append([])
+          chunks[-1].extend(group[i:i + chunksize])
+      chunks = [chunk for chunk in chunks if len(chunk) > 0]
+    else:
+      chunks = [tripids[i:i + chunksize] for i in range(0, len(tripids), chunksize)]
+    jobs = [(DayObj.datetimeObj, chunk, engine, store, resolution) for chunk in chunks]
+
+    if deferindexes:
+      for i in range(0, len(tripids), 500): # SQLite allows up to 999 parameters
+        batch = tripids[i:i + 500]
+        self.cur.execute('DELETE FROM %s WHERE trip_id IN (%s)' % (table, ", ".join(["?"] * len(batch))), batch)
+      self.cur.execute('SELECT name FROM sqlite_master WHERE type = "index" AND tbl_name = ? AND sql IS NOT NULL', (table,))
+      for index in self.cur.fetchall():
+        self.cur.execute('DROP INDEX %s' % index[0])
+      self.database.commit()
+
+    if processes > 1:
+      if self.getDatabasePath() == "":
+        raise CustomException("Worker processes cannot open an in-memory database: use processes=1.")
+      jobqueue, resultqueue = multiprocessing.Queue(), multiprocessing.Queue(2 * processes)
+      workers = [multiprocessing.Process(target=intervalsWorker, args=(self.getDatabasePath(), self.database.text_factory, jobqueue, resultqueue)) for i in range(processes)]
+      for worker in workers:
+        worker.start()
+      pending, stopping = iter(jobs), [False]
+      def feed():
+        # Hands the workers one more job, or once there are none left (or
+        # it is past <endtime>) tells each of them to stop
+        job = None if pastEndtime() else next(pending, None)
+        if job is not None:
+          jobqueue.put(job)
+        elif not stopping[0]:
+          for worker in workers:
+            jobqueue.put(None)
+          stopping[0] = True
+      def results(running=processes):
+        # The workers' results, as they arrive, until every worker is
+        # finished, keeping each of them two jobs ahead
+        for i in range(2 * processes):
+          feed()
+        while running > 0:
+          try:
+            result = resultqueue.get(timeout=WORKERPOLL)
+          except Empty:
+            # A worker that was killed never posts its result; one that finished exits with 0
+            for worker in workers:
+              if worker.exitcode not in [None, 0]:
+                raise RuntimeError("A worker process exited with code %i without finishing." % worker.exitcode)
+            continue
+          if result is None:
+            running -= 1
+          else:
+            feed()
+            yield result
+      results = results()
+    else:
+      patterns = {} # Trip pattern trajectories, each computed once (see PTTrip.getTrajectory)
+      runDay = Day(self.database, DayObj.datetimeObj) # Its EntityCache keeps the trips and shape lines for the whole run
+      results = (getIntervalRowsOfTrips(runDay, *job[1:], patterns=patterns) for job in itertools.takewhile(lambda job: not pastEndtime(), jobs))
+
+    written = 0
+    try:
+      for result in results:
+        if isinstance(result, str):
+          raise RuntimeError("Computing intervals failed:\n%s" % result)
+        if pastEndtime():
+          break
+        if store == "intervals":
+          self.writeIntervals(DayObj, result, replace=not deferindexes) # The actual workhorse
+        else:
+          self.writeTrajectories(DayObj, result)
+        written += len(result)
+        durat("%i of %i trips" % (written, len(tripids))) # How long did it take to process the chunk?
+      if written < len(tripids) and pastEndtime():
+        print "Stopped at", endtime, "- run again to resume."
+    finally:
+      if processes > 1:
+        for worker in workers:
+          worker.terminate()
+          worker.join()
+
+    if deferindexes:
+      durat()
+      createIndexes(self.database, tables=[table], analyze=False)
+      self.cur.execute('ANALYZE %s' % table)
+      durat('Rebuilding the %s indexes' % table)
+
+    if notify:
+      # When done, play some noise to let me know
+      import pygame
+      pygame.init()
+      pygame.mixer.init()
+      sound = pygame.mixer.Sound("test.wav")
+      for i in range(0,5):
+        sound.play()
+        time.sleep(1)
 
 class Day(Database):
   '''
@@ -306,6 +712,7 @@ class Day(Database):
     self.year = self.isoDate[0:4]
     self.month = self.isoDate[5:7]
     self.day = self.isoDate[8:10]
+    self.dateInt = int(self.year + self.month + self.day) # e.g. 20131207, as in the service_dates table and trip_dates view
 
     self.dayOfWeekInt = self.datetimeObj.weekday()
     weekdayCorrespondence = {0: "monday", 1: "tuesday", 2: "wednesday", 3: "thursday", 4: "friday", 5: "saturday", 6: "sunday"}
@@ -320,6 +727,8 @@ class Day(Database):
     yesterdayObj = self.datetimeObj - datetime.timedelta(days=1)
     self.yesterdayISO = yesterdayObj.isoformat(' ')
     self.yesterdayObj = yesterdayObj
+
+    self.tripIndex = None # An IntervalIndex of the trips running on self, built by self.getTripIndex on first use
     
   def getSittingStops(self, second):
     '''
@@ -335,21 +744,12 @@ class Day(Database):
     Example <second>: datetime.time(5, 6) = 05:06am
     <dayObj> is a Day object.
     '''
-    hour, mins, secs, ssecs = str(second.hour), str(second.minute), str(second.second), str(second.microsecond)
-    if len(hour) == 1:
-      hour = "0" + hour
-    if len(mins) == 1:
-      mins = "0" + mins
-    if len(secs) == 1:
-      secs = "0" + secs
-    if len(ssecs) == 1:
-      ssecs = "00" + ssecs
-    if len(ssecs) == 2:
-      ssecs = "0" + ssecs
+    # Seconds since midnight, to compare against the integer arrival_secs and departure_secs columns
+    secs = second.hour * 3600 + second.minute * 60 + second.second
     
     shortlist, sittingstops, captured = [], [], []
-    q = Template('SELECT S.stop_lat, S.stop_lon, ST.trip_id, ST.stop_id, ST.pickup_type_text, ST.drop_off_type_text FROM stop_times_amended AS ST JOIN stops AS S ON ST.stop_id = S.stop_id WHERE arrival_time = "$second" OR departure_time = "$second" OR (arrival_time < "$second" AND departure_time > "$second")')
-    query = q.substitute(second = hour + ":" + mins + ":" + secs + "." + ssecs)
+    q = Template('SELECT S.stop_lat, S.stop_lon, ST.trip_id, ST.stop_id, ST.pickup_type_text, ST.drop_off_type_text FROM stop_times_amended AS ST JOIN stops AS S ON ST.stop_id = S.stop_id WHERE arrival_secs = $second OR departure_secs = $second OR (arrival_secs < $second AND departure_secs > $second)')
+    query = q.substitute(second = secs)
     self.cur.execute(query)
     for sittingstop in self.cur.fetchall():
       if sittingstop[2] not in captured: # Ensures unique trip_ids
@@ -358,9 +758,8 @@ class Day(Database):
         
     # Need an additional query in case a stop dwells over the midnight break; checks the old stop_times table (not stop_times_amended)
     # This advances <second> by 24 hours so that it is a post-midnight check.
-    q = Template('SELECT S.stop_lat, S.stop_lon, ST.trip_id, ST.stop_id, ST.pickup_type_text, ST.drop_off_type_text FROM stop_times AS ST JOIN stops AS S ON ST.stop_id = S.stop_id WHERE arrival_time < "$second24" AND departure_time > "$second24"')
-    second24 = str(int(hour) + 24) + ":" + mins + ":" + secs + "." + ssecs
-    query = q.substitute(second = hour + ":" + mins + ":" + secs + "." + ssecs, second24 = second24)
+    q = Template('SELECT S.stop_lat, S.stop_lon, ST.trip_id, ST.stop_id, ST.pickup_type_text, ST.drop_off_type_text FROM stop_times AS ST JOIN stops AS S ON ST.stop_id = S.stop_id WHERE arrival_secs < $second24 AND departure_secs > $second24')
+    query = q.substitute(second24 = secs + 24 * 60 * 60)
     self.cur.execute(query)
     for sittingstop in self.cur.fetchall():
       if sittingstop[2] not in captured: # Ensures unique trip_ids
@@ -368,7 +767,7 @@ class Day(Database):
         shortlist.append(sittingstop)
         
     for sittingstop in shortlist:
-      if PTTrip(self.database, str(sittingstop[2]), self).runstoday: # If the trip actually runs on the day being considered
+      if self.getEntity(PTTrip, str(sittingstop[2]), self).runstoday: # If the trip actually runs on the day being considered
         sittingstop = {"stop_lat":sittingstop[0], "stop_lon":sittingstop[1], "trip_id":sittingstop[2], "stop_id":sittingstop[3], "pickup_type_text":sittingstop[4], "drop_off_type_text":sittingstop[5]}
         sittingstops.append(sittingstop)
         
@@ -377,9 +776,13 @@ class Day(Database):
   def getCanxServices(self):
     '''
     Returns a list of PTService objects representing services that have been cancelled on self.day, as specified by the calendar_dates table.
+    These are the services that the calendar table runs on self's day of
+    the week and date range, but that are not in the service_dates table
+    (which has the calendar_dates removals applied) for self.dateInt.
     '''
-    q = Template('SELECT DISTINCT service_id FROM calendar_dates WHERE date LIKE "$date%" AND exception_type = 2')
-    query = q.substitute(date = self.isoDate[0:10])
+    weekday = WEEKDAYS[self.datetimeObj.weekday()]
+    q = Template('SELECT DISTINCT service_id FROM calendar WHERE $weekday = 1 AND CAST(strftime("%Y%m%d", start_date) AS INTEGER) <= $date AND CAST(strftime("%Y%m%d", end_date) AS INTEGER) >= $date AND service_id NOT IN (SELECT service_id FROM service_dates WHERE date_int = $date)')
+    query = q.substitute(weekday = weekday, date = self.dateInt)
     self.cur.execute(query)
 
     canxServices = []
@@ -388,6 +791,25 @@ class Day(Database):
       canxServices.append(PTService(self.database, service[0]))
     return canxServices
     
+  def getTripRecords(self):
+    '''
+    Returns a list of the trips that run on self (Day) as lightweight
+    records: dictionaries of their trip_summary rows, keyed by column
+    name (trip_id, route_id, service_id, shape_id, route_type_desc,
+    first_arrival_secs, first_departure_secs, last_departure_secs, stop_count,
+    crosses_midnight, shape_length; see PTTrip.getTripSummary).
+    All the trips are decided and read in one query, with the calendar,
+    calendar_dates and over-midnight rules already applied by the
+    trip_dates view, so nothing is asked of the database per trip.
+    Use self.getAllTrips() for PTTrip objects.
+    '''
+    # Trips of services that run today, or that ran yesterday and carried on past midnight
+    q = Template('SELECT * FROM trip_summary WHERE trip_id IN (SELECT trip_id FROM trip_dates WHERE date_int = $date)')
+    query = q.substitute(date = self.dateInt)
+    self.cur.execute(query)
+    columns = [column[0] for column in self.cur.description]
+    return [dict(zip(columns, row)) for row in self.cur.fetchall()]
+
   def getAllTrips(self):
     '''
     Given a particular DayObj (<self>), returns a list of PTTrip objects that
@@ -396,16 +818,14 @@ class Day(Database):
     Note: A trip that starts on one day and ends on the next will be
     returned in both of those days, so bear this in mind if you use this
     method to count the number of services in a day.
+    Where only the trip_ids (or trip_summary columns) are needed,
+    self.getTripRecords() is much cheaper.
     '''
-    q = Template('SELECT DISTINCT trip_id FROM stop_times_amended WHERE $daylabel = "1"')
-    query = q.substitute(daylabel = self.dayOfWeekStr)
-    self.cur.execute(query)
-    
     trips = []
-    for trip in self.cur.fetchall():
-      pttrip = PTTrip(self.database, trip[0], self)
-      if pttrip.runstoday:
-        trips.append(pttrip)
+    for record in self.getTripRecords():
+      pttrip = self.getEntity(PTTrip, record["trip_id"], self)
+      pttrip.runstoday = True # As decided by self.getTripRecords
+      trips.append(pttrip)
     return trips
 
   def getServicesDay(self, verbose=False):
@@ -418,38 +838,16 @@ class Day(Database):
     service is not meant to represent a trip.
     PTTrip.doesTripRunOn(DayObj) correctly accounts for the midnight bug
     '''
-    regularservices = []
-    q = Template('SELECT DISTINCT C.service_id FROM calendar AS C LEFT OUTER JOIN calendar_dates AS CD ON CD.service_id = C.service_id WHERE C.start_Date <= "$today1" AND C.end_date >= "$tomorrow" AND C.$DayOfWeek = 1')
-    query = q.substitute(today1 = self.isoDate[0:10], tomorrow = self.tomorrow[0:10], DayOfWeek = self.dayOfWeekStr)
-    for service in self.cur.execute(query):
-      # Ordinarily, the service operates on self (Day)
-      regularservices.append(service[0])
-      
-    # Find all removals and additions on self (Day)
-    removed, added = [], []
-    q = Template('SELECT * FROM calendar_dates WHERE date = "$date"')
-    query = q.substitute(date = str(self.isoDate) + ".000")
+    # The calendar_dates additions and removals are already applied in service_dates
+    q = Template('SELECT service_id FROM service_dates WHERE date_int = $date')
+    query = q.substitute(date = self.dateInt)
+    if verbose:
+      print query
     self.cur.execute(query)
-    for service in self.cur.fetchall():
-      if service[2] == 2:
-        # Then the service has been removed on this self (Day) as an exception to the rule
-        removed.append(service[0])
-      elif service[2] == 1:
-        # Then the service has been added on this self (Day) as an exception to the rule
-        added.append(service[0])
-      else:
-        raise Exception
-        
-    # Only keep those services that have not been removed
-    gotServices = [str(x) for x in regularservices if x not in removed]
-    
-    # Add those services that have been added
-    gotServices = list(set(gotServices + added))
+    gotServices = [str(service[0]) for service in self.cur.fetchall()]
     
     if verbose:
-      print "REGULAR SERVICES:", regularservices
-      print "REMOVED:", removed
-      print "ADDED:" , added
+      print "SERVICES:", gotServices
     
     return gotServices
 
@@ -480,12 +878,59 @@ class Day(Database):
     output_file.close()
     return None
 
-  def getActiveTrips(self, second, internalCall=False):
+  def getIntervalsTable(self):
+    '''
+    Returns the name of the table holding self's (Day's) intervals: its
+    own intervals_YYYYMMDD table (see Database.populateIntervals) or, if
+    it has none, the single intervals table of databases populated
+    before intervals were kept by day. Readers select self's rows from
+    either by day.
+    '''
+    table = intervalsTableName(self.dateInt)
+    return table if hasTable(self.database, table) else "intervals"
+
+  def getIntervalsResolution(self):
+    '''
+    Returns the resolution the intervals table was populated at for self
+    (Day), as recorded by Database.populateIntervals: an integer N for
+    every N seconds from midnight, or a list of seconds. 1 (every
+    second) if none is recorded, as for tables written before there was
+    a choice.
+    '''
+    try:
+      self.cur.execute('SELECT resolution FROM intervals_info WHERE day = ?', (self.isoDate[0:10],))
+      recorded = self.cur.fetchone()
+    except dbapi.OperationalError:
+      # No intervals_info table
+      recorded = None
+    return 1 if recorded is None else json.loads(recorded[0])
+
+  def alignToResolution(self, second, resolution=None):
+    '''
+    Returns the latest second (integer, since midnight) at or before
+    <second> (integer) that the intervals table has positions for at
+    <resolution> (default: self.getIntervalsResolution()), or None if
+    there is none.
+    '''
+    if resolution is None:
+      resolution = self.getIntervalsResolution()
+    if isinstance(resolution, (int, long)):
+      return second - second % resolution
+    samples = resolutionSeconds(resolution)
+    i = np.searchsorted(samples, second, side='right')
+    return None if i == 0 else int(samples[i - 1])
+
+  def getActiveTrips(self, second, internalCall=False, source="index"):
     '''
     Returns an integer count of the number of trips in operation during
     self at <second>.
     <second> is a datetime.time object representing the seconds after
     midnight on self.<internalCall> is used by self.countActiveTripsByMode
+    <source> is "index", to look the trips up in self.getTripIndex()
+    (which needs no intervals table), or the table to read: "intervals"
+    or "trajectories". The intervals table is read at the latest second
+    of its resolution at or before <second> (see
+    self.alignToResolution).
 
     Examples of <second>:
     4pm (exactly, to the second) = datetime.datetime.time(16)
@@ -536,15 +981,22 @@ class Day(Database):
       
     # Use newsecond to get all of the trips that operate at <second>
     newsecond = str(newsecond.hour*3600 + newsecond.minute*60 + newsecond.second)
-    query = 'SELECT DISTINCT trip_id FROM intervals WHERE seconds = "%s"' % newsecond # Dont change this without referring to self.countActiveTripsByMode first
-    self.cur.execute(query)
-    nominallyrunning = self.cur.fetchall()
+    if source == "index":
+      # The index only holds trips running on self (Day)
+      return [self.getEntity(PTTrip, str(trip), self) for trip in sorted(set(self.getTripIndex().at(int(newsecond))))]
+    elif source == "trajectories":
+      nominallyrunning = [(trip_id,) for trip_id, mode, start, end, breakpoints in self.getTrajectories(int(newsecond), int(newsecond), breakpoints=False)]
+    else:
+      newsecond = self.alignToResolution(int(newsecond))
+      query = 'SELECT DISTINCT trip_id FROM %s WHERE day = ? AND seconds = ?' % self.getIntervalsTable() # Dont change this without referring to self.countActiveTripsByMode first
+      self.cur.execute(query, (self.isoDate[0:10], newsecond))
+      nominallyrunning = self.cur.fetchall()
     
-    todaystrips = [trip.trip_id for trip in self.getAllTrips()] # Trips that are actually running on self (Day)
+    todaystrips = [trip["trip_id"] for trip in self.getTripRecords()] # Trips that are actually running on self (Day)
     testtrips = [trip_id[0] for trip_id in nominallyrunning] # Trips that have a vehicle at operation at <second> on whatever Day they run
  
     # Return trips that run at <second> AND run on self (Day), as a list of PTTrip objects
-    return [PTTrip(self.database, str(trip), self) for trip in list(set(todaystrips).intersection(set(testtrips)))]
+    return [self.getEntity(PTTrip, str(trip), self) for trip in list(set(todaystrips).intersection(set(testtrips)))]
   
   def countActiveTrips(self, second):
     '''
@@ -568,6 +1020,168 @@ class Day(Database):
     
     return mode_count
 
+  def getTripRuns(self):
+    '''
+    Returns a list of (trip_id, route_type_desc, start_second,
+    end_second), one for each run of a trip on self (Day), from its first
+    to its last departure in seconds since self's midnight, clipped to
+    the day: a trip that began yesterday and runs past midnight starts
+    at 0. A trip whose service runs yesterday and today has a run for
+    each.
+    Read in one query from the trip_dates view and trip_summary table.
+    '''
+    day = 24*60*60
+    q = Template('SELECT TD.trip_id, TS.route_type_desc, TD.service_date_int, TS.first_departure_secs, TS.last_departure_secs FROM trip_dates AS TD JOIN trip_summary AS TS ON TS.trip_id = TD.trip_id WHERE TD.date_int = $date')
+    query = q.substitute(date = self.dateInt)
+    self.cur.execute(query)
+    runs = []
+    for trip_id, mode, servicedate, first, last in self.cur.fetchall():
+      offset = 0 if servicedate == self.dateInt else day # Yesterday's trips, after midnight
+      start, end = max(first - offset, 0), min(last - offset, day - 1)
+      if start <= end:
+        runs.append((trip_id, mode, start, end))
+    return runs
+
+  def getTripIndex(self):
+    '''
+    Returns an IntervalIndex of the trip_ids of self.getTripRuns() over
+    their [start_second, end_second], for the trips active at a second
+    or in a window of self (Day). Built on first use and kept on self,
+    so later calls reuse it.
+    '''
+    if self.tripIndex is None:
+      self.tripIndex = IntervalIndex([(start, end, trip_id) for trip_id, mode, start, end in self.getTripRuns()])
+    return self.tripIndex
+
+  def getActiveTripsInWindow(self, start, end):
+    '''
+    Returns a list of PTTrip objects representing the trips in operation
+    on self (Day) at any second from <start> to <end> inclusive (integers,
+    seconds since midnight), from self.getTripIndex().
+    '''
+    return [self.getEntity(PTTrip, str(trip), self) for trip in sorted(set(self.getTripIndex().window(start, end)))]
+
+  def getActiveProfile(self, n=1):
+    '''
+    Returns (seconds, counts): a numpy array of every <n>th second of self
+    (Day) from midnight, and a dictionary of {modetype: numpy array} of
+    the number of trips of that mode in operation (between their first
+    and last departures, inclusive) at each of those seconds.
+
+    Each trip running on self is read once (see self.getTripRuns) as a
+    [start, end] run. The counts for the whole day are then swept from
+    the start and end events, so no intervals table is needed, and the
+    cost does not grow with the number of samples.
+    '''
+    day = 24*60*60
+    runs = {}
+    for trip_id, mode, start, end in self.getTripRuns():
+      runs.setdefault(mode, []).append((start, end))
+
+    seconds, counts = np.arange(0, day, n), {}
+    for mode in runs:
+      starts, ends = np.array(runs[mode], dtype=int).T
+      # +1 at each start, -1 the second after each end; the running sum is the count in operation
+      events = np.bincount(starts, minlength=day + 1) - np.bincount(ends + 1, minlength=day + 1)
+      counts[mode] = np.cumsum(events)[seconds]
+    return seconds, counts
+
+  def getTrajectories(self, start=0, end=24*60*60-1, breakpoints=True):
+    '''
+    Returns a list of (trip_id, route_type_desc, start_second, end_second,
+    breakpoints) for each run of a trip in the trajectories table on self
+    (Day) that is in operation at any second from <start> to <end>
+    (seconds since midnight). breakpoints is a numpy array of (second,
+    x, y) rows, as from PTTrip.getTrajectory, or None if <breakpoints>
+    is False (for when only the times are needed).
+    
+    Note, requires the trajectories table to have been built for self,
+    with Database.populateIntervals(store="trajectories").
+    '''
+    query = 'SELECT trip_id, route_type_desc, start_second, end_second, %s FROM trajectories WHERE day = ? AND start_second <= ? AND end_second >= ? ORDER BY trip_id, start_second' % ("breakpoints" if breakpoints else "NULL")
+    self.cur.execute(query, (self.isoDate[0:10], end, start))
+    return [(trip_id, mode, first, last, None if blob is None else np.frombuffer(blob, dtype='<f8').reshape(-1, 3)) for trip_id, mode, first, last, blob in self.cur.fetchall()]
+
+  def getTrajectoryPositions(self, seconds):
+    '''
+    Reconstructs, from the trajectories table, the position of every
+    vehicle in operation on self (Day) at each of <seconds> (integers
+    since midnight, e.g. range(0, 24*60*60, 30) for every 30 seconds).
+    Returns a list of (trip_id, seconds, lat, lon, route_type_desc)
+    tuples, as the same columns of the intervals table would give (lat
+    and lon being the projected y and x).
+    '''
+    seconds = np.unique(np.asarray(seconds, dtype=int))
+    if len(seconds) == 0:
+      return []
+    positions = []
+    for trip_id, mode, start, end, breakpoints in self.getTrajectories(seconds[0], seconds[-1]):
+      running = seconds[np.searchsorted(seconds, start):np.searchsorted(seconds, end, side='right')]
+      xs = np.interp(running, breakpoints[:, 0], breakpoints[:, 1])
+      ys = np.interp(running, breakpoints[:, 0], breakpoints[:, 2])
+      positions.extend([(trip_id, second, lat, lon, mode) for second, lat, lon in zip(running.tolist(), ys.tolist(), xs.tolist())])
+    return positions
+
+  def exportPositionCube(self, folder, source="intervals", resolution=1):
+    '''
+    Writes the positions of every vehicle on self (Day) to <folder>
+    (created if need be) as a PositionCube: the column arrays second,
+    x, y, mode (an index into the feed's modes) and trip (an index into
+    trips.npy) as .npy files, sorted by second, with offsets.npy indexing
+    the first position of each second and cube.json describing the rest.
+    <source> is "intervals" (self's intervals table, at its resolution)
+    or "trajectories" (interpolated at <resolution>, see
+    resolutionSeconds).
+    The intervals are streamed into the files as memory maps, so the
+    day is never held in memory as Python objects.
+    Returns the PositionCube.
+    '''
+    if not os.path.isdir(folder):
+      os.makedirs(folder)
+    modes = sorted([mode.modetype for mode in self.getAllModes()])
+    modecodes = dict([(mode, code) for code, mode in enumerate(modes)])
+    def column(name, dtype, length):
+      return np.lib.format.open_memmap(os.path.join(folder, name + ".npy"), mode='w+', dtype=dtype, shape=(length,))
+    if source == "intervals":
+      table = self.getIntervalsTable()
+      resolution = self.getIntervalsResolution()
+      self.cur.execute('SELECT count(*) FROM %s WHERE day = ?' % table, (self.isoDate[0:10],))
+      length = self.cur.fetchone()[0]
+      seconds, xs, ys = column("seconds", np.int32, length), column("x", np.float64, length), column("y", np.float64, length)
+      modecolumn, tripids = column("mode", np.int8, length), np.empty(length, dtype=np.int64)
+      self.cur.execute('SELECT seconds, lon, lat, route_type_desc, trip_id FROM %s WHERE day = ? ORDER BY seconds, trip_id' % table, (self.isoDate[0:10],))
+      i, rows = 0, self.cur.fetchmany(100000)
+      while len(rows) > 0:
+        second, x, y, mode, trip_id = zip(*rows)
+        seconds[i:i + len(rows)], xs[i:i + len(rows)], ys[i:i + len(rows)], tripids[i:i + len(rows)] = second, x, y, trip_id
+        modecolumn[i:i + len(rows)] = [modecodes[m] for m in mode]
+        i, rows = i + len(rows), self.cur.fetchmany(100000)
+    elif source == "trajectories":
+      samples = resolutionSeconds(resolution)
+      resolution = resolution if isinstance(resolution, (int, long)) else samples.tolist()
+      runs = []
+      for trip_id, mode, start, end, breakpoints in self.getTrajectories():
+        running = samples[np.searchsorted(samples, start):np.searchsorted(samples, end, side='right')]
+        runs.append((running, np.interp(running, breakpoints[:, 0], breakpoints[:, 1]), np.interp(running, breakpoints[:, 0], breakpoints[:, 2]), np.repeat(modecodes[mode], len(running)), np.repeat(trip_id, len(running))))
+      runs = [np.concatenate([run[c] for run in runs] or [np.array([])]) for c in range(5)]
+      order = np.argsort(runs[0], kind='mergesort')
+      length = len(order)
+      seconds, xs, ys, modecolumn = column("seconds", np.int32, length), column("x", np.float64, length), column("y", np.float64, length), column("mode", np.int8, length)
+      seconds[:], xs[:], ys[:], modecolumn[:] = runs[0][order], runs[1][order], runs[2][order], runs[3][order]
+      tripids = runs[4][order].astype(np.int64)
+    else:
+      raise CustomException('source must be "intervals" or "trajectories"')
+    trips, tripindex = np.unique(tripids, return_inverse=True)
+    column("trip", np.int32, length)[:] = tripindex
+    np.save(os.path.join(folder, "trips.npy"), trips)
+    np.save(os.path.join(folder, "offsets.npy"), np.searchsorted(seconds, np.arange(24*60*60 + 1)).astype(np.int64))
+    for memmap in [seconds, xs, ys, modecolumn]:
+      memmap.flush()
+    del seconds, xs, ys, modecolumn
+    with open(os.path.join(folder, "cube.json"), "w") as f:
+      json.dump({"day": self.isoDate[0:10], "source": source, "resolution": resolution, "modes": modes}, f)
+    return PositionCube(folder)
+
   def bokehFrequencyByMode(self, n, Show=False, name="frequency.html", pagetitle="frequency.py", graphTitle="Wellington Public Transport Services, "):
     '''
     Uses blokeh to make a HTML chart of the frequency of public transport over self (Day), at intervals of n
@@ -595,62 +1209,24 @@ class Day(Database):
       '''The value to be used when the count is 0'''
       return None
 
-    seconds = [] # The x-axis
-    total, bus, rail, ferry, cablecar = [], [], [], [], [] # The lines (y-axis values)
-
-    for sec in range(0, 24*3600, n):
-      seconds.append(sec)
-      t, addBus, addRail, addFerry, addCableCar = 0, False, False, False, False # Define values, assume absence
-      secs = datetime.timedelta(seconds=sec)
-      secs = str(secs).split(":")
-      h, m, s = int(secs[0]), int(secs[1]), int(secs[2])
-      mode_count = myDay.countActiveTripsByMode(datetime.time(h, m, s)) # Dictionary
-      for mode in mode_count: # For each mode in the city
-        if mode == 'Bus':
-          addBus = True
-          count = mode_count[mode]
-          t += incrementT(mode, count)
-          bus.append(count)
-        elif mode == 'Rail':
-          addRail = True
-          count = mode_count[mode]
-          t += incrementT(mode, count)
-          rail.append(incrementSpecial(count))
-        elif mode == 'Ferry':
-          addFerry = True
-          count = mode_count[mode]
-          t += incrementT(mode, count)
-          ferry.append(count)
-        elif mode == 'Cable Car':
-          addCableCar = True
-          count = mode_count[mode]
-          t += incrementT(mode, count)
-          cablecar.append(count)
-        else:
-          raise CustomException("You need to add another list for that modetype.")
-
+    seconds, mode_counts = self.getActiveProfile(n) # The x-axis, and the count of each mode at each second
+    for mode in mode_counts: # For each mode in the city
+      if mode not in ['Bus', 'Rail', 'Ferry', 'Cable Car']:
+        raise CustomException("You need to add another list for that modetype.")
 
-      if addBus == False:
-        bus.append(ifZeroCount())
-      if addRail == False:
-        rail.append(ifZeroCount())
-      if addFerry == False:
-        ferry.append(ifZeroCount())
-      if addCableCar == False:
-        cablecar.append(ifZeroCount())
-
-      if t > 0:
-        total.append(t)
-      else:
-        total.append(ifZeroCount())
+    # The lines (y-axis values)
+    zeros = np.zeros(len(seconds), dtype=int)
+    bus, rail, ferry, cablecar = [mode_counts.get(mode, zeros) for mode in ['Bus', 'Rail', 'Ferry', 'Cable Car']]
+    total = sum([incrementT(mode, count) for mode, count in mode_counts.items()]) + zeros
+    total, bus, rail, ferry, cablecar = [[int(count) if count > 0 else ifZeroCount() for count in line] for line in [total, bus, incrementSpecial(rail), ferry, cablecar]]
 
     bokeh.plotting.output_file(name, title=pagetitle)
     bokeh.plotting.hold()
 
-    bokeh.plotting.line(np.array(seconds), bus, color='#BA5F22', tools='pan,zoom,resize', legend="Bus")
-    bokeh.plotting.line(np.array(seconds), rail, color='#003300', tools='pan,zoom,resize', legend="Train")
-    bokeh.plotting.line(np.array(seconds), ferry, color='#0099FF', tools='pan,zoom,resize', legend="Ferry")
-    bokeh.plotting.line(np.array(seconds), cablecar, color='#FF0000', tools='pan,zoom,resize', legend="Cable Car")
+    bokeh.plotting.line(seconds, bus, color='#BA5F22', tools='pan,zoom,resize', legend="Bus")
+    bokeh.plotting.line(seconds, rail, color='#003300', tools='pan,zoom,resize', legend="Train")
+    bokeh.plotting.line(seconds, ferry, color='#0099FF', tools='pan,zoom,resize', legend="Ferry")
+    bokeh.plotting.line(seconds, cablecar, color='#FF0000', tools='pan,zoom,resize', legend="Cable Car")
 
     graphTitle = graphTitle + self.dayOfWeekStr.title() + ", " + str(self.datetimeObj.day) +"/"+ str(self.datetimeObj.month) +"/"+ str(self.datetimeObj.year)
     bokeh.plotting.curplot().title = graphTitle
@@ -660,15 +1236,18 @@ class Day(Database):
       bokeh.plotting.show()
     return None
   
-  def nvd3FrequencyByMode(self, n, name="frequency_nvd3.html", verbose=True):
+  def nvd3FrequencyByMode(self, n, name="frequency_nvd3.html", verbose=True, source="profile", cube=None):
     '''
     TODO: Fix the x axis in this chart.
     TODO: Label the axes.
     Plots frequency of the various PT modes in the city at in intervals of n seconds.
     That is, the numbers of vehicles at operation at any given n, from 0000 to 2359.
     
-    NOTE: Requires a complete interval chart, and so can only work
-    for the day that this table represents.
+    <source> is "profile" to count the trips in operation from the
+    timetable (see self.getActiveProfile); the table to read, "intervals"
+    (self's, see self.getIntervalsTable, which must be complete) or
+    "trajectories"; or "cube" to count from <cube>, a PositionCube of
+    self (see self.exportPositionCube).
     '''
     def appendmodecount(modecount, modetypestr, modetypelist):
       try:
@@ -687,13 +1266,32 @@ class Day(Database):
       Example output: {'Cable Car': {0: 0, 28800: 2, 57600: 2, 3600: 0, 82800: 0, 46800: 2, 7200: 0, 39600: 2, 64800: 2, 10800: 0, 54000: 2, 14400: 0, 36000: 2, 43200: 2, 18000: 0, 72000: 2, 32400: 2, 61200: 2, 21600: 0, 75600: 2, 50400: 2, 25200: 2, 79200: 0, 86399: 0, 68400: 2}, 'Bus': {0: 0, 28800: 269, 57600: 194, 3600: 0, 82800: 30, 46800: 129, 7200: 0, 39600: 126, 64800: 223, 10800: 0, 54000: 145, 14400: 0, 36000: 136, 43200: 124, 18000: 0, 72000: 65, 32400: 178, 61200: 240, 21600: 25, 75600: 47, 50400: 126, 25200: 145, 79200: 37, 86399: 11, 68400: 112}, 'Rail': {0: 0, 28800: 21, 57600: 20, 3600: 0, 82800: 4, 46800: 11, 7200: 0, 39600: 11, 64800: 22, 10800: 0, 54000: 10, 14400: 0, 36000: 12, 43200: 10, 18000: 2, 72000: 10, 32400: 13, 61200: 21, 21600: 10, 75600: 7, 50400: 11, 25200: 22, 79200: 4, 86399: 2, 68400: 13}, 'Ferry': {0: 0, 28800: 2, 57600: 1, 3600: 0, 82800: 0, 46800: 1, 7200: 0, 39600: 1, 64800: 2, 10800: 0, 54000: 0, 14400: 0, 36000: 1, 43200: 1, 18000: 0, 72000: 0, 32400: 2, 61200: 2, 21600: 0, 75600: 0, 50400: 0, 25200: 2, 79200: 0, 86399: 0, 68400: 2}}
 
       '''
-      query = 'SELECT route_type_desc, seconds, count(route_type_desc) FROM intervals WHERE seconds = '
-      for second in xdata:
-        query += str(second) + ' or seconds = '
-      query = query[:-13] # Strip off the 'or seconds = ' of the last entry
-      query += 'GROUP BY route_type_desc, seconds'
-      self.cur.execute(query)
-      retdata = self.cur.fetchall()
+      if source == "profile":
+        seconds, mode_counts = self.getActiveProfile()
+        retdata = [(mode, second, int(count)) for mode in mode_counts for second, count in zip(xdata, mode_counts[mode][xdata]) if count > 0]
+      elif source == "cube":
+        retdata = cube.countByMode(xdata)
+      elif source == "trajectories":
+        # Count the runs in operation at each second of xdata
+        counts, seconds = {}, np.array(sorted(xdata))
+        for trip_id, mode, start, end, breakpoints in self.getTrajectories(seconds[0], seconds[-1], breakpoints=False):
+          for second in seconds[np.searchsorted(seconds, start):np.searchsorted(seconds, end, side='right')].tolist():
+            counts[(mode, second)] = counts.get((mode, second), 0) + 1
+        retdata = [(mode, second, count) for (mode, second), count in counts.items()]
+      else:
+        # Read each second of xdata at the latest second of the intervals table's resolution
+        resolution = self.getIntervalsResolution()
+        aligned = dict([(second, self.alignToResolution(second, resolution)) for second in xdata])
+        query = 'SELECT route_type_desc, seconds, count(route_type_desc) FROM %s WHERE day = "%s" AND (seconds = ' % (self.getIntervalsTable(), self.isoDate[0:10])
+        for second in set(aligned.values()) - set([None]):
+          query += str(second) + ' or seconds = '
+        query = query[:-13] # Strip off the 'or seconds = ' of the last entry
+        query += ') GROUP BY route_type_desc, seconds'
+        self.cur.execute(query)
+        counts = {}
+        for mode, moment, count in self.cur.fetchall():
+          counts.setdefault(moment, []).append((mode, count))
+        retdata = [(mode, second, count) for second in xdata for mode, count in counts.get(aligned[second], [])]
       
       # Grab modes
       modes = []
@@ -758,7 +1356,7 @@ class Day(Database):
     output_file.write(chart.htmlcontent)
     output_file.close()
     
-  def animateDay(self, start, end, llcrnrlon, llcrnrlat, latheight, aspectratio, sourceproj=None, projected=False, targetproj=None, lat_0=None, lon_0=None, outoption="show", placetext='', skip=5, filepath='', filename='TestOut.mp4'):
+  def animateDay(self, start, end, llcrnrlon, llcrnrlat, latheight, aspectratio, sourceproj=None, projected=False, targetproj=None, lat_0=None, lon_0=None, outoption="show", placetext='', skip=5, filepath='', filename='TestOut.mp4', source="intervals", resolution=None, cube=None):
     '''
     Animates the public transport system for self day.
     
@@ -792,14 +1390,26 @@ class Day(Database):
     <outoption> = "show", "video"; controls whether the output should
     be shown interactively (show), recorded to a video file (video).
     <skip> = How many frames to skip each time (integer), e.g. 5.
+    Frames only have vehicles on seconds of the intervals table's
+    resolution (see self.getIntervalsResolution), so <skip> should be a
+    multiple of it.
+    <resolution> = with <source>="trajectories", the seconds to
+    interpolate positions at (see resolutionSeconds): by default <skip>,
+    since the seconds between frames are not drawn other than in tails.
+    <cube> = with <source>="cube", a PositionCube of self (see
+    self.exportPositionCube) to draw each frame straight from, rather
+    than reading every position into memory first.
     <filename> = if <outoption> == "video", then this controls the
     filename of the output.
     <flilpath> gives the directory it is to be stored in.
     
-    # Note, requires a complete INTERVALS table.
+    # Note, requires a complete INTERVALS table for self (see
+    # self.getIntervalsTable), or with <source>="trajectories" a
+    # trajectories table for self.
     # If this has not been built, run Database.populateIntervals()
     # first.
-    # Also note, this method is reasonably fast but is memory-intensive
+    # Also note, this method is reasonably fast but is memory-intensive,
+    # other than with <source>="cube"
     # Finally, you must install the ffmpeg video codec, unless you
     # want to contribute a routine for a different codec/s yourself...
     '''
@@ -919,28 +1529,52 @@ class Day(Database):
       
     # Prepare the actual positions to plot
     tailallowance = 15*60 # 15 minute tails
-    posdict = {'Bus': {}, 'Rail': {}, 'Ferry': {}, 'Cable Car': {}}
-    query = 'SELECT seconds, lat, lon, route_type_desc FROM intervals WHERE seconds >= "%i" AND seconds <= "%i"' % (start-tailallowance, end)
-    self.cur.execute(query)
-    answer = self.cur.fetchall()
-    for a in answer:
-      second, lat, lon, mode = a[0], a[1], a[2], a[3]
-      if second not in posdict[mode]:
-        posdict[mode][second] = ([], [])
-      posdict[mode][second][0].append(lat)
-      posdict[mode][second][1].append(lon)
-    del answer # Free a large amount of memory
-    for mode in ['Bus', 'Rail', 'Ferry', 'Cable Car']:
-      for s in range(start-tailallowance, end):
-        try:
-          lon, lat = make_GCS(posdict[mode][s][1], posdict[mode][s][0], sourceproj)
-          lon, lat = m(lon, lat) # Converts them into (potentially projected) map coordinates
-        except KeyError:
-          # Mode doesn't operate at s
-          lon, lat = [], []
-        posdict[mode][s] = (lon, lat)
-    # Thin the posdict into every n records, note the seconds
-    posindex = thin(posdict, skip)
+    if source == "cube":
+      def getPositions(mode, past, present):
+        # The map coordinates of <mode>'s vehicles from <past> up to <present>, sliced from the cube
+        seconds, xs, ys, modes, trips = cube.window(past, present - 1)
+        keep = modes == cube.getModeCode(mode)
+        if not keep.any():
+          return ([], [])
+        lon, lat = make_GCS(xs[keep], ys[keep], sourceproj)
+        return m(lon, lat)
+      posindex = [s for s in range(start-tailallowance, end) if s % skip == 0]
+    else:
+      posdict = {'Bus': {}, 'Rail': {}, 'Ferry': {}, 'Cable Car': {}}
+      if source == "trajectories":
+        samples = resolutionSeconds(skip if resolution is None else resolution)
+        answer = [position[1:] for position in self.getTrajectoryPositions(samples[(samples >= start-tailallowance) & (samples <= end)])]
+      else:
+        resolution = self.getIntervalsResolution()
+        if isinstance(resolution, (int, long)) and skip % resolution != 0:
+          print "Note, the intervals table is at a resolution of %i seconds, which <skip> (%i) is not a multiple of." % (resolution, skip)
+        query = 'SELECT seconds, lat, lon, route_type_desc FROM %s WHERE day = ? AND seconds >= ? AND seconds <= ?' % self.getIntervalsTable()
+        self.cur.execute(query, (self.isoDate[0:10], start-tailallowance, end))
+        answer = self.cur.fetchall()
+      for a in answer:
+        second, lat, lon, mode = a[0], a[1], a[2], a[3]
+        if second not in posdict[mode]:
+          posdict[mode][second] = ([], [])
+        posdict[mode][second][0].append(lat)
+        posdict[mode][second][1].append(lon)
+      del answer # Free a large amount of memory
+      for mode in ['Bus', 'Rail', 'Ferry', 'Cable Car']:
+        for s in range(start-tailallowance, end):
+          try:
+            lon, lat = make_GCS(posdict[mode][s][1], posdict[mode][s][0], sourceproj)
+            lon, lat = m(lon, lat) # Converts them into (potentially projected) map coordinates
+          except KeyError:
+            # Mode doesn't operate at s
+            lon, lat = [], []
+          posdict[mode][s] = (lon, lat)
+      # Thin the posdict into every n records, note the seconds
+      posindex = thin(posdict, skip)
+
+      def getPositions(mode, past, present):
+        # The map coordinates of <mode>'s vehicles from <past> up to <present>
+        xs = [[x for x in posdict[mode][s][0]] for s in range(past, present)]
+        ys = [[y for y in posdict[mode][s][1]] for s in range(past, present)]
+        return ([item for sublist in xs for item in sublist], [item for sublist in ys for item in sublist])
     
     def animate(i):
       # Animation function: called sequentially
@@ -956,13 +1590,7 @@ class Day(Database):
         
       # Tails
       def makeTails(past, present, mode):
-        # These will be ordered... could do some cool things with this...
-        xs = [[x for x in posdict[mode][s][0]] for s in range(past, present)]
-        ys = [[y for y in posdict[mode][s][1]] for s in range(past, present)]
-        # ...but not after they have been flattened... here
-        xs = [item for sublist in xs for item in sublist]
-        ys = [item for sublist in ys for item in sublist]
-        return (xs, ys)
+        return getPositions(mode, past, present)
       
       # Get the data for the tails
       fifteenminsago, present = max(0, sectail), secvehicle-1
@@ -979,10 +1607,10 @@ class Day(Database):
       # Current vehicle positions
       time = str(datetime.timedelta(seconds=secvehicle))
       time_text.set_text('%s' % time)
-      bus.set_data(posdict['Bus'][secvehicle][0], posdict['Bus'][secvehicle][1])
-      train.set_data(posdict['Rail'][secvehicle][0], posdict['Rail'][secvehicle][1])
-      ferry.set_data(posdict['Ferry'][secvehicle][0], posdict['Ferry'][secvehicle][1])
-      cablecar.set_data(posdict['Cable Car'][secvehicle][0], posdict['Cable Car'][secvehicle][1])
+      bus.set_data(*getPositions('Bus', secvehicle, secvehicle+1))
+      train.set_data(*getPositions('Rail', secvehicle, secvehicle+1))
+      ferry.set_data(*getPositions('Ferry', secvehicle, secvehicle+1))
+      cablecar.set_data(*getPositions('Cable Car', secvehicle, secvehicle+1))
       
       fadeoutsecs = max(0, int((end-start)/float(skip))*0.25) # 25% of duration
       if i < fadeoutsecs:
@@ -1075,7 +1703,7 @@ class Day(Database):
     cosmeticyadj = -0.002 # Drags locations down
     
     # Get all the trip ids for trips that run on self (Day)
-    validtripids = [trip.trip_id for trip in self.getAllTrips()]
+    validtripids = [trip["trip_id"] for trip in self.getTripRecords()]
     q = "SELECT trip_id, stop_id FROM stop_times ORDER BY trip_id ASC"
     self.cur.execute(q)
     # Count the number of trips that stop at each stop.
@@ -1130,7 +1758,7 @@ class Day(Database):
     xs, ys, counts = [], [], []
     for stop in stopvisits:
       count = stopvisits[stop]
-      stopobj = Stop(self.database, stop)
+      stopobj = self.getEntity(Stop, stop)
       if projected == False:
         xy = stopobj.getShapelyPoint()
       else:
@@ -1358,11 +1986,25 @@ class Route(Agency):
   '''
   def __init__(self, database, route_id):
     '''
-
+    Issues no queries: self.agency_id is looked up on first use.
     '''
     Database.__init__(self, database)
     self.route_id = route_id
-    Agency.__init__(self, self.database, self.getAgencyID())
+    Agency.__init__(self, self.database, None)
+
+  @property
+  def agency_id(self):
+    '''
+    The agency_id of the Agency that operates the route, from
+    self.getAgencyID() on first use.
+    '''
+    if self._agency_id is None:
+      self._agency_id = self.getAgencyID()
+    return self._agency_id
+
+  @agency_id.setter
+  def agency_id(self, agency_id):
+    self._agency_id = agency_id
 
   def getAgencyID(self,):
     '''
@@ -1402,7 +2044,7 @@ class Route(Agency):
     q = Template('SELECT DISTINCT T.trip_id FROM routes AS R JOIN trips AS T ON R.route_id = T.route_id WHERE R.route_id ="$route_id"')
     query = q.substitute(route_id = self.route_id)
     self.cur.execute(query)
-    alltripsonroute = [PTTrip(self.database, str(trip[0]), DayObj) for trip in self.cur.fetchall()]
+    alltripsonroute = [self.getEntity(PTTrip, str(trip[0]), DayObj) for trip in self.cur.fetchall()]
     alltripsonroutetoday = [trip for trip in alltripsonroute if trip.runstoday]
       
     return alltripsonroutetoday
@@ -1438,6 +2080,7 @@ class Route(Agency):
     self.cur.execute(query)
     return self.cur.fetchall()[0][0]
 
+  @memoized
   def getMode(self):
     '''
     Returns a Mode object representing the mode of transport for the route.
@@ -1445,7 +2088,7 @@ class Route(Agency):
     q = Template('SELECT route_type_desc FROM routes WHERE route_id = "$route_id"')
     query = q.substitute(route_id = self.route_id)
     self.cur.execute(query)
-    return Mode(self.database, self.cur.fetchall()[0][0])
+    return self.getEntity(Mode, self.cur.fetchall()[0][0])
     
 class PTTrip(Route):
   '''
@@ -1454,12 +2097,43 @@ class PTTrip(Route):
   def __init__(self, database, trip_id, today=None):
     '''
     A trip_id is database unique.
+    Issues no queries: self.route_id (and so self.agency_id) and
+    self.runstoday are looked up on first use.
     '''
     Database.__init__(self, database)
     self.trip_id = trip_id
-    Route.__init__(self, database, self.getRouteID())
-    if today != None:
-      self.runstoday = self.doesTripRunOn(today)
+    Route.__init__(self, database, None)
+    self.today = today
+    self._runstoday = None
+
+  @property
+  def route_id(self):
+    '''
+    The route_id of the trip, from self.getRouteID() on first use.
+    '''
+    if self._route_id is None:
+      self._route_id = self.getRouteID()
+    return self._route_id
+
+  @route_id.setter
+  def route_id(self, route_id):
+    self._route_id = route_id
+
+  @property
+  def runstoday(self):
+    '''
+    Whether the trip runs on the Day it was constructed with, from
+    self.doesTripRunOn(today) on first use.
+    '''
+    if self._runstoday is None:
+      if self.today is None:
+        raise AttributeError("runstoday needs the PTTrip to be constructed with a Day")
+      self._runstoday = self.doesTripRunOn(self.today)
+    return self._runstoday
+
+  @runstoday.setter
+  def runstoday(self, runstoday):
+    self._runstoday = runstoday
 
   def getRouteID(self):
     '''
@@ -1470,6 +2144,25 @@ class PTTrip(Route):
     self.cur.execute(query)
     return self.cur.fetchall()[0][0]
   
+  def getTripSummary(self):
+    '''
+    Returns the trip's row of the trip_summary table as a dictionary,
+    keyed by column name (route_id, service_id, shape_id,
+    route_type_desc, first_arrival_secs, first_departure_secs,
+    last_departure_secs, stop_count, crosses_midnight, shape_length).
+    Arrival and departure seconds count from the midnight that the trip's
+    service day began, so can exceed 86400. shape_length is in metres.
+    Returns None if the trip has no row (it has no stop_times).
+    '''
+    q = Template('SELECT * FROM trip_summary WHERE trip_id = $trip_id')
+    query = q.substitute(trip_id = self.trip_id)
+    self.cur.execute(query)
+    columns = [column[0] for column in self.cur.description]
+    row = self.cur.fetchone()
+    if row is None:
+      return None
+    return dict(zip(columns, row))
+
   def getTripStartTime(self, DayObj):
     '''
     Returns the start time of the trip,
@@ -1482,23 +2175,21 @@ class PTTrip(Route):
     list of datetime.time objects with the date and the time, using
     <DayObj> as seed.
     '''
-    if self.doesTripRunOn(DayObj):
-      q = Template('SELECT arrival_time FROM stop_times_amended WHERE trip_id = "$trip_id" ORDER BY stop_sequence ASC')
-      query = q.substitute(trip_id = self.trip_id)
-      self.cur.execute(query)
-      starttime = self.cur.fetchall()[0][0].split(":")
-      starttime[2] = starttime[2].split(".")
+    summary = self.getTripSummary()
+    if summary is not None and self.doesTripRunOn(DayObj):
+      # The arrival at the first stop, less 24h if it is after midnight (the start day is then the following day)
+      startsecs = datetime.timedelta(seconds=summary["first_arrival_secs"] % (24 * 60 * 60))
       startday = self.getTripStartDay(DayObj)
       
       if isinstance(startday, list):
         startdays, days = self.getTripStartDay(DayObj), []
         for startday in startdays:
-          starttime = startday[0].datetimeObj.combine(startday[0].datetimeObj, datetime.time(int(starttime[0]), int(starttime[1]), int(starttime[2][0]), int(starttime[2][1])))
+          starttime = startday[0].datetimeObj + startsecs
           days.append(starttime)
         return [days]
         
       elif isinstance(startday, Day):
-        starttime = startday.datetimeObj.combine(startday.datetimeObj, datetime.time(int(starttime[0]), int(starttime[1]), int(starttime[2][0]), int(starttime[2][1])))
+        starttime = startday.datetimeObj + startsecs
         return starttime
 
       else:
@@ -1518,23 +2209,21 @@ class PTTrip(Route):
     list of datetime.time objects with the date and the time, using
     <DayObj> as seed.
     '''
-    if self.doesTripRunOn(DayObj):
-      q = Template('SELECT departure_time FROM stop_times_amended WHERE trip_id = "$trip_id" ORDER BY stop_sequence ASC')
-      query = q.substitute(trip_id = self.trip_id)
-      self.cur.execute(query)
-      endtime = self.cur.fetchall()[-1][0].split(":")
-      endtime[2] = endtime[2].split(".")
+    summary = self.getTripSummary()
+    if summary is not None and self.doesTripRunOn(DayObj):
+      # The last departure, less 24h if it is after midnight (the end day is then the following day)
+      endsecs = datetime.timedelta(seconds=summary["last_departure_secs"] % (24 * 60 * 60))
       endday = self.getTripEndDay(DayObj)
       
       if isinstance(endday, list):
         enddays, days = self.getTripEndDay(DayObj), []
         for endday in enddays:
-          endtime = endday.datetimeObj.combine(endday.datetimeObj, datetime.time(int(endtime[0]), int(endtime[1]), int(endtime[2][0]), int(endtime[2][1])))
+          endtime = endday.datetimeObj + endsecs
           days.append(endday)
         return [days]
       
       elif isinstance(endday, Day):
-        endtime = endday.datetimeObj.combine(endday.datetimeObj, datetime.time(int(endtime[0]), int(endtime[1]), int(endtime[2][0]), int(endtime[2][1])))
+        endtime = endday.datetimeObj + endsecs
         # Check that end time comes after start time
         if endtime < self.getTripStartTime(DayObj):
           if verbose:
@@ -1735,10 +2424,11 @@ class PTTrip(Route):
     Returns an object of type='datetime.timedelta'. To convert this to
     seconds, use timedelta.total_seconds()
     
-    Returns None if the trip does not run on <DayObj>.
+    Returns None if the trip does not run on <DayObj>, or has no stop_times.
     '''
-    if self.doesTripRunOn(DayObj):
-      return self.getTripEndTime(DayObj) - self.getTripStartTime(DayObj)
+    summary = self.getTripSummary()
+    if summary is not None and self.doesTripRunOn(DayObj):
+      return datetime.timedelta(seconds=summary["last_departure_secs"] - summary["first_arrival_secs"])
     else:
       return None
       
@@ -1777,158 +2467,22 @@ class PTTrip(Route):
     NOTE: This check cannot be performed by simply checking if the
     PTService runs on <DayObj>, as PTServices do not account for the
     "midnight bug".
+    
+    The trip_dates view already has the calendar_dates exceptions and
+    the over-midnight rollover applied, so this is one indexed lookup.
     '''
-    def checkIfAfterMidnight(self, DayObj):
-      '''Brief interior function that checks if self actually runs beyond midnight, and therefore runs for more than one day'''
-      q = Template('SELECT min(departure_time), max(departure_time) FROM stop_times WHERE trip_id = "$trip_id"')
-      query = q.substitute(trip_id = self.trip_id)
-      self.cur.execute(query)
-      result = self.cur.fetchall()
-      start, end = result[0][0], result[0][1]
-      if int(start[0:2]) >= 24 and int(end[0:2]) >= 24:
-        # '28:00:00.000' -->> 28
-        # Then the trip ends some time after midnight, and this needs to insure that True is returned when asked if the trip runs today.
-        return (True, True)
-      elif int(start[0:2]) < 24 and int(end[0:2]) >= 24:
-        # The trip starts before midnight and finishes after it
-        return (False, True)
-      elif int(start[0:2]) >= 24 and int(end[0:2]) < 24:
-        ## return (True, False)
-        raise CustomException("How can a trip start after midnight and finish before it?")
-      else:
-        # The trip does not end with a time beyond "23:59:59.999"
-        return (False, False)
-        
-    q = Template('SELECT * FROM calendar WHERE service_id = "$service_id"')
-    serviceid = self.getService().service_id
-    query = q.substitute(service_id = serviceid)
+    q = Template('SELECT count(*) FROM trip_dates WHERE trip_id = $trip_id AND date_int = $date')
+    query = q.substitute(trip_id = self.trip_id, date = DayObj.dateInt)
     if verbose:
       print query
     self.cur.execute(query)
-    info = self.cur.fetchone()
-    Week = {"Monday": False, "Tuesday": False, "Wednesday": False, "Thursday": False, "Friday": False, "Saturday": False, "Sunday": False}
-
-    minuit = checkIfAfterMidnight(self, DayObj)
-    protectMonday, protectTuesday, protectWednesday, protectThursday, protectFriday, protectSaturday, protectSunday = False, False, False, False, False, False, False
-
-    if info[1] == 1:
-      Week["Monday"] = True
-      if minuit[1] == True:
-        Week["Tuesday"] = True
-        protectTuesday = True
-      if minuit[0] == True and protectMonday == False:
-        Week["Monday"] = False
-
-    if info[2] == 1:
-      Week["Tuesday"] = True
-      if minuit[1] == True:
-        Week["Wednesday"] = True
-        protectWednesday = True
-      if minuit[0] == True and protectTuesday == False:
-        Week["Tuesday"] = False
-
-    if info[3] == 1:
-      Week["Wednesday"] = True
-      if minuit[1] == True:
-        Week["Thursday"] = True
-        protectThursday = True
-      if minuit[0] == True and protectWednesday == False:
-        Week["Wednesday"] = False
-
-    if info[4] == 1:
-      Week["Thursday"] = True
-      if minuit[1] == True:
-        Week["Friday"] = True
-        protectFriday = True
-      if minuit[0] == True and protectThursday == False:
-        Week["Thursday"] = False
-
-    if info[5] == 1:
-      Week["Friday"] = True
-      if minuit[1] == True:
-        Week["Saturday"] = True
-        protectSaturday = True
-      if minuit[0] == True and protectFriday == False:
-        Week["Friday"] = False
-
-    if info[6] == 1:
-      Week["Saturday"] = True
-      if minuit[1] == True:
-        Week["Sunday"] = True
-        protectSunday = True
-      if minuit[0] == True and protectSaturday == False:
-        Week["Saturday"] = False
-
-    if info[7] == 1:
-      Week["Sunday"] = True
-      if minuit[1] == True:
-        Week["Monday"] = True
-        protectMonday = True
-      if minuit[0] == True and protectSunday == False:
-        Week["Sunday"] = False
-        
-    if verbose:
-      print Week
-  
-    DOW = DayObj.dayOfWeekStr.title()
-    if verbose:
-      print "The method is considering a " + DOW
-    tripdate = self.getTripStartDay(DayObj)
-    if tripdate == None:
-      return False
-    elif isinstance(tripdate, list):
-      # The trip goes over midnight
-      return True
-    elif isinstance(tripdate, Day):
-      tripdate = tripdate.isoDate + ".000"
-      
-    if Week[DOW] is True:
-      # Then the trip does run on this day of the week, but we still need to check if there's an exception
-      # for this particular date.
-      
-      # The start of the trip is either "today" (DayObj) or "yesterday" (the day before DayObj),
-      # depending on whether the trip crosses midnight.
-      # This date is the relevant one to check for exceptions.
-      try:
-        q = Template('SELECT * FROM calendar_dates WHERE service_id = "$service_id" and date = "$date"')
-        query = q.substitute(service_id = serviceid, date = tripdate)
-        if verbose:
-          print query
-        self.cur.execute(query)
-        exceptions = self.cur.fetchall()
-        for exception in exceptions:
-          excdate, exctype = exception[1], exception[3]
-          if excdate == tripdate and exctype == 'Removed':
-            # The trip normally runs on this day, but today is an exception
-            return False
-        # Once all relevant exceptions have been checked, it is confirmed that the trip does run on <DayObj>
-        return True
-      except:
-        # There are never any exceptions for this trip
-        return True
-    else:
-      # Even if the trip does not normally run on this day of the week,
-      # there may still be exceptions in the form of ADDITIONS
-      q = Template('SELECT * FROM calendar_dates WHERE service_id = "$service_id" and date = "$date"')
-      query = q.substitute(service_id = serviceid, date = tripdate)
-      if verbose:
-        print query
-      self.cur.execute(query)
-      exceptions = self.cur.fetchall()
-      for exception in exceptions:
-        excdate, exctype = exception[1], exception[3]
-        if excdate == tripdate and exctype == 'Added':
-          return True
-          
-      # Once all relevant exceptions have been checked and no additions have been found,
-      # we have confirmed that the trip does not run on <DayObj>
-      return False
+    return self.cur.fetchone()[0] > 0
 
   def getRoute(self):
     '''
     Returns the Route object that represents the path taken along PTtrip.
     '''
-    routeOfTrip = Route(self.database, self.route_id)
+    routeOfTrip = self.getEntity(Route, self.route_id)
     return routeOfTrip
 
   def getService(self):
@@ -1941,6 +2495,7 @@ class PTTrip(Route):
     PTServiceOfTrip = PTService(self.database, self.cur.fetchall()[0][0])
     return PTServiceOfTrip
 
+  @memoized
   def getShapeID(self):
     '''
     Each trip has a particular shape.
@@ -1964,6 +2519,7 @@ class PTTrip(Route):
 
     return shape_id
 
+  @sharedByShape
   def getShapelyLine(self, precise=True):
     '''
     Returns a Shapely Line object representing the trip.
@@ -1985,6 +2541,7 @@ class PTTrip(Route):
 
     return LineString(vertices)
     
+  @sharedByShape
   def getShapelyLineProjected(self, source=4326, target=2134):
     '''
     Projects self.getShapelyLine from <source> GCS to <target> PCS.
@@ -2065,18 +2622,191 @@ class PTTrip(Route):
     if verbose:
       print query
 
-    return [Stop(self.database, stop[0]) for stop in self.cur.fetchall()]
+    return [self.getEntity(Stop, stop[0]) for stop in self.cur.fetchall()]
 
-  def whereIsVehicle(self, DayObj, write=False):
+  def getTripPattern(self):
     '''
-    If self (trip) runs on <DayObj>, returns a list of tuples of integers
-    and shapely.geomoetry.Point objects representing the seconds since
-    midnight on <DayObj> and the position of the vehicle along its route
-    shape.
+    Returns (key, t0): the key of self's (trip's) pattern (see
+    tripPatternKey), which it shares with every trip along the same
+    shape and stops with the same times relative to its first
+    departure, and <t0>, the seconds of that first departure.
+    '''
+    q = Template('SELECT stop_id, arrival_secs, departure_secs, shape_dist_traveled FROM stop_times WHERE trip_id = $trip_id ORDER BY stop_sequence')
+    query = q.substitute(trip_id = self.trip_id)
+    self.cur.execute(query)
+    stoptimes = self.cur.fetchall()
+    return tripPatternKey(self.getShapeID(), stoptimes)
+
+  def getPatternTrajectory(self, key, timing="arrivals"):
+    '''
+    Returns (first, last, breakpoints), the trajectory of the trip
+    pattern <key> (see self.getTripPattern) relative to its first
+    departure: breakpoints as in self.getTrajectory, and the first and
+    last departures, all in seconds after the first departure.
+    Only the shape of self is used, so this is the same for every trip
+    of the pattern.
+    
+    The vehicle is at a stop from its arrival to its departure, at the
+    stop's shape_dist_traveled scaled to the length of the line. Between
+    stops, <timing> is:
+    "arrivals" (the default), as self.whereIsVehicleLegacy: the vehicle
+    leaves a stop at its departure, but at the even speed that covers
+    the segment in the time from its arrival at the stop to its arrival
+    at the next, so after a dwell it has not reached the next stop when
+    it arrives there, and jumps to it. The jump is made in the half
+    second before the arrival, so every whole second matches the legacy
+    engine.
+    "departures": a deviation from the legacy engine, in which the
+    vehicle moves at an even speed from its departure from one stop to
+    its arrival at the next, so its path is continuous.
+    '''
+    if timing not in ["arrivals", "departures"]:
+      raise CustomException('timing must be "arrivals" or "departures"')
+    stoptimes = np.array([stop[1:] for stop in key[1]], dtype=float)
+    arrivals, departures = stoptimes[:, 0], stoptimes[:, 1]
+    
+    # Cumulative distance along the line to each vertex, and to each stop
+    ref = LinearReference(self.getShapelyLineProjected())
+    vertexdists, linelength = ref.distances, ref.length
+    stopdists = np.minimum(stoptimes[:, 2] / stoptimes[-1, 2] * linelength, linelength)
+    
+    def moving(n, m, leave, speedtime, until):
+      '''
+      The (times, distances) of the vehicle leaving stop <n> at <leave>
+      towards stop <m>, covering the segment in <speedtime> seconds,
+      until <until>: where it passes each vertex, and where it is at
+      <until>.
+      '''
+      if stopdists[m] == stopdists[n]:
+        return [], []
+      passed = vertexdists[(vertexdists > min(stopdists[n], stopdists[m])) & (vertexdists < max(stopdists[n], stopdists[m]))]
+      if stopdists[m] < stopdists[n]:
+        passed = passed[::-1]
+      passedtimes = leave + (passed - stopdists[n]) / (stopdists[m] - stopdists[n]) * speedtime
+      reached = passedtimes < until
+      return list(passedtimes[reached]) + [until], list(passed[reached]) + [stopdists[n] + (until - leave) / speedtime * (stopdists[m] - stopdists[n])]
+    
+    # Distance along the line against time: at each stop from arrival to departure, then past each vertex on the way to the next stop
+    times, dists = [], []
+    if timing == "departures":
+      for n in range(len(stopdists)):
+        times.extend([arrivals[n], departures[n]])
+        dists.extend([stopdists[n], stopdists[n]])
+        if n + 1 < len(stopdists):
+          movingtimes, movingdists = moving(n, n + 1, departures[n], arrivals[n + 1] - departures[n], arrivals[n + 1])
+          times.extend(movingtimes[:-1]) # Less the arrival at the next stop, which is added with it
+          dists.extend(movingdists[:-1])
+    else:
+      # The vehicle is at or after the last stop arrived at (the last of any that share an arrival), as in the legacy engine
+      for n in range(len(stopdists)):
+        if n + 1 < len(stopdists) and arrivals[n + 1] == arrivals[n]:
+          continue
+        times.append(arrivals[n])
+        dists.append(stopdists[n])
+        if n + 1 == len(stopdists):
+          times.append(departures[n])
+          dists.append(stopdists[n])
+        elif departures[n] >= arrivals[n + 1]:
+          # Still at the stop when the next is arrived at
+          times.append(arrivals[n + 1] - 0.5)
+          dists.append(stopdists[n])
+        else:
+          times.append(departures[n])
+          dists.append(stopdists[n])
+          movingtimes, movingdists = moving(n, n + 1, departures[n], arrivals[n + 1] - arrivals[n], arrivals[n + 1] - 0.5)
+          times.extend(movingtimes)
+          dists.extend(movingdists)
+    times, dists = np.array(times), np.array(dists)
+    # Leave out the repeats, where there is no dwell
+    keep = np.concatenate(([True], (np.diff(times) != 0) | (np.diff(dists) != 0)))
+    times, dists = times[keep], dists[keep]
+    breakpoints = np.column_stack((times,) + ref.interpolateArray(dists))
+    return int(departures.min()), int(departures.max()), breakpoints
+
+  def getTrajectory(self, DayObj, patterns=None, timing="arrivals"):
+    '''
+    Returns the piecewise-linear path of the vehicle of self (trip) on
+    <DayObj>, along its projected route shape (self.getShapelyLineProjected),
+    as a list of (start_second, end_second, breakpoints) for each run of
+    the trip within <DayObj> (usually one; two if yesterday's run of the
+    trip carries on past midnight as well as today's).
+    start_second and end_second are the first and last seconds since
+    midnight on <DayObj> that the run is in operation (its first and last
+    departures, within <DayObj>).
+    breakpoints is a numpy array of (second, x, y) rows, at the stops'
+    arrivals and departures and where the vehicle passes each vertex of
+    the shape, so the position at any second is the linear interpolation
+    between them.
+    It is the trajectory of self's trip pattern (self.getPatternTrajectory)
+    shifted to self's first departure, with the vehicle moving between
+    stops by <timing> (see there). <patterns> is an optional dictionary
+    of {(timing, key): pattern trajectory} to look it up in, or add it
+    to, so that trips of the same pattern only compute it once.
+    
+    Returns [] if the trip does not run on <DayObj>.
+    '''
+    # The trip's seconds count from the midnight its service day began: yesterday's, if it runs past midnight into <DayObj>
+    q = Template('SELECT service_date_int FROM trip_dates WHERE trip_id = $trip_id AND date_int = $date')
+    query = q.substitute(trip_id = self.trip_id, date = DayObj.dateInt)
+    self.cur.execute(query)
+    offsets = sorted([0 if service[0] == DayObj.dateInt else -24 * 60 * 60 for service in self.cur.fetchall()])
+    if len(offsets) == 0:
+      return []
     
-    <write> (Boolean, default=False) controls whether the result is to be
-    written to the database. If the trip_id is already in the database,
-    the old trip_id is over-written with the new.
+    key, t0 = self.getTripPattern()
+    if patterns is not None and (timing, key) in patterns:
+      first, last, breakpoints = patterns[(timing, key)]
+    else:
+      first, last, breakpoints = self.getPatternTrajectory(key, timing)
+      if patterns is not None:
+        patterns[(timing, key)] = (first, last, breakpoints)
+    
+    runs = []
+    for offset in offsets:
+      start, end = max(first + t0 + offset, 0), min(last + t0 + offset, 24 * 60 * 60 - 1)
+      if start <= end:
+        runs.append((start, end, breakpoints + [t0 + offset, 0.0, 0.0]))
+    return runs
+
+  def getPositionArrays(self, DayObj, resolution=1, patterns=None, timing="arrivals"):
+    '''
+    The NumPy engine of self.whereIsVehicle(<DayObj>). Returns a tuple of
+    three numpy arrays (seconds, x, y): every second since midnight on
+    <DayObj> that the trip is running (or only those of <resolution>, see
+    resolutionSeconds), and the position of the vehicle
+    along its projected route shape (self.getShapelyLineProjected) at
+    that second, interpolated from self.getTrajectory(<DayObj>, <patterns>,
+    <timing>).
+    
+    With the default <timing>, "arrivals", the positions match the legacy
+    engine's, except that the vehicle at its last stop is at the end of
+    the line (where the legacy engine cut the line to nothing and put it
+    at the start), and a trip running past midnight into <DayObj> from
+    the day before is included as well as the same trip starting on
+    <DayObj>. <timing>="departures" (the "continuous" engine of
+    self.whereIsVehicle) deviates from it between stops after a dwell.
+    
+    The arrays are empty if the trip does not run on <DayObj>.
+    '''
+    samples = None if resolution == 1 else resolutionSeconds(resolution)
+    seconds, xs, ys = [np.array([], dtype=int)], [np.array([])], [np.array([])]
+    for start, end, breakpoints in self.getTrajectory(DayObj, patterns, timing):
+      if samples is None:
+        running = np.arange(start, end + 1)
+      else:
+        running = samples[np.searchsorted(samples, start):np.searchsorted(samples, end, side='right')]
+      seconds.append(running)
+      xs.append(np.interp(running, breakpoints[:, 0], breakpoints[:, 1]))
+      ys.append(np.interp(running, breakpoints[:, 0], breakpoints[:, 2]))
+    return np.concatenate(seconds), np.concatenate(xs), np.concatenate(ys)
+
+  def whereIsVehicleLegacy(self, DayObj):
+    '''
+    The original engine of self.whereIsVehicle(<DayObj>): for each second
+    of <DayObj>, walks the trip's stops and interpolates along segments
+    of the route shape cut at each stop. Returns a list of (second, Point)
+    tuples like the NumPy engine, but takes seconds per trip rather than
+    milliseconds; kept to check getPositionArrays against.
     '''
     def scale_factor(line, nominallength):
       '''
@@ -2090,19 +2820,10 @@ class PTTrip(Route):
     
     def cut(line, distance):
       '''
-      Cuts a line in two at a distance from its starting point.
-      Source: shapely manual, linestrings: http://toblerity.org/shapely/manual.html#linear-referencing-methods
+      Cuts a line in two at a distance from its starting point (see
+      LinearReference.cut).
       '''
-      if distance <= 0.0  or distance >= line.length:
-        return [LineString(line)]
-      coords = list(line.coords)
-      for i, p in enumerate(coords):
-        pd = line.project(Point(p))
-        if pd == distance:
-          return [LineString(coords[:i+1]), LineString(coords[i:])]
-        if pd > distance:
-          cp = line.interpolate(distance)
-          return [LineString(coords[:i] + [(cp.x, cp.y)]), LineString([(cp.x, cp.y)] + coords[i:])]
+      return LinearReference(line).cut(distance)
     
     def interpolatedposition(stop1distalong, stop1depart, stop2distalong, stop2arrive, routeshape, relativesecond):
       '''
@@ -2147,6 +2868,9 @@ class PTTrip(Route):
       an ordered list of the locations of stops given as distances along
       a line.
       '''
+      # One linear reference of the whole line, which each segment is a
+      # substring of, rather than cutting the line twice per stop
+      ref = LinearReference(line)
       segments = {}
       for n, distance in enumerate(stopdistalongs):
         # n starts at 0
@@ -2161,20 +2885,12 @@ class PTTrip(Route):
           print stopdistalongs[n], stopdistalongs[m]
           print n, m
           raise Exception
-        # Remove the head segment
-        seg = cut(line, stopdistalongs[n])
-        if len(seg) > 1:
-          seg = seg[1]
-        else:
-          seg = seg[0]
-        # Remove the tail segment
+        # Remove the head segment (none, as cut() does, if the stop is at either end of the line)
+        start = stopdistalongs[n] if 0.0 < stopdistalongs[n] < ref.length else 0.0
+        # Remove the tail segment (likewise none if it would be the whole of what is left)
         seglength = stopdistalongs[m] - stopdistalongs[n]
-        seg = cut(seg, seglength)
-        if len(seg) > 1:
-          seg = seg[0]
-        else:
-          seg = seg[0]
-        segments[n] = seg
+        end = start + seglength if 0.0 < seglength < ref.length - start else ref.length
+        segments[n] = ref.substring(start, end)
       return segments
     
     def interpolatedOnSegment(segment, stop1depart, stop2depart, relativesecond):
@@ -2215,7 +2931,7 @@ class PTTrip(Route):
     successat = None # For fewer SQL statements and the edge-case where
                      # the route doubles-back on itself.
     for n, stop in enumerate(Stop_Times):
-      stopobj = Stop(self.database, stop[3])
+      stopobj = self.getEntity(Stop, stop[3])
       stopobjs.append(stopobj)
       try:
         seen = seencount[stopobj.stop_id]
@@ -2274,35 +2990,91 @@ class PTTrip(Route):
           # Move to next [n, stop] if no match found
       else:
         pass
+    return positionlist
+
+  def whereIsVehicle(self, DayObj, write=False, engine="numpy", resolution=1):
+    '''
+    If self (trip) runs on <DayObj>, returns a list of tuples of integers
+    and shapely.geomoetry.Point objects representing the seconds since
+    midnight on <DayObj> and the position of the vehicle along its route
+    shape.
+    
+    <write> (Boolean, default=False) controls whether the result is to be
+    written to the database. If the trip_id is already in the database,
+    the old trip_id is over-written with the new.
+    
+    <engine> (String, default="numpy") chooses how the positions are
+    found: "numpy" (self.getPositionArrays), "continuous"
+    (self.getPositionArrays with timing="departures": a deviation from
+    the legacy timing between stops) or "legacy"
+    (self.whereIsVehicleLegacy).
+    
+    <resolution> (default=1) is the seconds to give positions at: every
+    second, every <resolution> seconds, or a list of seconds (see
+    resolutionSeconds).
+    '''
+    if engine in ["numpy", "continuous"]:
+      seconds, xs, ys = self.getPositionArrays(DayObj, resolution, timing=engineTiming(engine))
+      positionlist = [(int(second), Point(x, y)) for second, x, y in zip(seconds, xs, ys)]
+    elif engine == "legacy":
+      positionlist = self.whereIsVehicleLegacy(DayObj)
+      if resolution != 1:
+        samples = set(resolutionSeconds(resolution).tolist())
+        positionlist = [(second, point) for second, point in positionlist if second in samples]
+    else:
+      raise CustomException('engine must be "numpy", "continuous" or "legacy"')
     if write == False:
       # Then just return the result
       return positionlist
     elif write == True:
       # Then record the result in the database and return None
-      # 1. Check if the trip has already been recorded: if so, delete it
-      query = 'DELETE FROM intervals WHERE trip_id = %s' % (str(self.trip_id))
-      self.cur.execute(query)
-      self.database.commit
-      # 2. Add the data to the table one row at a time, then commit
-      # 2a. Get universally-applicable data
-      trip_id = self.trip_id
-      day = DayObj.isoDate[0:10] # e.g. 2013-12-08
-      route = self.getRoute()
-      route_type_desc = route.getMode().modetype
-      agency_id = self.getAgencyID()
-      route_id = route.route_id
-      shape_id = str(self.getShapeID())
-      for posi in positionlist:
-        second = posi[0]
-        lat = posi[1].y
-        lon = posi[1].x
-        ##pickup_type_text = None # For a later version
-        ##drop_off_type_text = None # For a later version
-        query = 'INSERT INTO intervals VALUES ("%i", "%s", "%i", "%f", "%f", "%s", "None", "None", "%s", "%s", "%s");' % (trip_id, day, second, lat, lon, route_type_desc, agency_id, route_id, shape_id)
-        self.cur.execute(query)
-      self.database.commit()
+      self.writeIntervals(DayObj, [(self.trip_id, self.getIntervalRows(DayObj, positionlist))])
       return None
 
+  def getIntervalRows(self, DayObj, positionlist=None, engine="numpy", resolution=1, patterns=None):
+    '''
+    Returns the rows of the intervals table for self (trip) on <DayObj>,
+    one tuple per second that it runs (of <resolution>), from
+    <positionlist> (as from self.whereIsVehicle) or, if that is None,
+    from <engine> (see self.whereIsVehicle; <patterns> as in
+    self.getTrajectory).
+    '''
+    if positionlist is None and engine in ["numpy", "continuous"]:
+      seconds, xs, ys = self.getPositionArrays(DayObj, resolution, patterns, engineTiming(engine))
+      positions = zip(seconds.tolist(), xs.tolist(), ys.tolist())
+    else:
+      if positionlist is None:
+        positionlist = self.whereIsVehicle(DayObj, engine=engine, resolution=resolution)
+      positions = [(second, point.x, point.y) for second, point in positionlist]
+    # Universally-applicable data
+    trip_id = self.trip_id
+    day = DayObj.isoDate[0:10] # e.g. 2013-12-08
+    route = self.getRoute()
+    route_type_desc = route.getMode().modetype
+    agency_id = self.getAgencyID()
+    route_id = route.route_id
+    shape_id = str(self.getShapeID())
+    ##pickup_type_text = None # For a later version
+    ##drop_off_type_text = None # For a later version
+    return [(trip_id, day, second, lat, lon, route_type_desc, None, None, agency_id, route_id, shape_id) for second, lon, lat in positions]
+
+  def getTrajectoryRows(self, DayObj, patterns=None, timing="arrivals"):
+    '''
+    Returns the rows of the trajectories table for self (trip) on
+    <DayObj>, one tuple per run of self.getTrajectory(<DayObj>,
+    <patterns>, <timing>), with
+    its breakpoints packed into a string of little-endian float64
+    (second, x, y) triples (left as a string, not a buffer, so the rows
+    can be pickled back from populateIntervals' worker processes).
+    '''
+    day = DayObj.isoDate[0:10] # e.g. 2013-12-08
+    route = self.getRoute()
+    route_type_desc = route.getMode().modetype
+    agency_id = self.getAgencyID()
+    route_id = route.route_id
+    shape_id = str(self.getShapeID())
+    return [(day, self.trip_id, start, end, route_type_desc, agency_id, route_id, shape_id, breakpoints.astype('<f8').tostring()) for start, end, breakpoints in self.getTrajectory(DayObj, patterns, timing)]
+
 class Stop(Database):
   '''
   A stop is a place where a PT vehicle stops and passengers may board
@@ -2360,6 +3132,7 @@ class Stop(Database):
     self.cur.execute
     return self.cur.fetchall()[0][0]
 
+  @memoized
   def getShapelyPoint(self):
     '''
     Returns a shapely Point object representing the location of the stop.
@@ -2372,6 +3145,7 @@ class Stop(Database):
     lat, lon = round(loc[0], 7), round(loc[1], 7)
     return Point(lon, lat) # Shapely Point object... try Point.x, Point.y, etc.
     
+  @memoized
   def getShapelyPointProjected(self, source=4326, target=2134, verbose=False):
     '''
     Returns a Shapely point representing the location of the stop,
@@ -2408,7 +3182,7 @@ class Stop(Database):
     self.cur.execute(query)
     retcount = 0
     for tripid in self.cur.fetchall():
-      if PTTrip(self.database, tripid[0], DayObj).runstoday:
+      if self.getEntity(PTTrip, tripid[0], DayObj).runstoday:
         retcount += 1
     return retcount
     
@@ -2421,39 +3195,19 @@ class Stop(Database):
     '''
     def prepare_tuple(fetchall, DayObj):
       retlist = []
+      startday = TripObj.getTripStartDay(DayObj)
       for stop in fetchall:
-        stop_time = stop
-        arrival_time, departure_time = stop_time[0], stop_time[1] # Raw strings
-        arrival_hour, arrival_min, arrival_sec, arrival_ssec = arrival_time[0:2], arrival_time[3:5], arrival_time[6:8], arrival_time[9:]
-        departure_hour, departure_min, departure_sec, departure_ssec = departure_time[0:2], departure_time[3:5], departure_time[6:8], departure_time[9:]
-        startday = TripObj.getTripStartDay(DayObj)
+        arrival_secs, departure_secs = stop[0], stop[1] # Seconds since the midnight the trip started, which go past 86400 for post-midnight times
         if isinstance(startday, Day):
-          if int(arrival_hour) < 24:
-            # Then it is not post-midnight
-            stop_arrival_datetime = startday.datetimeObj.combine(startday.datetimeObj, datetime.time(int(arrival_hour), int(arrival_min), int(arrival_sec), int(arrival_ssec)))
-          elif int(arrival_hour) >= 24:
-            # Time needs to be next day as well
-            arrival_hour = str(int(arrival_hour) - 24)
-            if len(arrival_hour) < 2:
-              arrival_hour = "0" + arrival_hour
-            nextday = DayObj.tomorrowObj
-            stop_arrival_datetime = nextday.combine(nextday, datetime.time(int(arrival_hour), int(arrival_min), int(arrival_sec), int(arrival_ssec)))
-          if int(departure_hour) < 24:
-            stop_departure_datetime = startday.datetimeObj.combine(startday.datetimeObj, datetime.time(int(departure_hour), int(departure_min), int(departure_sec), int(departure_ssec)))
-          elif int(departure_hour) >= 24:
-            departure_hour = str(int(departure_hour) - 24)
-            if len(departure_hour) < 2:
-              departure_hour = "0" + departure_hour
-            if nextday not in locals():
-              nextday = DayObj.tomorrowObj
-            stop_departure_datetime = nextday.combine(nextday, datetime.time(int(departure_hour), int(departure_min), int(departure_sec), int(departure_ssec)))
+          stop_arrival_datetime = startday.datetimeObj + datetime.timedelta(seconds=arrival_secs)
+          stop_departure_datetime = startday.datetimeObj + datetime.timedelta(seconds=departure_secs)
           retlist.append((stop_arrival_datetime, stop_departure_datetime))
       return retlist
       
     # 1. Check if trip runs on DayObj
     if TripObj.doesTripRunOn(DayObj) == True:
-      # 2. Get the raw arrival and departure times
-      q = Template('SELECT arrival_time, departure_time FROM stop_times WHERE stop_id = "$stop_id" and trip_id = "$trip_id" ORDER BY stop_sequence ASC')
+      # 2. Get the arrival and departure times, in seconds
+      q = Template('SELECT arrival_secs, departure_secs FROM stop_times WHERE stop_id = "$stop_id" and trip_id = "$trip_id" ORDER BY stop_sequence ASC')
       query = q.substitute(stop_id = self.stop_id, trip_id = TripObj.trip_id)
       self.cur.execute(query)
       stops = self.cur.fetchall()
@@ -2482,7 +3236,7 @@ class Stop(Database):
       elif projected == False:
         stoploc = self.getShapelyPoint()
         routeline = TripObj.getShapelyLine()
-      return routeline.interpolate(routeline.project(stoploc))
+      return LinearReference(routeline).snap(stoploc)
       
     elif new == False:
       # Define the line and point of interest
@@ -2579,6 +3333,350 @@ class Stop(Database):
     else:
       return None
 
+class LinearReference(object):
+  '''
+  Linear referencing along a Shapely LineString. The cumulative length
+  to each vertex is computed once, so the point at any distance along
+  the line, or the part of the line between two distances, is found by a
+  binary search of those lengths rather than by projecting every vertex
+  onto the line each time.
+  '''
+  def __init__(self, line):
+    '''
+    <line> is a Shapely LineString (or anything with .coords).
+    self.distances is a numpy array of the distance along the line to
+    each of its vertices (self.coords), and self.length the total.
+    '''
+    self.line = line
+    self.coords = np.array(line.coords)[:, 0:2]
+    self.distances = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(self.coords[:, 0]), np.diff(self.coords[:, 1])))))
+    self.length = self.distances[-1]
+
+  def interpolateArray(self, distances):
+    '''
+    Returns two numpy arrays (xs, ys) of the points at each of
+    <distances> along the line, clamped to its ends.
+    '''
+    return np.interp(distances, self.distances, self.coords[:, 0]), np.interp(distances, self.distances, self.coords[:, 1])
+
+  def interpolate(self, distance, normalized=False):
+    '''
+    Returns the Point at <distance> along the line (a fraction of its
+    length if <normalized>), as LineString.interpolate does.
+    '''
+    if normalized:
+      distance = distance * self.length
+    xs, ys = self.interpolateArray([distance])
+    return Point(xs[0], ys[0])
+
+  def substring(self, start, end):
+    '''
+    Returns the LineString of the part of the line from <start> to <end>
+    (distances along it, clamped to its ends, with <start> <= <end>): the
+    interpolated points at each, and the vertices in between.
+    '''
+    start, end = min(max(start, 0.0), self.length), min(max(end, 0.0), self.length)
+    i, j = np.searchsorted(self.distances, start, side='right'), np.searchsorted(self.distances, end, side='left')
+    xs, ys = self.interpolateArray([start, end])
+    return LineString([(xs[0], ys[0])] + [tuple(coord) for coord in self.coords[i:j]] + [(xs[1], ys[1])])
+
+  def cut(self, distance):
+    '''
+    Cuts the line in two at <distance> from its starting point, returning
+    a list of the two LineStrings, or of just the whole line if
+    <distance> is not within it.
+    After the shapely manual, linestrings: http://toblerity.org/shapely/manual.html#linear-referencing-methods
+    '''
+    if distance <= 0.0 or distance >= self.length:
+      return [LineString(self.line)]
+    return [self.substring(0.0, distance), self.substring(distance, self.length)]
+
+  def project(self, point):
+    '''
+    Returns the distance along the line of its nearest point to <point>
+    (a Shapely Point), as LineString.project does.
+    '''
+    starts, ends = self.coords[:-1], self.coords[1:]
+    seglengths = np.diff(self.distances)
+    vectors = ends - starts
+    with np.errstate(invalid='ignore', divide='ignore'):
+      u = ((point.x - starts[:, 0]) * vectors[:, 0] + (point.y - starts[:, 1]) * vectors[:, 1]) / seglengths ** 2
+    u = np.clip(np.nan_to_num(u), 0.0, 1.0)
+    gaps = np.hypot(starts[:, 0] + u * vectors[:, 0] - point.x, starts[:, 1] + u * vectors[:, 1] - point.y)
+    nearest = np.argmin(gaps)
+    return self.distances[nearest] + u[nearest] * seglengths[nearest]
+
+  def snap(self, point):
+    '''
+    Returns the Point on the line nearest to <point>.
+    '''
+    return self.interpolate(self.project(point))
+
+class PositionCube(object):
+  '''
+  A day of vehicle positions as column arrays in .npy files (written by
+  Day.exportPositionCube), opened as read-only memory maps, so that only
+  the parts used are read from disk.
+  The positions are sorted by second, and offsets[s] is the index of
+  the first position at or after second s (with offsets[86400] the
+  total), so the positions of any window of seconds are a zero-copy
+  slice of each column.
+  '''
+  # The column arrays, each a <name>.npy file
+  COLUMNS = ["seconds", "x", "y", "mode", "trip"]
+
+  def __init__(self, folder):
+    '''
+    <folder> is the folder the cube was written to by
+    Day.exportPositionCube.
+    self.modes is the list of mode names (route_type_desc) that the mode
+    column codes index, and self.trips the array of trip_ids that the
+    trip column indexes.
+    '''
+    self.folder = folder
+    with open(os.path.join(folder, "cube.json")) as f:
+      info = json.load(f)
+    self.day, self.source, self.resolution, self.modes = info["day"], info["source"], info["resolution"], info["modes"]
+    for column in self.COLUMNS + ["offsets", "trips"]:
+      setattr(self, column, np.load(os.path.join(folder, column + ".npy"), mmap_mode='r'))
+
+  def __len__(self):
+    return len(self.seconds)
+
+  def window(self, start, end):
+    '''
+    Returns (seconds, x, y, mode, trip), slices of the columns holding
+    the positions from second <start> to <end> inclusive.
+    '''
+    a, b = self.offsets[max(start, 0)], self.offsets[min(end, 24*60*60-1) + 1]
+    return tuple(getattr(self, column)[a:b] for column in self.COLUMNS)
+
+  def at(self, second):
+    '''
+    Returns (seconds, x, y, mode, trip), slices of the columns holding
+    the positions at <second>.
+    '''
+    return self.window(second, second)
+
+  def getModeCode(self, modetype):
+    '''
+    Returns the code of <modetype> (e.g. "Bus") in the mode column, or
+    -1 if the cube has no such mode.
+    '''
+    return self.modes.index(modetype) if modetype in self.modes else -1
+
+  def countByMode(self, seconds):
+    '''
+    Returns a list of (route_type_desc, second, count) for each mode in
+    operation at each of <seconds>, as the frequency charts of Day read
+    from the intervals table.
+    '''
+    counts = []
+    for second in seconds:
+      modes = np.bincount(self.at(second)[3], minlength=len(self.modes))
+      counts.extend([(self.modes[code], second, int(count)) for code, count in enumerate(modes) if count > 0])
+    return counts
+
+  def hexbin(self, start=0, end=24*60*60-1, modetype=None, **kwargs):
+    '''
+    Plots a matplotlib hexbin of the positions from second <start> to
+    <end> (of <modetype> only, if given): where vehicles spend their
+    time. <kwargs> are passed on to plt.hexbin, e.g. gridsize=100,
+    bins='log'. Returns the PolyCollection from plt.hexbin.
+    '''
+    seconds, xs, ys, modes, trips = self.window(start, end)
+    if modetype is not None:
+      keep = modes == self.getModeCode(modetype)
+      xs, ys = xs[keep], ys[keep]
+    return plt.hexbin(xs, ys, **kwargs)
+
+class IntervalIndex(object):
+  '''
+  A centred interval tree over closed [start, end] intervals, each with a
+  value (e.g. a trip_id), built once. Each node holds the intervals that
+  contain its centre, sorted by start and by end, and the intervals
+  wholly before and after it are in its left and right subtrees, so the
+  intervals containing a point, or overlapping a window, are found in
+  logarithmic time (plus the number found).
+  '''
+  def __init__(self, intervals):
+    '''
+    <intervals> is a list of (start, end, value) tuples, with start <= end.
+    '''
+    self.size = len(intervals)
+    self.root = self.build(list(intervals))
+
+  def build(self, intervals):
+    '''
+    Returns the node (centre, starts, bystart, ends, byend, left, right)
+    of <intervals>, or None if there are none.
+    '''
+    if len(intervals) == 0:
+      return None
+    endpoints = sorted([start for start, end, value in intervals] + [end for start, end, value in intervals])
+    centre = endpoints[len(endpoints) // 2]
+    left, right, here = [], [], []
+    for interval in intervals:
+      if interval[1] < centre:
+        left.append(interval)
+      elif interval[0] > centre:
+        right.append(interval)
+      else:
+        here.append(interval)
+    bystart = sorted(here, key=lambda interval: interval[0])
+    byend = sorted(here, key=lambda interval: -interval[1]) # Latest end first
+    return (centre, [interval[0] for interval in bystart], bystart, [-interval[1] for interval in byend], byend, self.build(left), self.build(right))
+
+  def __len__(self):
+    return self.size
+
+  def at(self, point):
+    '''
+    Returns a list of the values of the intervals that contain <point>.
+    '''
+    return self.window(point, point)
+
+  def window(self, start, end):
+    '''
+    Returns a list of the values of the intervals that overlap the window
+    from <start> to <end> inclusive.
+    '''
+    values, nodes = [], [self.root]
+    while len(nodes) > 0:
+      node = nodes.pop()
+      if node is None:
+        continue
+      centre, starts, bystart, ends, byend, left, right = node
+      if end < centre:
+        # Every interval here ends after the window; those starting by its end overlap it
+        values.extend([interval[2] for interval in bystart[:bisect.bisect_right(starts, end)]])
+        nodes.append(left)
+      elif start > centre:
+        # Every interval here starts before the window; those ending from its start overlap it
+        values.extend([interval[2] for interval in byend[:bisect.bisect_right(ends, -start)]])
+        nodes.append(right)
+      else:
+        # The window contains the centre, and so overlaps every interval here
+        values.extend([interval[2] for interval in bystart])
+        nodes.extend([left, right])
+    return values
+
+class EntityCache(object):
+  '''
+  A bounded identity map of entity objects (see
+  Database.getEntity), and of the shape lines they share (see
+  sharedByShape): one instance per key, evicting the least recently
+  used once it holds more than <size>.
+  '''
+  def __init__(self, size=ENTITY_CACHE_SIZE):
+    self.size = size
+    self.entities = collections.OrderedDict() # Least recently used first
+    self.hits, self.misses = 0, 0
+
+  def __len__(self):
+    return len(self.entities)
+
+  def get(self, key, load):
+    '''
+    Returns the object kept for <key>, or calls <load>() for it and keeps
+    that, making it the most recently used.
+    '''
+    try:
+      entity = self.entities.pop(key)
+      self.hits += 1
+    except KeyError:
+      entity = load()
+      self.misses += 1
+    self.entities[key] = entity
+    if len(self.entities) > self.size:
+      self.entities.popitem(last=False)
+    return entity
+
+  def clear(self):
+    '''
+    Forgets every object kept.
+    '''
+    self.entities.clear()
+
+def resolutionSeconds(resolution=1):
+  '''
+  Returns a sorted numpy array of the seconds since midnight that
+  positions are given at for <resolution>: an integer N for every N
+  seconds from midnight (so 1 is every second), or a list of seconds.
+  '''
+  if isinstance(resolution, (int, long)):
+    if resolution < 1:
+      raise CustomException("resolution must be at least 1 second")
+    return np.arange(0, 24 * 60 * 60, resolution)
+  seconds = np.unique(np.asarray(resolution, dtype=int))
+  if len(seconds) == 0 or seconds[0] < 0 or seconds[-1] >= 24 * 60 * 60:
+    raise CustomException("resolution must be an integer, or a list of seconds from 0 to 86399")
+  return seconds
+
+def tripPatternKey(shape_id, stoptimes):
+  '''
+  Returns (key, t0) for a trip along the shape <shape_id> with
+  <stoptimes>, a list of its (stop_id, arrival_secs, departure_secs,
+  shape_dist_traveled) in stop_sequence order. t0 is the departure from
+  the first stop, and key is hashable and the same for every trip of
+  the same pattern: along the same shape and stops, with the same times
+  relative to t0.
+  '''
+  t0 = stoptimes[0][2]
+  return (str(shape_id), tuple([(stop_id, arrival - t0, departure - t0, dist) for stop_id, arrival, departure, dist in stoptimes])), t0
+
+def engineTiming(engine):
+  '''
+  Returns the timing (see PTTrip.getPatternTrajectory) of the trajectory
+  engine <engine>: "departures" for "continuous", otherwise "arrivals".
+  '''
+  return "departures" if engine == "continuous" else "arrivals"
+
+def getIntervalRowsOfTrips(DayObj, trip_ids, engine="numpy", store="intervals", resolution=1, patterns=None):
+  '''
+  Returns a list of (trip_id, rows), the intervals table rows of each
+  trip in <trip_ids> on <DayObj> (a Day) at <resolution> (see
+  PTTrip.getIntervalRows), or with <store>="trajectories" its
+  trajectories table rows (see PTTrip.getTrajectoryRows), read from
+  <DayObj>'s database.
+  The trips are made by DayObj.getEntity, so pass the same Day from one
+  call to the next for them (and their shape lines) to be loaded once.
+  <patterns> is a dictionary of trip pattern trajectories, likewise kept
+  from one call to the next so that each pattern is only computed once
+  (see PTTrip.getTrajectory).
+  '''
+  if store == "trajectories":
+    return [(trip_id, DayObj.getEntity(PTTrip, trip_id).getTrajectoryRows(DayObj, patterns, engineTiming(engine))) for trip_id in trip_ids]
+  return [(trip_id, DayObj.getEntity(PTTrip, trip_id).getIntervalRows(DayObj, engine=engine, resolution=resolution, patterns=patterns)) for trip_id in trip_ids]
+
+def intervalsWorker(dbPath, text_factory, jobqueue, resultqueue):
+  '''
+  Body of each worker process of Database.populateIntervals(), with its
+  own connection to the database at <dbPath>.
+  Takes (datetimeObj, trip_ids, engine, store, resolution) jobs off
+  <jobqueue> until it gets None, and puts the result of
+  getIntervalRowsOfTrips for each on <resultqueue>, then None. If a job
+  fails, puts the traceback string instead, so that the writer can stop
+  and report it. Each worker keeps one Day per date, all sharing one
+  EntityCache, and one dictionary of trip patterns for all its jobs, so
+  that trips, shape lines and patterns are loaded or computed once per
+  worker.
+  '''
+  database = dbapi.connect(dbPath)
+  database.text_factory = text_factory
+  days, patterns, entities = {}, {}, EntityCache()
+  try:
+    job = jobqueue.get()
+    while job is not None:
+      if job[0] not in days:
+        days[job[0]] = Day(database, job[0])
+        days[job[0]].entities = entities
+      resultqueue.put(getIntervalRowsOfTrips(days[job[0]], *job[1:], patterns=patterns))
+      job = jobqueue.get()
+    resultqueue.put(None)
+  except:
+    resultqueue.put(traceback.format_exc())
+
 if __name__ == '__main__':
   ################################################################################
   ########################## Testing Section #####################################
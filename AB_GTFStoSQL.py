@@ -76,6 +76,8 @@
 ## drop_off_type INTEGER
 ## drop_off_type_text TEXT
 ## shape_dist_traveled FLOAT
+## arrival_secs INTEGER (seconds since the midnight the trip's service day began, so can exceed 86400)
+## departure_secs INTEGER
 
 #stop_times_amended
 ## trip_id INTEGER REFERENCES trips(trip_id)
@@ -96,6 +98,17 @@
 ## drop_off_type INTEGER
 ## drop_off_type_text TEXT
 ## shape_dist_traveled FLOAT
+## arrival_secs INTEGER (seconds since midnight, always below 86400)
+## departure_secs INTEGER
+
+#stop_times_midnight_dwell
+## trip_id INTEGER REFERENCES trips(trip_id)
+## service_id INTEGER REFERENCES trips(service_id)
+## stop_id INTEGER REFERENCES stops(stop_id)
+## stop_sequence INTEGER
+## arrival_time DATETIME
+## departure_time DATETIME
+## problem TEXT
 
 # stops
 ## stop_id INTEGER
@@ -146,7 +159,39 @@
 ## wheelchair_accessible_text TEXT
 
 #
-# intervals
+# trip_summary (one row per trip, derived from the tables above by populateTripSummary)
+## trip_id INTEGER PRIMARY KEY
+## route_id TEXT REFERENCES routes(route_id)
+## service_id INTEGER REFERENCES trips(service_id)
+## shape_id TEXT REFERENCES shapes(shape_id)
+## route_type_desc TEXT REFERENCES routes(route_type_desc)
+## first_arrival_secs INTEGER (as stop_times.arrival_secs)
+## first_departure_secs INTEGER (as stop_times.departure_secs)
+## last_departure_secs INTEGER
+## stop_count INTEGER
+## crosses_midnight INTEGER (1 if the trip is still running at or after 24:00:00, else 0)
+## shape_length FLOAT (metres, great-circle along the shape's vertices)
+
+#
+# service_dates (one row per date each service runs, calendar_dates applied; derived by populateServiceDates)
+## service_id INTEGER REFERENCES trips(service_id)
+## date_int INTEGER (YYYYMMDD)
+## next_date_int INTEGER (YYYYMMDD of the following day, for trips that run past midnight)
+#
+# trip_dates (VIEW of service_dates and trip_summary: the dates each trip is running on, including the day after for trips that run past midnight)
+## trip_id INTEGER REFERENCES trips(trip_id)
+## date_int INTEGER (YYYYMMDD)
+## service_date_int INTEGER (YYYYMMDD of the service day the trip belongs to)
+
+#
+# feed_metadata (one row per source file, written by recordFeedHashes for updateDatabase)
+## filename TEXT PRIMARY KEY
+## tablename TEXT
+## sha1 TEXT (hex digest of the file's contents)
+## loaded DATETIME
+
+#
+# intervals (and intervals_YYYYMMDD, one table per day with the same columns, created by AB_Class's Database.populateIntervals)
 ## trip_id INTEGER REFERENCES trips(trip_id)
 ## day DATETIME
 ## seconds INTEGER
@@ -158,11 +203,32 @@
 ## agency_id TEXT REFERENCES agency(agency_id)
 ## route_id TEXT REFERENCES routes(route_id)
 ## shape_id TEXT REFERENCES shapes(shape_id)
+#
+# intervals_done (one row per trip written to intervals, so that AB_Class's Database.populateIntervals can resume)
+## day DATETIME
+## trip_id INTEGER REFERENCES trips(trip_id)
+## PRIMARY KEY (day, trip_id)
+#
+# intervals_info (the resolution each day of intervals was written at by AB_Class's Database.populateIntervals)
+## day DATETIME PRIMARY KEY
+## resolution TEXT (JSON: an integer N for every N seconds from midnight, or a list of seconds)
+#
+# trajectories (one row per run of a trip on a day: the alternative to intervals written by AB_Class's Database.populateIntervals(store="trajectories"))
+## day DATETIME
+## trip_id INTEGER REFERENCES trips(trip_id)
+## start_second INTEGER
+## end_second INTEGER
+## route_type_desc TEXT REFERENCES routes(route_type_desc)
+## agency_id TEXT REFERENCES agency(agency_id)
+## route_id TEXT REFERENCES routes(route_id)
+## shape_id TEXT REFERENCES shapes(shape_id)
+## breakpoints BLOB (little-endian float64 (second, x, y) rows, between which the position is linear)
+## PRIMARY KEY (day, trip_id, start_second)
 
 #
 # Author:        Richard Law.
 #
-# Inputs:        Folders of .txt files downloaded from http://www.gtfs-data-exchange.com/agencies.
+# Inputs:        Folders or .zip archives of .txt files downloaded from http://www.gtfs-data-exchange.com/agencies.
 #
 # Created:            20131104
 # Last Updated:       20131207
@@ -179,6 +245,97 @@ There is NO NEED to run this script if you possess the most recent version of th
 Strings are stored as unicode, so 'tricky' characters in the CSV (as in the o-circumflex in Co^te d'Ivoire) are print-ed with the appropriate non-English characters, if this is appropriate at any point.
 """
 
+import io
+import os
+import csv
+import time
+import codecs
+import hashlib
+import datetime
+import zipfile
+import traceback
+import multiprocessing
+
+# Use SQLlite3 as the database application progamming interface
+import sqlite3 as dbapi
+
+from string import Template
+
+# Used for batching rows into executemany()
+from itertools import islice
+
+# Used for picking the wanted columns out of each CSV record
+from operator import itemgetter
+
+# Used for shape lengths
+from itertools import groupby
+from math import radians, sin, cos, asin, sqrt
+
+# Used for noticing worker processes that die without reporting back
+from Queue import Empty
+
+# Number of rows handed to each executemany() call by insertRows()
+BATCHSIZE = 10000
+
+# Read buffer, in bytes, for members streamed out of a .zip feed by openGTFSFile()
+ZIPBUFFER = 1024 * 1024
+
+# Parsed batches each parse worker of populateParallel() may have waiting on the queue
+QUEUEDEPTH = 4
+
+# Seconds a single writer waits on its workers' queue before checking that they are still alive
+WORKERPOLL = 5
+
+# Mean radius of the Earth, in metres, for shape lengths
+EARTHRADIUS = 6371008.8
+
+# The GTFS file each table is parsed from
+SOURCES = [("routes", "routes.txt"), ("agency", "agency.txt"), ("calendar", "calendar.txt"), ("calendar_dates", "calendar_dates.txt"), ("trips", "trips.txt"), ("shapes", "shapes.txt"), ("feed_info", "feed_info.txt"), ("stops", "stops.txt"), ("stop_times", "stop_times.txt")]
+
+# The tables derived from other tables, in the order they are derived, as (table, the tables it is derived from)
+DERIVED = [
+  ("stop_times_amended", ["stop_times", "trips", "calendar"]), # populateStopTimesAmended
+  ("trip_summary", ["routes", "trips", "shapes", "stop_times"]), # populateTripSummary
+  ("service_dates", ["calendar", "calendar_dates"]), # populateServiceDates
+  ]
+
+# The tables that the vehicle positions of AB_Class.py (the intervals tables, and their intervals_done
+# and intervals_info records, and the trajectories table) are worked out from, and go stale with
+POSITIONS_SOURCES = ["routes", "calendar", "calendar_dates", "trips", "shapes", "stop_times"]
+
+# Indexes built by createIndexes(), as (index name, table, columns).
+# Each matches the WHERE/ORDER BY of the AB_Class methods named beside it.
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+INDEXES = [
+  ("idx_agency_agency_id", "agency", "agency_id"), # Agency.getAgencyName
+  ("idx_routes_route_id", "routes", "route_id"), # Route.getAgencyID, Route.getMode, Route.getShortName
+  ("idx_routes_agency_id", "routes", "agency_id"), # Agency.getRoutes_Agency
+  ("idx_routes_route_type_desc", "routes", "route_type_desc"), # Mode.getRoutesOfMode, Mode.getAgencies
+  ("idx_trips_trip_id", "trips", "trip_id"), # PTTrip.getRouteID, PTTrip.getService, PTTrip.getShapeID
+  ("idx_trips_route_id", "trips", "route_id"), # Route.getTripsInDayOnRoute, Agency.getServices
+  ("idx_trips_service_id", "trips", "service_id"), # PTService.getRoutes_PTService
+  ("idx_calendar_service_id", "calendar", "service_id"), # PTTrip.doesTripRunOn
+  ("idx_calendar_dates_service_id_date", "calendar_dates", "service_id, date"), # PTTrip.doesTripRunOn
+  ("idx_calendar_dates_date", "calendar_dates", "date"), # Day.getServicesDay, Day.getCanxServices
+  ("idx_shapes_shape_id_sequence", "shapes", "shape_id, shape_pt_sequence"), # PTTrip.getShapelyLine
+  ("idx_stops_stop_id", "stops", "stop_id"), # Stop.getShapelyPoint and the other Stop.get* methods
+  ("idx_stop_times_trip_id_sequence", "stop_times", "trip_id, stop_sequence"), # PTTrip.getStopsInSequence, PTTrip.whereIsVehicle, Stop.getGivenDistanceAlong
+  ("idx_stop_times_stop_id_trip_id", "stop_times", "stop_id, trip_id"), # Stop.getStopTime, Stop.countVisitsInDay
+  ("idx_stop_times_arrival_secs", "stop_times", "arrival_secs"), # Day.getSittingStops (dwells over midnight)
+  ("idx_stop_times_amended_trip_id_sequence", "stop_times_amended", "trip_id, stop_sequence"), # PTTrip.getTripStartTime, PTTrip.getTripStartDay
+  ("idx_stop_times_amended_arrival_secs", "stop_times_amended", "arrival_secs"), # Day.getSittingStops
+  ("idx_stop_times_amended_departure_secs", "stop_times_amended", "departure_secs"), # Day.getSittingStops
+  ("idx_trip_summary_service_id", "trip_summary", "service_id"), # Day.getAllTrips
+  ("idx_trip_summary_route_id", "trip_summary", "route_id"),
+  ("idx_service_dates_date_int", "service_dates", "date_int, service_id"), # Day.getServicesDay, trip_dates (PTTrip.doesTripRunOn, DTI_GTFSGraph.buildSubsetGraph)
+  ("idx_service_dates_next_date_int", "service_dates", "next_date_int, service_id"), # trip_dates, for trips that run past midnight
+  ("idx_intervals_seconds", "intervals", "seconds"), # Day.getActiveTrips, Day.animateDay
+  ("idx_intervals_trip_id", "intervals", "trip_id"), # PTTrip.whereIsVehicle
+  ] + [("idx_stop_times_amended_%s_trip_id" % day, "stop_times_amended", "%s, trip_id" % day) for day in WEEKDAYS] # Day.getAllTrips
+
+# The columns of the intervals table, and of each day's intervals_YYYYMMDD table
+INTERVALS_COLUMNS = "trip_id INTEGER REFERENCES trips(trip_id), day DATETIME, seconds INTEGER, lat FLOAT, lon FLOAT, route_type_desc TEXT REFERENCES routes(route_type_desc), pickup_type_text TEXT REFERENCES stop_times(pickup_type_text), drop_off_type_text TEXT REFERENCES stop_times(drop_off_type_text), agency_id TEXT REFERENCES agency(agency_id), route_id TEXT REFERENCES routes(route_id), shape_id TEXT REFERENCES shapes(shape_id)"
+
 ################################################################################
 ############################# Functions ########################################
 ################################################################################
@@ -219,7 +376,7 @@ def createGTSFtoSQL_database(DBName_str):
   cur.execute('CREATE TABLE shapes(shape_id TEXT, shape_pt_lat FLOAT, shape_pt_lon FLOAT, shape_pt_sequence INTEGER, shape_dist_traveled INTEGER)')
 
   # Add a stop_times table
-  cur.execute('CREATE TABLE stop_times(trip_id INTEGER REFERENCES trips(trip_id), arrival_time DATETIME, departure_time DATETIME, stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, stop_headsign TEXT, pickup_type INTEGER, pickup_type_text TEXT, drop_off_type INTEGER, drop_off_type_text TEXT, shape_dist_traveled FLOAT)')
+  cur.execute('CREATE TABLE stop_times(trip_id INTEGER REFERENCES trips(trip_id), arrival_time DATETIME, departure_time DATETIME, stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, stop_headsign TEXT, pickup_type INTEGER, pickup_type_text TEXT, drop_off_type INTEGER, drop_off_type_text TEXT, shape_dist_traveled FLOAT, arrival_secs INTEGER, departure_secs INTEGER)')
 
   # Add a stops table
   cur.execute('CREATE TABLE stops(stop_id INTEGER, stop_code INTEGER, stop_name TEXT, stop_desc TEXT, stop_lat FLOAT, stop_lon FLOAT, zone_id TEXT, stop_url TEXT, location_type INTEGER, location_type_text TEXT, parent_station INTEGER, stop_timezone TEXT, wheelchair_boarding INTEGER, wheelchair_boarding_text TEXT)')
@@ -228,19 +385,102 @@ def createGTSFtoSQL_database(DBName_str):
   cur.execute('CREATE TABLE trips(route_id TEXT REFERENCES routes, service_id INTEGER, trip_id INTEGER, trip_headsign TEXT, trip_short_name TEXT, direction_id INTEGER, direction_id_text TEXT, block_id INTEGER, shape_id TEXT REFERENCES shapes(shape_id), wheelchair_accessible INTEGER, wheelchair_accessible_text TEXT)')
 
   # Add an intervals table
-  cur.execute('CREATE TABLE intervals(trip_id INTEGER REFERENCES trips(trip_id), day DATETIME, seconds INTEGER, lat FLOAT, lon FLOAT, route_type_desc TEXT REFERENCES routes(route_type_desc), pickup_type_text TEXT REFERENCES stop_times(pickup_type_text), drop_off_type_text TEXT REFERENCES stop_times(drop_off_type_text), agency_id TEXT REFERENCES agency(agency_id), route_id TEXT REFERENCES routes(route_id), shape_id TEXT REFERENCES shapes(shape_id))')
+  cur.execute('CREATE TABLE intervals(%s)' % INTERVALS_COLUMNS)
+
+  # Add a table of the trips written to intervals, for resuming Database.populateIntervals (AB_Class.py)
+  cur.execute('CREATE TABLE intervals_done(day DATETIME, trip_id INTEGER REFERENCES trips(trip_id), PRIMARY KEY (day, trip_id))')
+
+  # Add a table of the resolution of each day of intervals
+  cur.execute('CREATE TABLE intervals_info(day DATETIME PRIMARY KEY, resolution TEXT)')
+
+  # Add a trajectories table, the piecewise-linear alternative to intervals
+  cur.execute('CREATE TABLE trajectories(day DATETIME, trip_id INTEGER REFERENCES trips(trip_id), start_second INTEGER, end_second INTEGER, route_type_desc TEXT REFERENCES routes(route_type_desc), agency_id TEXT REFERENCES agency(agency_id), route_id TEXT REFERENCES routes(route_id), shape_id TEXT REFERENCES shapes(shape_id), breakpoints BLOB, PRIMARY KEY (day, trip_id, start_second))')
 
   # Add a stop_times_amended table that doesn't store time beyond 23:59:59.999 like the GTFS does
-  cur.execute('CREATE TABLE stop_times_amended(trip_id INTEGER REFERENCES trips(trip_id), service_id INTEGER REFERENCES trips(service_id), arrival_time DATETIME, departure_time DATETIME, monday INTEGER, tuesday INTEGER, wednesday INTEGER, thursday INTEGER, friday INTEGER, saturday INTEGER, sunday INTEGER, stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, stop_headsign TEXT, pickup_type INTEGER, pickup_type_text TEXT, drop_off_type INTEGER, drop_off_type_text TEXT, shape_dist_traveled FLOAT)')
+  cur.execute('CREATE TABLE stop_times_amended(trip_id INTEGER REFERENCES trips(trip_id), service_id INTEGER REFERENCES trips(service_id), arrival_time DATETIME, departure_time DATETIME, monday INTEGER, tuesday INTEGER, wednesday INTEGER, thursday INTEGER, friday INTEGER, saturday INTEGER, sunday INTEGER, stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, stop_headsign TEXT, pickup_type INTEGER, pickup_type_text TEXT, drop_off_type INTEGER, drop_off_type_text TEXT, shape_dist_traveled FLOAT, arrival_secs INTEGER, departure_secs INTEGER)')
+
+  # Add a table of the stop_times rows whose dwell spans midnight, reported by populateStopTimesAmended
+  cur.execute('CREATE TABLE stop_times_midnight_dwell(trip_id INTEGER REFERENCES trips(trip_id), service_id INTEGER REFERENCES trips(service_id), stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, arrival_time DATETIME, departure_time DATETIME, problem TEXT)')
+
+  # Add a trip_summary table, one row per trip, filled by populateTripSummary
+  cur.execute('CREATE TABLE trip_summary(trip_id INTEGER PRIMARY KEY, route_id TEXT REFERENCES routes(route_id), service_id INTEGER REFERENCES trips(service_id), shape_id TEXT REFERENCES shapes(shape_id), route_type_desc TEXT REFERENCES routes(route_type_desc), first_arrival_secs INTEGER, first_departure_secs INTEGER, last_departure_secs INTEGER, stop_count INTEGER, crosses_midnight INTEGER, shape_length FLOAT)')
+
+  # Add a feed_metadata table of source file hashes, for updating the database from a later feed
+  cur.execute('CREATE TABLE feed_metadata(filename TEXT PRIMARY KEY, tablename TEXT, sha1 TEXT, loaded DATETIME)')
+
+  # Add a service_dates table, filled by populateServiceDates, and the trip_dates view over it
+  cur.execute('CREATE TABLE service_dates(service_id INTEGER, date_int INTEGER, next_date_int INTEGER)')
+  cur.execute('CREATE VIEW trip_dates AS SELECT TS.trip_id AS trip_id, SD.date_int AS date_int, SD.date_int AS service_date_int FROM service_dates AS SD JOIN trip_summary AS TS ON TS.service_id = SD.service_id WHERE TS.first_departure_secs < 86400 UNION ALL SELECT TS.trip_id AS trip_id, SD.next_date_int AS date_int, SD.date_int AS service_date_int FROM service_dates AS SD JOIN trip_summary AS TS ON TS.service_id = SD.service_id WHERE TS.crosses_midnight = 1')
 
   GTFSDB.commit()
 
   return GTFSDB
 
-def populateRoutes(GTFSLocation, database):
+class ZipMemberReader(io.BufferedReader):
+  '''
+  A buffered reader of the member <name> of the open zipfile.ZipFile
+  <archive>, which closes the archive as well when it is closed (see
+  openGTFSFile()).
+  '''
+  def __init__(self, archive, name):
+    io.BufferedReader.__init__(self, archive.open(name), ZIPBUFFER)
+    self.archive = archive
+
+  def close(self):
+    try:
+      io.BufferedReader.close(self)
+    finally:
+      self.archive.close()
+
+def openGTFSFile(GTFSLocation, filename):
+  '''
+  Opens <filename> (e.g. "stops.txt") of the GTFS feed at <GTFSLocation> for reading, and returns the file object.
+  <GTFSLocation> is either a directory containing the feed's .txt files (with or without a trailing slash), or the path to the feed's .zip archive.
+  Members of an archive are streamed straight out of it, without extracting anything to disk. Members are matched on their base name, so archives that wrap the .txt files in a folder also work. Closing the file object also closes the archive.
+  '''
+  if zipfile.is_zipfile(GTFSLocation):
+    archive = zipfile.ZipFile(GTFSLocation)
+    for name in archive.namelist():
+      if os.path.basename(name) == filename:
+        try:
+          return ZipMemberReader(archive, name)
+        except:
+          archive.close()
+          raise
+    archive.close()
+    raise IOError("No %s in %s" % (filename, GTFSLocation))
+  else:
+    return open(os.path.join(GTFSLocation, filename), "rb")
+
+def readGTFSFile(GTFSLocation, filename, columns):
+  '''
+  Generator of the records in <filename> of the GTFS feed at <GTFSLocation> (a directory or a .zip; see openGTFSFile()).
+  The file is parsed with a real CSV reader, so quoted values containing commas are read whole.
+  Each record is yielded as a tuple of the values of <columns>, a list of two or more column names, in that order. Columns are found by the file's header rather than by position; a column that the file does not have gives '' in every record, as does a short line.
+  '''
+  f = openGTFSFile(GTFSLocation, filename)
+  try:
+    reader = csv.reader(f)
+    header = [column.strip() for column in next(reader)]
+    if header and header[0].startswith(codecs.BOM_UTF8):
+      header[0] = header[0][len(codecs.BOM_UTF8):] # Some agencies save their feeds with a byte-order mark
+    width = len(header)
+    # Absent columns are read from one extra, empty, value on the end of each record
+    getValues = itemgetter(*[header.index(column) if column in header else width for column in columns])
+    for record in reader:
+      if len(record) != width:
+        if not record:
+          continue # skip blank lines
+        record = (record + [''] * width)[:width]
+      record.append('')
+      yield getValues(record)
+  finally:
+    f.close()
+
+def populateRoutes(GTFSLocation, database, batchsize=None):
   '''
   Populates the routes table of <database> with the information from routes.txt, as well as the equivalent text representations of route_type.
-  <GTFSLocation> is a string of the directory containing a text file called "routes.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "routes.txt"
   Returns <database>, updated with the routes table filled.
 
   route_id > ID that uniquely identifes a route (dataset unique). REQUIRED.
@@ -260,75 +500,74 @@ def populateRoutes(GTFSLocation, database):
   Edited: 20131104
 
   '''
-  cur = database.cursor()
-  routes = GTFSLocation + "routes.txt"
-  with open(routes) as f:
-    next(f) # skip header
-    for line in f:
-      route = line.split(",")
-      route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_url, route_color, route_text_color = route[0], route[1], route[2], route[3], route[4], route[5], route[6], route[7], route[8]
-
-      # Handling null values
-      LOV = [route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_url, route_color, route_text_color]
-      index = 0
-      for value in LOV:
-        if len(value) == 0:
-          # If the value is empty for the column
-          LOV[index] = None
-        index += 1
-
-      route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_url, route_color, route_text_color = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8]
-
-      # Non-string values
-      route_type = int(route_type)
-
-      # Get a text representation of route_type
-      if route_type == 0:
-        route_type_text = "Tram, Streetcar, Light Rail"
-        route_color = "006600" # Dark green
-      elif route_type == 1:
-        route_type_text = "Subway, Metro"
-        route_color = "FF6633" # Orange
-      elif route_type == 2:
-        route_type_text = "Rail"
-        route_color = "000000" # Black
-      elif route_type == 3:
-        route_type_text = "Bus"
-        route_color = "660066" # Darkish purple
-      elif route_type == 4:
-        route_type_text = "Ferry"
-        route_color = "3399FF" # Light blue
-      elif route_type == 5:
-        route_type_text = "Cable Car"
-        route_color = "CC0000" # Darkish red
-      elif route_type == 6:
-        route_type_text = "Gondola, Suspended Cable Car"
-        route_color = "669966" # Greyish green
-      elif route_type == 7:
-        route_type_text = "Funicular"
-        route_color = "ff3366" # Pink
-      else:
-        route_type_text = None
-
-      # Default route colour is white.
-      if route_color == None or route_color == "\n":
-        route_color = "FFFFFF"
-
-      # Defaul route text is black.
-      if route_text_color == None or route_text_color == "\n":
-        route_text_color = "000000"
-
-      cur.execute('INSERT INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_type_text, route_url, route_color, route_text_color))
+  insertRows(database, "routes", parseRoutes(GTFSLocation), batchsize)
 
-    database.commit()
-
-    return database
+  return database
 
-def populateAgency(GTFSLocation, database, continent, country, city):
+def parseRoutes(GTFSLocation):
+  '''
+  Generator of the rows of the routes table, parsed from routes.txt in <GTFSLocation>; see populateRoutes().
+  '''
+  for route in readGTFSFile(GTFSLocation, "routes.txt", ["route_id", "agency_id", "route_short_name", "route_long_name", "route_desc", "route_type", "route_url", "route_color", "route_text_color"]):
+    route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_url, route_color, route_text_color = route
+
+    # Handling null values
+    LOV = [route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_url, route_color, route_text_color]
+    index = 0
+    for value in LOV:
+      if len(value) == 0:
+        # If the value is empty for the column
+        LOV[index] = None
+      index += 1
+
+    route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_url, route_color, route_text_color = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8]
+
+    # Non-string values
+    route_type = int(route_type)
+
+    # Get a text representation of route_type
+    if route_type == 0:
+      route_type_text = "Tram, Streetcar, Light Rail"
+      route_color = "006600" # Dark green
+    elif route_type == 1:
+      route_type_text = "Subway, Metro"
+      route_color = "FF6633" # Orange
+    elif route_type == 2:
+      route_type_text = "Rail"
+      route_color = "000000" # Black
+    elif route_type == 3:
+      route_type_text = "Bus"
+      route_color = "660066" # Darkish purple
+    elif route_type == 4:
+      route_type_text = "Ferry"
+      route_color = "3399FF" # Light blue
+    elif route_type == 5:
+      route_type_text = "Cable Car"
+      route_color = "CC0000" # Darkish red
+    elif route_type == 6:
+      route_type_text = "Gondola, Suspended Cable Car"
+      route_color = "669966" # Greyish green
+    elif route_type == 7:
+      route_type_text = "Funicular"
+      route_color = "ff3366" # Pink
+    else:
+      route_type_text = None
+
+    # Default route colour is white.
+    if route_color == None or route_color == "\n":
+      route_color = "FFFFFF"
+
+    # Defaul route text is black.
+    if route_text_color == None or route_text_color == "\n":
+      route_text_color = "000000"
+
+    yield (route_id, agency_id, route_short_name, route_long_name, route_desc, route_type, route_type_text, route_url, route_color, route_text_color)
+
+def populateAgency(GTFSLocation, database, continent, country, city, batchsize=None):
   '''
   Populates the routes table of <database> with the information from agency.txt
   Forces agency_lang to lower case despite agency.txt
-  <GTFSLocation> is a string of the directory containing a text file called "agency.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "agency.txt"
   Returns <database>, updated with the routes table filled.
   <continent>, <country> and <city> are all strings; more information follows.
 
@@ -348,35 +587,33 @@ def populateAgency(GTFSLocation, database, continent, country, city):
   Created: 20131104
   Edited: 20131104
   '''
-  cur = database.cursor()
-  agencies = GTFSLocation + "agency.txt"
-  with open(agencies) as f:
-    next(f) # skip header
-    for line in f:
-      agency = line.split(",")
-      agency_id, agency_name, agency_url, agency_timezone, agency_lang, agency_phone = agency[0], agency[1], agency[2], agency[3], agency[4], agency[5]
-
-      # Handling null values
-      arrayOfValues = (agency_id, agency_name, agency_url, agency_timezone, agency_lang, agency_phone)
-      for value in arrayOfValues:
-        if len(value) == 0:
-          # If the value is empty for the column
-          header = None
+  insertRows(database, "agency", parseAgency(GTFSLocation, continent, country, city), batchsize)
 
-      # Capitalisation
-      agency_lang = agency_lang.lower()
+  return database
 
-      cur.execute('INSERT INTO agency VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (agency_id, agency_name, agency_url, agency_timezone, agency_lang, agency_phone, continent, country, city))
+def parseAgency(GTFSLocation, continent, country, city):
+  '''
+  Generator of the rows of the agency table, parsed from agency.txt in <GTFSLocation>; see populateAgency().
+  '''
+  for agency in readGTFSFile(GTFSLocation, "agency.txt", ["agency_id", "agency_name", "agency_url", "agency_timezone", "agency_lang", "agency_phone"]):
+    agency_id, agency_name, agency_url, agency_timezone, agency_lang, agency_phone = agency
 
-    database.commit()
+    # Handling null values
+    arrayOfValues = (agency_id, agency_name, agency_url, agency_timezone, agency_lang, agency_phone)
+    for value in arrayOfValues:
+      if len(value) == 0:
+        # If the value is empty for the column
+        header = None
 
-    return database
+    # Capitalisation
+    agency_lang = agency_lang.lower()
 
+    yield (agency_id, agency_name, agency_url, agency_timezone, agency_lang, agency_phone, continent, country, city)
 
-def populateCalendar(GTFSLocation, database):
+def populateCalendar(GTFSLocation, database, batchsize=None):
   '''
   Populates the calendar table of <database> with the information from calendar.txt
-  <GTFSLocation> is a string of the directory containing a text file called "calendar.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "calendar.txt"
   Returns <database>, updated with the calendar table filled.
 
   service_id > ID that uniquely identifes a set of dates when service is available for one or more routes Dataset unique. References trips.txt REQUIRED.
@@ -395,45 +632,44 @@ def populateCalendar(GTFSLocation, database):
   Created: 20131104
   Edited: 20131104
   '''
-  cur = database.cursor()
-  calendars = GTFSLocation + "calendar.txt"
-  with open(calendars) as f:
-    next(f) # skip header
-    for line in f:
-      calendar = line.split(",")
-      service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date = calendar[0], calendar[1], calendar[2], calendar[3], calendar[4], calendar[5], calendar[6], calendar[7], calendar[8], calendar[9]
-
-      # Get ISO8601 string datetimes for start_date and end_date
-      start_date = start_date[0:4] + "-" + start_date[4:6] + "-" + start_date[6:8] + " 00:00:00.000"
-      end_date = end_date[0:4] + "-" + end_date[4:6] + "-" + end_date[6:8] + " 00:00:00.000"
-
-      # Handling null values
-      LOV = [service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date]
-      index = 0
-      for value in LOV:
-        if len(value) == 0:
-          # If the value is empty for the column
-          LOV[index] = None
-        index += 1
-
-      service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8], LOV[9]
+  insertRows(database, "calendar", parseCalendar(GTFSLocation), batchsize)
 
-      # Non-string values
-      monday = int(monday)
-      tuesday = int(tuesday)
-      wednesday = int(wednesday)
-      thursday = int(thursday)
-      friday = int(friday)
-      saturday = int(saturday)
-      sunday = int(sunday)
+  return database
 
-      cur.execute('INSERT INTO calendar VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date))
-
-    database.commit()
-
-    return database
-
-def populateCalendarDates(GTFSLocation, database):
+def parseCalendar(GTFSLocation):
+  '''
+  Generator of the rows of the calendar table, parsed from calendar.txt in <GTFSLocation>; see populateCalendar().
+  '''
+  for calendar in readGTFSFile(GTFSLocation, "calendar.txt", ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "start_date", "end_date"]):
+    service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date = calendar
+
+    # Get ISO8601 string datetimes for start_date and end_date
+    start_date = start_date[0:4] + "-" + start_date[4:6] + "-" + start_date[6:8] + " 00:00:00.000"
+    end_date = end_date[0:4] + "-" + end_date[4:6] + "-" + end_date[6:8] + " 00:00:00.000"
+
+    # Handling null values
+    LOV = [service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date]
+    index = 0
+    for value in LOV:
+      if len(value) == 0:
+        # If the value is empty for the column
+        LOV[index] = None
+      index += 1
+
+    service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8], LOV[9]
+
+    # Non-string values
+    monday = int(monday)
+    tuesday = int(tuesday)
+    wednesday = int(wednesday)
+    thursday = int(thursday)
+    friday = int(friday)
+    saturday = int(saturday)
+    sunday = int(sunday)
+
+    yield (service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date)
+
+def populateCalendarDates(GTFSLocation, database, batchsize=None):
   '''
   Populates the calendar_dates table of <database> with the information from calendar.txt
   The calendar_dates table allows one to explicitly activate or disable service IDs by date.
@@ -443,7 +679,7 @@ def populateCalendarDates(GTFSLocation, database):
 
   If the a service_id value appears in both the calendar and calendar_dates tables, the information in calendar_dates modifies the service information specified in calendar.
 
-  <GTFSLocation> is a string of the directory containing a text file called "calendar.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "calendar.txt"
   Returns <database>, updated with the calendar table filled.
 
   service_id > ID that uniquely identifes a set of dates when service is available for one or more routes Dataset unique. Each (service_id, date) pair can only appear once. References trips.txt REQUIRED.
@@ -456,49 +692,48 @@ def populateCalendarDates(GTFSLocation, database):
   Created: 20131106
   Edited: 20131106
   '''
-  cur = database.cursor()
-  dates = GTFSLocation + "calendar_dates.txt"
-  with open(dates) as f:
-    next(f) # skip header
-    for line in f:
-      cdate = line.split(",")
-      service_id, date, exception_type = cdate[0], cdate[1], cdate[2]
-
-      # Get ISO8601 string datetimes for start_date and end_date
-      date = date[0:4] + "-" + date[4:6] + "-" + date[6:8] + " 00:00:00.000"
-
-      # Handling null values
-      LOV = [service_id, date, exception_type]
-      index = 0
-      for value in LOV:
-        if len(value) == 0:
-          # If the value is empty for the column
-          LOV[index] = None
-        index += 1
+  insertRows(database, "calendar_dates", parseCalendarDates(GTFSLocation), batchsize)
 
-      service_id, date, exception_type = LOV[0], LOV[1], LOV[2]
+  return database
 
-      # Non-string values
-      exception_type = int(exception_type)
+def parseCalendarDates(GTFSLocation):
+  '''
+  Generator of the rows of the calendar_dates table, parsed from calendar_dates.txt in <GTFSLocation>; see populateCalendarDates().
+  '''
+  for cdate in readGTFSFile(GTFSLocation, "calendar_dates.txt", ["service_id", "date", "exception_type"]):
+    service_id, date, exception_type = cdate
 
-      # Textual correspondence to exception_type
-      if exception_type == 1:
-        exception_text = "Added"
-      elif exception_type == 2:
-        exception_text = "Removed"
+    # Get ISO8601 string datetimes for start_date and end_date
+    date = date[0:4] + "-" + date[4:6] + "-" + date[6:8] + " 00:00:00.000"
 
-      cur.execute('INSERT INTO calendar_dates VALUES (?, ?, ?, ?)', (service_id, date, exception_type, exception_text))
+    # Handling null values
+    LOV = [service_id, date, exception_type]
+    index = 0
+    for value in LOV:
+      if len(value) == 0:
+        # If the value is empty for the column
+        LOV[index] = None
+      index += 1
 
-    database.commit()
+    service_id, date, exception_type = LOV[0], LOV[1], LOV[2]
+
+    # Non-string values
+    exception_type = int(exception_type)
 
-    return database
+    # Textual correspondence to exception_type
+    if exception_type == 1:
+      exception_text = "Added"
+    elif exception_type == 2:
+      exception_text = "Removed"
 
-def populateTrips(GTFSLocation, database):
+    yield (service_id, date, exception_type, exception_text)
+
+def populateTrips(GTFSLocation, database, batchsize=None):
   '''
   Populates the trips table of <database> with the information from trips.txt
   The trips table details individual PT trips, including the direction, the name and via concordance with routes, shapes, calendar and calendar_dates: the dates, exceptions and spatial representations.
 
-  <GTFSLocation> is a string of the directory containing a text file called "calendar.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "calendar.txt"
   Returns <database>, updated with the calendar table filled.
 
   route_id > ID that uniquely identifes a route. References routes. REQUIRED.
@@ -518,75 +753,71 @@ def populateTrips(GTFSLocation, database):
   Created: 20131106
   Edited: 20131106
   '''
-  cur = database.cursor()
-  trips = GTFSLocation + "trips.txt"
-  with open(trips) as f:
-    next(f) # skip header
-    for line in f:
-      trip = line.split(",")
-
-      route_id, service_id, trip_id, trip_headsign, direction_id, block_id, shape_id = trip[0], trip[1], trip[2], trip[3], trip[4], trip[5], trip[6]
-      # no trip_short_name in Wellington
-      trip_short_name = None
-      # no wheelchair_accessible in Wellington
-      wheelchair_accessible = None
-
-      # Handling null values
-      LOV = [route_id, service_id, trip_id, trip_headsign, trip_short_name, direction_id, block_id, shape_id, wheelchair_accessible]
-      index = 0
-      for value in LOV:
-        if value is not None:
-          if len(value) == 0:
-            # If the value is empty for the column
-            LOV[index] = None
-        index += 1
-      route_id, service_id, trip_id, trip_headsign, trip_short_name, direction_id, block_id, shape_id, wheelchair_accessible = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8]
-
-      # Non-string values
-      # Try/excepts are for None types, which are ignored.
-      try:
-        direction_id = int(direction_id)
-      except:
-        direction_id = None
-      try:
-        block_id = int(block_id)
-      except:
-        block_id = None
-      try:
-        wheelchair_accessible = int(wheelchair_accessible)
-      except:
-        wheelchair_accessible = None
-
-      # Textual correspondence to directon_id
-      if direction_id == 0:
-        # Travel in one direction (e.g. outbound travel)
-        direction_id_text = "Outbound"
-      elif direction_id == 1:
-        # Travel in the opposite direction (e.g. inbound travel)
-        direction_id_text = "Inbound"
-
-      # Textual correspondence to wheelchair_accessible
-      if wheelchair_accessible == 0 or wheelchair_accessible is None:
-        wheelchair_accessible_text = "Unknown"
-      elif wheelchair_accessible == 1:
-        wheelchair_accessible_text = "Accessible"
-      elif wheelchair_accessible == 2:
-        wheelchair_accessible_text = "Inaccessible"
-
-      cur.execute('INSERT INTO trips VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (route_id, service_id, trip_id, trip_headsign, trip_short_name, direction_id, direction_id_text, block_id, shape_id, wheelchair_accessible, wheelchair_accessible_text))
+  insertRows(database, "trips", parseTrips(GTFSLocation), batchsize)
 
-    database.commit()
+  return database
 
-    return database
+def parseTrips(GTFSLocation):
+  '''
+  Generator of the rows of the trips table, parsed from trips.txt in <GTFSLocation>; see populateTrips().
+  '''
+  for trip in readGTFSFile(GTFSLocation, "trips.txt", ["route_id", "service_id", "trip_id", "trip_headsign", "trip_short_name", "direction_id", "block_id", "shape_id", "wheelchair_accessible"]):
+    # trip_short_name and wheelchair_accessible are empty for Wellington, which does not supply them
+    route_id, service_id, trip_id, trip_headsign, trip_short_name, direction_id, block_id, shape_id, wheelchair_accessible = trip
+
+    # Handling null values
+    LOV = [route_id, service_id, trip_id, trip_headsign, trip_short_name, direction_id, block_id, shape_id, wheelchair_accessible]
+    index = 0
+    for value in LOV:
+      if value is not None:
+        if len(value) == 0:
+          # If the value is empty for the column
+          LOV[index] = None
+      index += 1
+    route_id, service_id, trip_id, trip_headsign, trip_short_name, direction_id, block_id, shape_id, wheelchair_accessible = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8]
+
+    # Non-string values
+    # Try/excepts are for None types, which are ignored.
+    try:
+      direction_id = int(direction_id)
+    except:
+      direction_id = None
+    try:
+      block_id = int(block_id)
+    except:
+      block_id = None
+    try:
+      wheelchair_accessible = int(wheelchair_accessible)
+    except:
+      wheelchair_accessible = None
 
-def populateShapes(GTFSLocation, database):
+    # Textual correspondence to directon_id
+    if direction_id == 0:
+      # Travel in one direction (e.g. outbound travel)
+      direction_id_text = "Outbound"
+    elif direction_id == 1:
+      # Travel in the opposite direction (e.g. inbound travel)
+      direction_id_text = "Inbound"
+
+    # Textual correspondence to wheelchair_accessible
+    if wheelchair_accessible == 0 or wheelchair_accessible is None:
+      wheelchair_accessible_text = "Unknown"
+    elif wheelchair_accessible == 1:
+      wheelchair_accessible_text = "Accessible"
+    elif wheelchair_accessible == 2:
+      wheelchair_accessible_text = "Inaccessible"
+
+    yield (route_id, service_id, trip_id, trip_headsign, trip_short_name, direction_id, direction_id_text, block_id, shape_id, wheelchair_accessible, wheelchair_accessible_text)
+
+def populateShapes(GTFSLocation, database, batchsize=None):
   '''
   Populates the shapes table of <database> with the information from shapes.txt
   The shapes table details the spatial representation (ordered vertices) of PT routes, identifiable with shape_id.
+  Rows come from parseShapes(<GTFSLocation>) and are written <batchsize> at a time by insertRows().
 
   This script also tests whether the agency has genuinely supplied the length of the routes, or just copied the sequence information. If all of the shape_dist_traveled values are equal to shape_pt_sequence (as in Wellington), then shape_dist_traveled is uniformly set to None.
 
-  <GTFSLocation> is a string of the directory containing a text file called "calendar.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "calendar.txt"
   Returns <database>, updated with the calendar table filled.
 
   shape_id > An ID that uniquely identfies a shape (e.g. a line). NOT DATASET UNIQUE BECAUSE ONE LINE HAS MANY VERTICES. REQUIRED.
@@ -600,71 +831,66 @@ def populateShapes(GTFSLocation, database):
   Created: 20131106
   Edited: 20131106
   '''
-  trueDistance = True # Assume that the agency actually gives distance values.
-  countMatches = 0 # Set matches to 0
-
-  cur = database.cursor()
-  shapes = GTFSLocation + "shapes.txt"
-  with open(shapes) as f:
-    next(f) # skip header
-    rows = sum(1 for l in f) - 1 # Counts the number of records, which is very large. Subtracts one to correspond to countMatches, which begins at 0.
-
-    # True distance provided?
-    for line in f:
-      shape = line.split(",")
-      shape_pt_sequence, shape_distance_traveled = shape[3], shape[4]
-      if shape[4] != '':
-        if shape_pt_sequence == shape_distance_traveled:
-          countMatches += 1
-    if countMatches == rows: # If EVERY row is just the sequence number...
-      trueDistance = False # ...confirm that the agency does not give actual distance values.
-
-  with open(shapes) as g:
-    next(g) # skip header
-    for line in g:
-      shape = line.split(",")
-
-      shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled = shape[0], shape[1], shape[2], shape[3], shape[4]
-
-      if trueDistance == False:
-        # If the distance field isn't actually distance:
-        shape_dist_traveled = None
-
-      # Handling null values
-      LOV = [shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled]
-      index = 0
-      for value in LOV:
-        if value is not None:
-          if len(value) == 0:
-            # If the value is empty for the column
-            LOV[index] = None
-        index += 1
-      shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4]
-
-      # Non-string values
-      # Try/excepts are for None types, which are ignored.
-      shape_pt_lat = float(shape_pt_lat)
-      shape_pt_lon = float(shape_pt_lon)
-      shape_pt_sequence = int(shape_pt_sequence)
-      try:
-        shape_dist_traveled = float(shape_dist_traveled)
-      except:
-        shape_dist_traveled = None
-
-      cur.execute('INSERT INTO shapes VALUES (?, ?, ?, ?, ?)', (shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled))
+  insertRows(database, "shapes", parseShapes(GTFSLocation), batchsize)
 
-    database.commit()
+  return database
 
-    return database
+def parseShapes(GTFSLocation):
+  '''
+  Generator of the rows of the shapes table, parsed from shapes.txt in <GTFSLocation>.
+  Yields (shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled) tuples; see populateShapes().
+  '''
+  trueDistance = True # Assume that the agency actually gives distance values.
+  countMatches = 0 # Set matches to 0
 
-def populateFeedInfo(GTFSLocation, database):
+  # True distance provided? Compare every shape_dist_traveled against shape_pt_sequence in a first pass over the file.
+  rows = 0
+  for shape_pt_sequence, shape_distance_traveled in readGTFSFile(GTFSLocation, "shapes.txt", ["shape_pt_sequence", "shape_dist_traveled"]):
+    rows += 1
+    if shape_distance_traveled != '':
+      if shape_pt_sequence == shape_distance_traveled:
+        countMatches += 1
+  if rows > 0 and countMatches == rows: # If EVERY row is just the sequence number...
+    trueDistance = False # ...confirm that the agency does not give actual distance values.
+
+  for shape in readGTFSFile(GTFSLocation, "shapes.txt", ["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence", "shape_dist_traveled"]):
+    shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled = shape
+
+    if trueDistance == False:
+      # If the distance field isn't actually distance:
+      shape_dist_traveled = None
+
+    # Handling null values
+    LOV = [shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled]
+    index = 0
+    for value in LOV:
+      if value is not None:
+        if len(value) == 0:
+          # If the value is empty for the column
+          LOV[index] = None
+      index += 1
+    shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4]
+
+    # Non-string values
+    # Try/excepts are for None types, which are ignored.
+    shape_pt_lat = float(shape_pt_lat)
+    shape_pt_lon = float(shape_pt_lon)
+    shape_pt_sequence = int(shape_pt_sequence)
+    try:
+      shape_dist_traveled = float(shape_dist_traveled)
+    except:
+      shape_dist_traveled = None
+
+    yield (shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence, shape_dist_traveled)
+
+def populateFeedInfo(GTFSLocation, database, batchsize=None):
   '''
   Populates the feed_info table of <database> with the information from feed_info.txt
   The feed_info table details the agency who created the GTFS feed, including a link to their website for further information.
   Information about the feed itself, rather than the services that the feed describes.
   The publisher of the feed is sometimes a different entity than any of the agencies in the agency table.
 
-  <GTFSLocation> is a string of the directory containing a text file called "calendar.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "calendar.txt"
   Returns <database>, updated with the calendar table filled.
 
   feed_publisher_name > The full name of the organization that publishes the feed. This may be the same as one of the agency_name values in the agency table. REQUIRED.
@@ -679,48 +905,44 @@ def populateFeedInfo(GTFSLocation, database):
   Created: 20131106
   Edited: 20131106
   '''
-  cur = database.cursor()
-  feed_infos = GTFSLocation + "feed_info.txt"
-
-  with open(feed_infos) as g:
-    next(g) # skip header
-    for line in g:
-      feed_info = line.split(",")
-
-      feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date = feed_info[0], feed_info[1], feed_info[2], feed_info[3], feed_info[4]
-      # no feed_version in Wellington
-      feed_version = None
-
-      # Handling null values
-      LOV = [feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date, feed_version]
-      index = 0
-      for value in LOV:
-        if value is not None:
-          if len(value) == 0:
-            # If the value is empty for the column
-            LOV[index] = None
-        index += 1
-      feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date, feed_version = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5]
+  insertRows(database, "feed_info", parseFeedInfo(GTFSLocation), batchsize)
 
-      # Get ISO8601 string datetimes for feed_start_date and feed_end_date
-      feed_start_date = feed_start_date[0:4] + "-" + feed_start_date[4:6] + "-" + feed_start_date[6:8] + " 00:00:00.000"
-      feed_end_date = feed_end_date[0:4] + "-" + feed_end_date[4:6] + "-" + feed_end_date[6:8] + " 00:00:00.000"
+  return database
 
-      # Capitalisation
-      feed_lang = feed_lang.lower()
+def parseFeedInfo(GTFSLocation):
+  '''
+  Generator of the rows of the feed_info table, parsed from feed_info.txt in <GTFSLocation>; see populateFeedInfo().
+  '''
+  for feed_info in readGTFSFile(GTFSLocation, "feed_info.txt", ["feed_publisher_name", "feed_publisher_url", "feed_lang", "feed_start_date", "feed_end_date", "feed_version"]):
+    # feed_version is empty for Wellington, which does not supply it
+    feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date, feed_version = feed_info
+
+    # Handling null values
+    LOV = [feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date, feed_version]
+    index = 0
+    for value in LOV:
+      if value is not None:
+        if len(value) == 0:
+          # If the value is empty for the column
+          LOV[index] = None
+      index += 1
+    feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date, feed_version = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5]
 
-      cur.execute('INSERT INTO feed_info VALUES (?, ?, ?, ?, ?, ?)', (feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date, feed_version))
+    # Get ISO8601 string datetimes for feed_start_date and feed_end_date
+    feed_start_date = feed_start_date[0:4] + "-" + feed_start_date[4:6] + "-" + feed_start_date[6:8] + " 00:00:00.000"
+    feed_end_date = feed_end_date[0:4] + "-" + feed_end_date[4:6] + "-" + feed_end_date[6:8] + " 00:00:00.000"
 
-    database.commit()
+    # Capitalisation
+    feed_lang = feed_lang.lower()
 
-    return database
+    yield (feed_publisher_name, feed_publisher_url, feed_lang, feed_start_date, feed_end_date, feed_version)
 
-def populateStops(GTFSLocation, database):
+def populateStops(GTFSLocation, database, batchsize=None):
   '''
   Populates the stops table of <database> with the information from stops.txt
   The stops table has information about PT stops, stations, interchanges and the like that the PT vehicles and passengers coincide at.
 
-  <GTFSLocation> is a string of the directory containing a text file called "calendar.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "calendar.txt"
   Returns <database>, updated with the calendar table filled.
 
   stop_id > An ID that uniquely identifies a stop or station. Multiple routes may use the same stop. The stop_id is dataset unique. REQUIRED.
@@ -747,79 +969,75 @@ def populateStops(GTFSLocation, database):
   Created: 20131106
   Edited: 20131106
   '''
-  cur = database.cursor()
-  stops = GTFSLocation + "stops.txt"
-
-  print "Note: populateStops() currently gives an incorrect stop_timezone for GTFS feeds outside New Zealand."
+  insertRows(database, "stops", parseStops(GTFSLocation), batchsize)
 
-  with open(stops) as g:
-    next(g) # skip header
-    for line in g:
-      line = line.replace(", ", " - ") # Replaces ", ", which appears in text descriptions of stop names, with a hyphen surrounded by spaces. For correct parsing.
-      stop = line.split(",")
+  return database
 
-      stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, parent_station = stop[0], stop[1], stop[2], stop[3], stop[4], stop[5], stop[6], stop[7], stop[8], stop[9]
-      # no wheelchair_boarding in Wellington
-      wheelchair_boarding = None
+def parseStops(GTFSLocation):
+  '''
+  Generator of the rows of the stops table, parsed from stops.txt in <GTFSLocation>; see populateStops().
+  '''
+  print "Note: populateStops() currently gives an incorrect stop_timezone for GTFS feeds outside New Zealand."
 
-      # stop_timezone
-      # For now, I am assuming this remains within New Zealand
-      stop_timezone = "Pacific/Auckland"
-
-      # Handling null values
-      LOV = [stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, parent_station, stop_timezone, wheelchair_boarding]
-      index = 0
-      for value in LOV:
-        if value is not None:
-          if len(value) == 0:
-            # If the value is empty for the column
-            LOV[index] = None
-        index += 1
-      stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, parent_station, stop_timezone, wheelchair_boarding = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8], LOV[9], LOV[10], LOV[11]
-
-      # Non-string values
-      # Try/excepts are for None types, which are ignored.
-      stop_lat = float(stop_lat)
-      stop_lon = float(stop_lon)
-      try:
-        location_type = int(location_type)
-      except:
-        location_type = None
-      try:
-        wheelchair_boarding = int(wheelchair_boarding)
-      except:
-        wheelchair_boarding = None
-
-      # wheelchair_boarding_text
-      if wheelchair_boarding is None or wheelchair_boarding == 0:
-        wheelchair_boarding_text = "Unknown"
-      elif wheelchair_boarding == 1:
-        wheelchair_boarding_text = "Accessible"
-      elif wheelchair_boarding == 2:
-        wheelchair_boarding == "Inaccessible"
-
-      # location_type_text
-      if location_type is None or location_type == 0:
-        location_type_text = "Stop"
-        # Hail and ride option
-        if "hail & ride" in stop_name.lower() or "hail and ride" in stop_name.lower():
-          # Location type number itself is NOT changed, due to dependencies of other tables.
-          location_type_text = "Hail and Ride"
-      elif location_type == 1:
-        location_type_text = "Station"
-
-      cur.execute('INSERT INTO stops VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, location_type_text, parent_station, stop_timezone, wheelchair_boarding, wheelchair_boarding_text))
+  for stop in readGTFSFile(GTFSLocation, "stops.txt", ["stop_id", "stop_code", "stop_name", "stop_desc", "stop_lat", "stop_lon", "zone_id", "stop_url", "location_type", "parent_station", "wheelchair_boarding"]):
+    # wheelchair_boarding is empty for Wellington, which does not supply it
+    stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, parent_station, wheelchair_boarding = stop
 
-    database.commit()
+    # stop_timezone
+    # For now, I am assuming this remains within New Zealand
+    stop_timezone = "Pacific/Auckland"
 
-    return database
+    # Handling null values
+    LOV = [stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, parent_station, stop_timezone, wheelchair_boarding]
+    index = 0
+    for value in LOV:
+      if value is not None:
+        if len(value) == 0:
+          # If the value is empty for the column
+          LOV[index] = None
+      index += 1
+    stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, parent_station, stop_timezone, wheelchair_boarding = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8], LOV[9], LOV[10], LOV[11]
+
+    # Non-string values
+    # Try/excepts are for None types, which are ignored.
+    stop_lat = float(stop_lat)
+    stop_lon = float(stop_lon)
+    try:
+      location_type = int(location_type)
+    except:
+      location_type = None
+    try:
+      wheelchair_boarding = int(wheelchair_boarding)
+    except:
+      wheelchair_boarding = None
 
-def populateStopTimes(GTFSLocation, database):
+    # wheelchair_boarding_text
+    if wheelchair_boarding is None or wheelchair_boarding == 0:
+      wheelchair_boarding_text = "Unknown"
+    elif wheelchair_boarding == 1:
+      wheelchair_boarding_text = "Accessible"
+    elif wheelchair_boarding == 2:
+      wheelchair_boarding == "Inaccessible"
+
+    # location_type_text
+    if location_type is None or location_type == 0:
+      location_type_text = "Stop"
+      # Hail and ride option
+      if "hail & ride" in stop_name.lower() or "hail and ride" in stop_name.lower():
+        # Location type number itself is NOT changed, due to dependencies of other tables.
+        location_type_text = "Hail and Ride"
+    elif location_type == 1:
+      location_type_text = "Station"
+
+    yield (stop_id, stop_code, stop_name, stop_desc, stop_lat, stop_lon, zone_id, stop_url, location_type, location_type_text, parent_station, stop_timezone, wheelchair_boarding, wheelchair_boarding_text)
+
+def populateStopTimes(GTFSLocation, database, batchsize=None):
   '''
   Populates the stop_times table of <database> with the information from stop_times.txt
   This table has information about when each trip stops at each stop (so is VERY large).
+  Rows come from parseStopTimes(<GTFSLocation>) and are written <batchsize> at a time by insertRows().
 
-  <GTFSLocation> is a string of the directory containing a text file called "calendar.txt"
+  <GTFSLocation> is a string of the directory, or the path to the .zip archive, containing a text file called "calendar.txt"
   Returns <database>, updated with the calendar table filled.
 
   trip_id > ID that identifies a trip. References trips table.
@@ -839,99 +1057,99 @@ def populateStopTimes(GTFSLocation, database):
   Created: 20131106
   Edited: 20131106
   '''
-  cur = database.cursor()
-  stop_times = GTFSLocation + "stop_times.txt"
+  insertRows(database, "stop_times", parseStopTimes(GTFSLocation), batchsize)
 
-  print "Reminder: arrival and departure times in the stops table can permissibly be empty or extend beyond 24h."
+  return database
 
-  with open(stop_times) as g:
-    next(g) # skip header
-    for line in g:
-      line = line.replace(", ", " - ") # Replaces ", ", which appears in text descriptions of stop names, with a hyphen surrounded by spaces. For correct parsing.
-      stop_time = line.split(",")
-
-      trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, drop_off_type, shape_dist_traveled = stop_time[0], stop_time[1], stop_time[2], stop_time[3], stop_time[4], stop_time[5], stop_time[6], stop_time[7], stop_time[8]
-
-      # Handling null values
-      LOV = [trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, drop_off_type, shape_dist_traveled]
-      index = 0
-      for value in LOV:
-        if value is not None:
-          if len(value) == 0:
-            # If the value is empty for the column
-            LOV[index] = None
-        index += 1
-      trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, drop_off_type, shape_dist_traveled = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8]
-
-      # Non-string values
-      # Try/excepts are for None types, which are ignored.
-      trip_id = int(trip_id)
-      stop_id = int(stop_id)
-      stop_sequence = int(stop_sequence)
-      try:
-        pickup_type = int(pickup_type)
-      except:
-        pickup_type = None
-      try:
-        drop_off_type = int(drop_off_type)
-      except:
-        drop_off_type = None
-      try:
-        shape_dist_traveled = float(shape_dist_traveled)
-      except:
-        shape_dist_traveled = None
-
-      # Arrival and departure times
-      if len(arrival_time) == 0 or arrival_time is None:
-        arrival_time = None
-        print "## Null arrival time noted for trip_id %i, stop_id %i. ##" % (trip_id, stop_id)
-      else:
-        arrival_time = arrival_time.split(":")
-        hour = arrival_time[0]
-        minutes = arrival_time[1]
-        seconds = arrival_time[2]
-        if len(hour) == 1:
-          # Then it is an hour before midday
-          hour = "0" + hour
-        arrival_time = hour + ":" + minutes + ":" + seconds + ".000"
-
-      if len(departure_time) == 0 or departure_time is None:
-        departure_time = None
-        print "## Null departure time noted for trip_id %i, stop_id %i. ##" % (trip_id, stop_id)
-      else:
-        departure_time = departure_time.split(":")
-        hour = departure_time[0]
-        minutes = departure_time[1]
-        seconds = departure_time[2]
-        if len(hour) == 1:
-          # Then it is an hour before midday
-          hour = "0" + hour
-        departure_time = hour + ":" + minutes + ":" + seconds + ".000"
-
-      # Drop-off and pickup type correspondence
-      if pickup_type is None or pickup_type == 0:
-        pickup_type_text = "Pickup"
-      elif pickup_type == 1:
-        pickup_type_text = "No Pickup"
-      elif pickup_type == 2:
-        pickup_type_text = "Agency Pickup"
-      elif pickup_type == 3:
-        pickup_type_text = "Coordinate Pickup"
-
-      if drop_off_type is None or drop_off_type == 0:
-        drop_off_type_text = "Drop Off"
-      elif drop_off_type == 1:
-        drop_off_type_text = "No Drop Off"
-      elif drop_off_type == 2:
-        drop_off_type_text = "Agency Drop Off"
-      elif drop_off_type == 3:
-        drop_off_type_text = "Coordinate Drop Off"
-
-      cur.execute('INSERT INTO stop_times VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, pickup_type_text, drop_off_type, drop_off_type_text, shape_dist_traveled))
+def parseStopTimes(GTFSLocation):
+  '''
+  Generator of the rows of the stop_times table, parsed from stop_times.txt in <GTFSLocation>.
+  Yields tuples in the column order of the stop_times table; see populateStopTimes().
+  '''
+  print "Reminder: arrival and departure times in the stops table can permissibly be empty or extend beyond 24h."
 
-    database.commit()
+  for stop_time in readGTFSFile(GTFSLocation, "stop_times.txt", ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence", "stop_headsign", "pickup_type", "drop_off_type", "shape_dist_traveled"]):
+    trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, drop_off_type, shape_dist_traveled = stop_time
 
-    return database
+    # Handling null values
+    LOV = [trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, drop_off_type, shape_dist_traveled]
+    index = 0
+    for value in LOV:
+      if value is not None:
+        if len(value) == 0:
+          # If the value is empty for the column
+          LOV[index] = None
+      index += 1
+    trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, drop_off_type, shape_dist_traveled = LOV[0], LOV[1], LOV[2], LOV[3], LOV[4], LOV[5], LOV[6], LOV[7], LOV[8]
+
+    # Non-string values
+    # Try/excepts are for None types, which are ignored.
+    trip_id = int(trip_id)
+    stop_id = int(stop_id)
+    stop_sequence = int(stop_sequence)
+    try:
+      pickup_type = int(pickup_type)
+    except:
+      pickup_type = None
+    try:
+      drop_off_type = int(drop_off_type)
+    except:
+      drop_off_type = None
+    try:
+      shape_dist_traveled = float(shape_dist_traveled)
+    except:
+      shape_dist_traveled = None
+
+    # Arrival and departure times, also as seconds since midnight (which can exceed 86400)
+    arrival_secs, departure_secs = None, None
+    if arrival_time is None or len(arrival_time) == 0:
+      arrival_time = None
+      print "## Null arrival time noted for trip_id %i, stop_id %i. ##" % (trip_id, stop_id)
+    else:
+      arrival_time = arrival_time.split(":")
+      hour = arrival_time[0]
+      minutes = arrival_time[1]
+      seconds = arrival_time[2]
+      if len(hour) == 1:
+        # Then it is an hour before midday
+        hour = "0" + hour
+      arrival_time = hour + ":" + minutes + ":" + seconds + ".000"
+      arrival_secs = int(hour) * 3600 + int(minutes) * 60 + int(seconds)
+
+    if departure_time is None or len(departure_time) == 0:
+      departure_time = None
+      print "## Null departure time noted for trip_id %i, stop_id %i. ##" % (trip_id, stop_id)
+    else:
+      departure_time = departure_time.split(":")
+      hour = departure_time[0]
+      minutes = departure_time[1]
+      seconds = departure_time[2]
+      if len(hour) == 1:
+        # Then it is an hour before midday
+        hour = "0" + hour
+      departure_time = hour + ":" + minutes + ":" + seconds + ".000"
+      departure_secs = int(hour) * 3600 + int(minutes) * 60 + int(seconds)
+
+    # Drop-off and pickup type correspondence
+    if pickup_type is None or pickup_type == 0:
+      pickup_type_text = "Pickup"
+    elif pickup_type == 1:
+      pickup_type_text = "No Pickup"
+    elif pickup_type == 2:
+      pickup_type_text = "Agency Pickup"
+    elif pickup_type == 3:
+      pickup_type_text = "Coordinate Pickup"
+
+    if drop_off_type is None or drop_off_type == 0:
+      drop_off_type_text = "Drop Off"
+    elif drop_off_type == 1:
+      drop_off_type_text = "No Drop Off"
+    elif drop_off_type == 2:
+      drop_off_type_text = "Agency Drop Off"
+    elif drop_off_type == 3:
+      drop_off_type_text = "Coordinate Drop Off"
+
+    yield (trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign, pickup_type, pickup_type_text, drop_off_type, drop_off_type_text, shape_dist_traveled, arrival_secs, departure_secs)
 
 def populateStopTimesAmended(database):
   '''
@@ -944,104 +1162,539 @@ def populateStopTimesAmended(database):
   2330pm and end at sunday at 0100m. This table records that more
   sensibly than the GTFS default, which is to say the trip runs on
   Saturday at 2330 and ends on Saturday at 2500.
+
+  The table is derived inside SQLite with a single INSERT ... SELECT over
+  stop_times, trips and calendar: times of 24h or more lose 24h and the
+  week of the service is rotated by one day (Monday's flag moves to
+  Tuesday, ..., Sunday's to Monday). arrival_secs and departure_secs
+  lose 86400 in the same way.
+
+  A stop where the vehicle arrives before midnight and departs after it
+  (a dwell over midnight) keeps the week of its arrival; a stop that
+  arrives after midnight but departs before it is impossible. Both are
+  copied into the stop_times_midnight_dwell table so they can be
+  inspected, rather than stopping the build.
+  Both tables are emptied first, so this can be run again to re-derive
+  them.
+  Returns <database>.
+  '''
+  cur = database.cursor()
+  cur.execute('CREATE TABLE IF NOT EXISTS stop_times_midnight_dwell(trip_id INTEGER REFERENCES trips(trip_id), service_id INTEGER REFERENCES trips(service_id), stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, arrival_time DATETIME, departure_time DATETIME, problem TEXT)')
+  cur.execute('DELETE FROM stop_times_amended')
+  cur.execute('DELETE FROM stop_times_midnight_dwell')
+
+  # stop_times joined to its service and week, with the hours as integers
+  # Services that are only in calendar_dates run on no day of the week
+  stoppedtrips = '''SELECT ST.trip_id, T.service_id, ST.arrival_time, ST.departure_time, CAST(substr(ST.arrival_time, 1, 2) AS INTEGER) AS arrival_hour, CAST(substr(ST.departure_time, 1, 2) AS INTEGER) AS departure_hour,
+    coalesce(C.monday, 0) AS monday, coalesce(C.tuesday, 0) AS tuesday, coalesce(C.wednesday, 0) AS wednesday, coalesce(C.thursday, 0) AS thursday, coalesce(C.friday, 0) AS friday, coalesce(C.saturday, 0) AS saturday, coalesce(C.sunday, 0) AS sunday,
+    ST.stop_id, ST.stop_sequence, ST.stop_headsign, ST.pickup_type, ST.pickup_type_text, ST.drop_off_type, ST.drop_off_type_text, ST.shape_dist_traveled, ST.arrival_secs, ST.departure_secs
+    FROM stop_times AS ST JOIN trips AS T ON T.trip_id = ST.trip_id LEFT OUTER JOIN calendar AS C ON C.service_id = T.service_id'''
+
+  # Rows that either dwell over midnight, or "arrive" after departing
+  cur.execute('''INSERT INTO stop_times_midnight_dwell
+    SELECT trip_id, service_id, stop_id, stop_sequence, arrival_time, departure_time,
+    CASE WHEN arrival_hour < 24 THEN 'Dwells over midnight' ELSE 'Arrives after midnight, departs before it' END
+    FROM (%s) WHERE (arrival_hour < 24) != (departure_hour < 24)''' % stoppedtrips)
+
+  # Rows with an arrival after midnight take the week of the following day
+  # e.g. "25:10:00.000" on a Saturday becomes "01:10:00.000" on a Sunday
+  q = Template('''INSERT INTO stop_times_amended
+    SELECT trip_id, service_id,
+    CASE WHEN arrival_hour >= 24 THEN substr('0' || (arrival_hour - 24), -2) || substr(arrival_time, 3) ELSE arrival_time END,
+    CASE WHEN departure_hour >= 24 THEN substr('0' || (departure_hour - 24), -2) || substr(departure_time, 3) ELSE departure_time END,
+    $week,
+    stop_id, stop_sequence, stop_headsign, pickup_type, pickup_type_text, drop_off_type, drop_off_type_text, shape_dist_traveled,
+    CASE WHEN arrival_hour >= 24 THEN arrival_secs - 86400 ELSE arrival_secs END,
+    CASE WHEN departure_hour >= 24 THEN departure_secs - 86400 ELSE departure_secs END
+    FROM ($stoppedtrips)''')
+  week = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+  rotated = ["CASE WHEN arrival_hour >= 24 THEN %s ELSE %s END" % (week[i - 1], day) for i, day in enumerate(week)]
+  cur.execute(q.substitute(week = ", ".join(rotated), stoppedtrips = stoppedtrips))
+
+  database.commit()
+
+  cur.execute('SELECT count(*) FROM stop_times_midnight_dwell')
+  dwells = cur.fetchone()[0]
+  if dwells > 0:
+    print "## %i stop_times rows dwell over midnight; see the stop_times_midnight_dwell table. ##" % dwells
+
+  return database
+
+def populateTripSummary(database):
+  '''
+  Populates the trip_summary table of <database>: one row per trip, with
+  its route, service, shape and mode, the seconds of its first arrival
+  and of its first and last departures, its number of stops, whether it runs past midnight, and
+  the length of its shape in metres.
+  These are the values that PTTrip would otherwise work out from
+  stop_times one trip at a time.
+  Requires routes, trips, shapes and stop_times to be populated. The
+  table is emptied first, so this can be run again to re-derive it.
+  Returns <database>.
+  '''
+  dropOldTripSummary(database)
+  cur = database.cursor()
+  cur.execute('CREATE TABLE IF NOT EXISTS trip_summary(trip_id INTEGER PRIMARY KEY, route_id TEXT REFERENCES routes(route_id), service_id INTEGER REFERENCES trips(service_id), shape_id TEXT REFERENCES shapes(shape_id), route_type_desc TEXT REFERENCES routes(route_type_desc), first_arrival_secs INTEGER, first_departure_secs INTEGER, last_departure_secs INTEGER, stop_count INTEGER, crosses_midnight INTEGER, shape_length FLOAT)')
+  cur.execute('DELETE FROM trip_summary')
+
+  # Shape lengths, walking each shape's vertices in sequence
+  cur.execute('CREATE TEMP TABLE shape_lengths(shape_id TEXT PRIMARY KEY, shape_length FLOAT)')
+  cur.execute('SELECT shape_id, shape_pt_lat, shape_pt_lon FROM shapes ORDER BY shape_id, shape_pt_sequence')
+  lengths = []
+  for shape_id, vertices in groupby(cur.fetchall(), lambda vertex: vertex[0]):
+    vertices = [(vertex[1], vertex[2]) for vertex in vertices]
+    lengths.append((shape_id, sum(greatCircleDistance(a, b) for a, b in zip(vertices, vertices[1:]))))
+  cur.executemany('INSERT INTO shape_lengths VALUES (?, ?)', lengths)
+
+  cur.execute('''INSERT INTO trip_summary
+    SELECT T.trip_id, T.route_id, T.service_id, T.shape_id, R.route_type_desc,
+    ST.first_arrival_secs, ST.first_departure_secs, ST.last_departure_secs, ST.stop_count, ST.last_departure_secs >= 86400, SL.shape_length
+    FROM trips AS T
+    JOIN (SELECT trip_id, min(arrival_secs) AS first_arrival_secs, min(departure_secs) AS first_departure_secs, max(departure_secs) AS last_departure_secs, count(*) AS stop_count FROM stop_times GROUP BY trip_id) AS ST ON ST.trip_id = T.trip_id
+    LEFT OUTER JOIN routes AS R ON R.route_id = T.route_id
+    LEFT OUTER JOIN shape_lengths AS SL ON SL.shape_id = T.shape_id''')
+  cur.execute('DROP TABLE shape_lengths')
+
+  database.commit()
+
+  return database
+
+def dropOldTripSummary(database):
+  '''
+  Drops the trip_summary table of <database> if it was written by an
+  earlier version of this script, without the first_arrival_secs column,
+  so that it can be derived again.
+  Returns True if it was dropped, else False.
+  '''
+  cur = database.cursor()
+  cur.execute('PRAGMA table_info(trip_summary)')
+  columns = [column[1] for column in cur.fetchall()]
+  if len(columns) == 0 or "first_arrival_secs" in columns:
+    return False
+  cur.execute('DROP TABLE trip_summary')
+  database.commit()
+  return True
+
+def populateServiceDates(database):
+  '''
+  Populates the service_dates table of <database>: one row for every
+  date that each service runs on, as the calendar table's weekdays
+  between its start_date and end_date, with the additions and removals
+  of the calendar_dates table applied. Services that only appear in
+  calendar_dates run on their added dates.
+  Dates are YYYYMMDD integers, e.g. 20131207.
+  The trip_dates view joins this to trip_summary, so that the trips
+  running on a date (including trips that began the day before and run
+  past midnight) are one indexed lookup.
+  Requires calendar, calendar_dates and trip_summary to be populated.
+  The table is emptied first, so this can be run again to re-derive it.
+  Returns <database>.
+  '''
+  cur = database.cursor()
+  cur.execute('CREATE TABLE IF NOT EXISTS service_dates(service_id INTEGER, date_int INTEGER, next_date_int INTEGER)')
+  cur.execute('CREATE VIEW IF NOT EXISTS trip_dates AS SELECT TS.trip_id AS trip_id, SD.date_int AS date_int, SD.date_int AS service_date_int FROM service_dates AS SD JOIN trip_summary AS TS ON TS.service_id = SD.service_id WHERE TS.first_departure_secs < 86400 UNION ALL SELECT TS.trip_id AS trip_id, SD.next_date_int AS date_int, SD.date_int AS service_date_int FROM service_dates AS SD JOIN trip_summary AS TS ON TS.service_id = SD.service_id WHERE TS.crosses_midnight = 1')
+  cur.execute('DELETE FROM service_dates')
+
+  def dateInt(day):
+    return day.year * 10000 + day.month * 100 + day.day
+
+  def toDate(isodate):
+    # "2013-12-07 00:00:00.000"
+    return datetime.date(int(isodate[0:4]), int(isodate[5:7]), int(isodate[8:10]))
+
+  # Regular dates, by day of the week
+  dates = {}
+  cur.execute('SELECT service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday, start_date, end_date FROM calendar')
+  for calendar in cur.fetchall():
+    service_id, week, day, end = calendar[0], calendar[1:8], toDate(calendar[8]), toDate(calendar[9])
+    while day <= end:
+      if week[day.weekday()] == 1:
+        dates[(service_id, day)] = True
+      day += datetime.timedelta(days=1)
+
+  # Exceptions: 1 adds the date, 2 removes it
+  cur.execute('SELECT service_id, date, exception_type FROM calendar_dates')
+  for service_id, date, exception_type in cur.fetchall():
+    if exception_type == 1:
+      dates[(service_id, toDate(date))] = True
+    elif exception_type == 2:
+      dates.pop((service_id, toDate(date)), None)
+
+  rows = [(service_id, dateInt(servicedate), dateInt(servicedate + datetime.timedelta(days=1))) for service_id, servicedate in sorted(dates)]
+  cur.executemany('INSERT INTO service_dates VALUES (?, ?, ?)', rows)
+
+  database.commit()
+
+  return database
+
+def hashGTFSFile(GTFSLocation, filename):
+  '''
+  Returns the SHA-1 hex digest of the contents of <filename> in the GTFS feed at <GTFSLocation> (a directory or a .zip; see openGTFSFile()).
+  '''
+  digest = hashlib.sha1()
+  f = openGTFSFile(GTFSLocation, filename)
+  try:
+    for chunk in iter(lambda: f.read(ZIPBUFFER), ""):
+      digest.update(chunk)
+  finally:
+    f.close()
+  return digest.hexdigest()
+
+def recordFeedHashes(database, GTFSLocation, hashes=None):
+  '''
+  Records the hash of every source file in SOURCES, as loaded from the GTFS feed at <GTFSLocation>, in the feed_metadata table of <database>.
+  <hashes> is an optional {filename: sha1} dictionary of hashes that have already been worked out.
+  Returns <database>.
+  '''
+  if hashes is None:
+    hashes = dict((filename, hashGTFSFile(GTFSLocation, filename)) for tableName, filename in SOURCES)
+  cur = database.cursor()
+  cur.execute('CREATE TABLE IF NOT EXISTS feed_metadata(filename TEXT PRIMARY KEY, tablename TEXT, sha1 TEXT, loaded DATETIME)')
+  loaded = datetime.datetime.now().isoformat(' ')
+  cur.executemany('INSERT OR REPLACE INTO feed_metadata VALUES (?, ?, ?, ?)', [(filename, tableName, hashes[filename], loaded) for tableName, filename in SOURCES])
+  database.commit()
+  return database
+
+def migrateSchema(database):
+  '''
+  Brings the schema of <database>, written by an earlier version of this
+  script, up to that of createGTSFtoSQL_database(), so that its tables
+  can be reloaded: adds the seconds columns (see addSecondsColumns()),
+  and creates the feed_metadata, stop_times_midnight_dwell and DERIVED
+  tables and the trip_dates view if they are missing. A trip_summary
+  table without first_arrival_secs is dropped (see dropOldTripSummary())
+  and so counts as missing.
+  Returns the list of the DERIVED tables that were missing, which need
+  deriving whether or not their sources change.
+  '''
+  addSecondsColumns(database)
+  dropOldTripSummary(database)
+  missing = [tableName for tableName, sources in DERIVED if not hasTable(database, tableName)]
+  cur = database.cursor()
+  cur.execute('CREATE TABLE IF NOT EXISTS feed_metadata(filename TEXT PRIMARY KEY, tablename TEXT, sha1 TEXT, loaded DATETIME)')
+  cur.execute('CREATE TABLE IF NOT EXISTS stop_times_amended(trip_id INTEGER REFERENCES trips(trip_id), service_id INTEGER REFERENCES trips(service_id), arrival_time DATETIME, departure_time DATETIME, monday INTEGER, tuesday INTEGER, wednesday INTEGER, thursday INTEGER, friday INTEGER, saturday INTEGER, sunday INTEGER, stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, stop_headsign TEXT, pickup_type INTEGER, pickup_type_text TEXT, drop_off_type INTEGER, drop_off_type_text TEXT, shape_dist_traveled FLOAT, arrival_secs INTEGER, departure_secs INTEGER)')
+  cur.execute('CREATE TABLE IF NOT EXISTS stop_times_midnight_dwell(trip_id INTEGER REFERENCES trips(trip_id), service_id INTEGER REFERENCES trips(service_id), stop_id INTEGER REFERENCES stops(stop_id), stop_sequence INTEGER, arrival_time DATETIME, departure_time DATETIME, problem TEXT)')
+  cur.execute('CREATE TABLE IF NOT EXISTS trip_summary(trip_id INTEGER PRIMARY KEY, route_id TEXT REFERENCES routes(route_id), service_id INTEGER REFERENCES trips(service_id), shape_id TEXT REFERENCES shapes(shape_id), route_type_desc TEXT REFERENCES routes(route_type_desc), first_arrival_secs INTEGER, first_departure_secs INTEGER, last_departure_secs INTEGER, stop_count INTEGER, crosses_midnight INTEGER, shape_length FLOAT)')
+  cur.execute('CREATE TABLE IF NOT EXISTS service_dates(service_id INTEGER, date_int INTEGER, next_date_int INTEGER)')
+  cur.execute('CREATE VIEW IF NOT EXISTS trip_dates AS SELECT TS.trip_id AS trip_id, SD.date_int AS date_int, SD.date_int AS service_date_int FROM service_dates AS SD JOIN trip_summary AS TS ON TS.service_id = SD.service_id WHERE TS.first_departure_secs < 86400 UNION ALL SELECT TS.trip_id AS trip_id, SD.next_date_int AS date_int, SD.date_int AS service_date_int FROM service_dates AS SD JOIN trip_summary AS TS ON TS.service_id = SD.service_id WHERE TS.crosses_midnight = 1')
+  database.commit()
+  return missing
+
+def updateDatabase(GTFSLocation, database, batchsize=None):
+  '''
+  Updates <database>, written by this script from an earlier feed, to the GTFS feed at <GTFSLocation>.
+  Each source file is hashed and compared with the feed_metadata table. Only the tables whose file has changed are emptied and re-populated, and only the tables in DERIVED that depend on them are re-derived. If any of POSITIONS_SOURCES changed, the vehicle positions worked out from them are dropped (see dropPositions()). For a typical refresh, where only calendar_dates.txt has changed, that is calendar_dates and service_dates.
+  A database without hashes (written before feed_metadata existed) has every table reloaded, once its schema is brought up to date by migrateSchema(), before anything is emptied.
+  The agency table keeps the continent, country and city already in <database>.
+  Returns the list of table names that were re-populated or re-derived.
+  '''
+  missing = migrateSchema(database)
+  cur = database.cursor()
+  cur.execute('SELECT filename, sha1 FROM feed_metadata')
+  previous = dict(cur.fetchall())
+  hashes = dict((filename, hashGTFSFile(GTFSLocation, filename)) for tableName, filename in SOURCES)
+  changed = [tableName for tableName, filename in SOURCES if previous.get(filename) != hashes[filename]]
+
+  # Reload the tables whose file changed
+  cur.execute('SELECT continent, country, city FROM agency LIMIT 1')
+  place = cur.fetchone() or (None, None, None)
+  for tableName, parse, args in parseJobs(GTFSLocation, place[0], place[1], place[2]):
+    if tableName in changed:
+      cur.execute('DELETE FROM %s' % tableName)
+      start = time.time()
+      rows = insertRows(database, tableName, parse(*args), batchsize)
+      print "%s: %i rows reloaded in %.2f seconds." % (tableName, rows, time.time() - start)
+
+  # Re-derive the tables that depend on them
+  populateDerived = {"stop_times_amended": populateStopTimesAmended, "trip_summary": populateTripSummary, "service_dates": populateServiceDates}
+  for tableName, sources in DERIVED:
+    if len(set(sources) & set(changed)) > 0 or tableName in missing:
+      timeTable(database, tableName, populateDerived[tableName], database)
+      changed.append(tableName)
+
+  # Drop the vehicle positions worked out from the old tables, so that no day is resumed from them
+  if len(set(POSITIONS_SOURCES) & set(changed)) > 0:
+    changed.extend(dropPositions(database))
+
+  if len(changed) > 0:
+    cur.execute('ANALYZE')
+  recordFeedHashes(database, GTFSLocation, hashes)
+
+  return changed
+
+def dropPositions(database):
+  '''
+  Drops every day's intervals table (see intervalsTableName()) of
+  <database>, and empties the intervals, intervals_done, intervals_info
+  and trajectories tables, as AB_Class.Database.dropIntervals does for
+  one day, so that Database.populateIntervals starts every day afresh
+  rather than resuming from positions of an older feed.
+  Returns the list of the table names dropped or emptied.
   '''
-  def calendarOffset(weekbinary):
-    '''
-    <weekbinary> is a list of the form [1,1,1,1,1,0,0] (example)
-    where the digits are binary indications of whether the trip runs on
-    a given day, where each number refers to the week MTWTFSS
-    '''
-    origmon, origtue, origwed, origthu, origfri, origsat, origsun = weekbinary[0], weekbinary[1],weekbinary[2], weekbinary[3], weekbinary[4], weekbinary[5], weekbinary[6]
-    return [origsun, origmon, origtue, origwed, origthu, origfri, origsat]
-
-  def maxBinary(week1, week2):
-    week = []
-    i = 0
-    for day in week1:
-      week.append(max(day, week2[i]))
-      i+=1
-    return week
+  cur = database.cursor()
+  cur.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name GLOB "intervals_[0-9]*"')
+  dropped = [table[0] for table in cur.fetchall()]
+  for tableName in dropped:
+    cur.execute('DROP TABLE %s' % tableName)
+  for tableName in ["intervals", "intervals_done", "intervals_info", "trajectories"]:
+    if hasTable(database, tableName):
+      cur.execute('DELETE FROM %s' % tableName)
+      dropped.append(tableName)
+  database.commit()
+  return dropped
+
+def greatCircleDistance(a, b):
+  '''
+  Returns the great-circle (haversine) distance in metres between <a> and <b>, two (lat, lon) tuples in WGS84 degrees.
+  '''
+  lat1, lon1, lat2, lon2 = radians(a[0]), radians(a[1]), radians(b[0]), radians(b[1])
+  h = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+  return 2 * EARTHRADIUS * asin(sqrt(h))
 
+def hasTable(database, tableName):
+  '''
+  Returns True if <database> has a table called <tableName>, else False.
+  '''
   cur = database.cursor()
+  cur.execute('SELECT count(*) FROM sqlite_master WHERE type = "table" AND name = ?', (tableName,))
+  return cur.fetchone()[0] > 0
 
-  # Build a concordance from trip_id to service_id
-  cur.execute('SELECT trip_id, service_id FROM trips')
-  trip_service = {}
-  for tripserv in cur.fetchall():
-    trip_id, service_id = tripserv[0], tripserv[1]
-    trip_service[trip_id] = service_id
-
-  # Build a concordance from service_id to day of the week
-  cur.execute('SELECT service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday FROM calendar')
-  servday = {}
-  for servcal in cur.fetchall():
-    service_id = servcal[0]
-    monday, tuesday, wednesday, thursday, friday, saturday, sunday = servcal[1], servcal[2], servcal[3], servcal[4], servcal[5], servcal[6], servcal[7]
-    servday[service_id] = [int(monday), int(tuesday), int(wednesday), int(thursday), int(friday), int(saturday), int(sunday)]
-
-  # Copy the rows of calendar into stop_times_amended
-  # For each stop in a trip (record of stop_times), check if it is after midnight
-  cur.execute('SELECT * FROM stop_times')
-  for stoppedtrip in cur.fetchall():
-    trip_id = stoppedtrip[0]
-    arrival_time = stoppedtrip[1]
-    departure_time = departure_time = stoppedtrip[2]
-    stop_id = stoppedtrip[3]
-    stop_sequence = stoppedtrip[4]
-    stop_headsign = stoppedtrip[5]
-    pickup_type = stoppedtrip[6]
-    pickup_type_text = stoppedtrip[7]
-    drop_off_type = stoppedtrip[8]
-    drop_off_type_text = stoppedtrip[9]
-    shape_dist_traveled = stoppedtrip[10]
-
-    service_id = trip_service[trip_id]
-    week = servday[service_id]
-
-    arriveafter, departafter = False, False
-    if int(arrival_time[0:2]) >= 24:
-      # Then the trip arrives at the stop after or at midnight
-      newarrivaltime = int(arrival_time[0:2])-24
-      if len(str(newarrivaltime)) == 1:
-		# Then append a 0
-		newarrivaltime = "0" + str(newarrivaltime)
-      arrival_time = str(newarrivaltime) + arrival_time[2:]
-      # Offset the calendar by one day
-      week_arrive = calendarOffset(week)
-      arriveafter = True
-
-    if int(departure_time[0:2]) >= 24:
-      newdeparturetime = int(departure_time[0:2])-24
-      if len(str(newdeparturetime)) == 1:
-		# Then append a 0
-		newdeparturetime = "0" + str(newdeparturetime)
-      departure_time = str(newdeparturetime) + departure_time[2:]
-      # Offset the calendar by one day
-      week_depart = calendarOffset(week)
-      departafter = True
-
-    if arriveafter == False and departafter == True:
-      # Then the trip arrives at a stop, dwells, and then departs
-      # and the clock ticks over midnight during the dwell
-      # The calendar needs to reflect this
-      # I made maxBinary to do something about this, but I don't like it
-      ## week = maxBinary[week_arrive, week_depart]
-      raise AttributeError
-
-    elif arriveafter == True and departafter == False:
-      # This is impossible
-      raise AttributeError
-
-    elif arriveafter == True and departafter == True:
-      if week_arrive == week_depart:
-        # If they're equal, just take the arrive one as authoritative
-        week = week_arrive
+def addSecondsColumns(database):
+  '''
+  Adds the integer arrival_secs and departure_secs columns to the stop_times and stop_times_amended tables of a <database> written before they existed, and fills them from the arrival_time and departure_time strings.
+  Tables that already have the columns are left alone.
+  Returns <database>.
+  '''
+  cur = database.cursor()
+  for tableName in ["stop_times", "stop_times_amended"]:
+    cur.execute('PRAGMA table_info(%s)' % tableName)
+    if "arrival_secs" not in [column[1] for column in cur.fetchall()]:
+      for column in ["arrival", "departure"]:
+        cur.execute('ALTER TABLE %s ADD COLUMN %s_secs INTEGER' % (tableName, column))
+        # "HH:MM:SS.000"
+        cur.execute('UPDATE %s SET %s_secs = CAST(substr(%s_time, 1, 2) AS INTEGER) * 3600 + CAST(substr(%s_time, 4, 2) AS INTEGER) * 60 + CAST(substr(%s_time, 7, 2) AS INTEGER) WHERE %s_time IS NOT NULL' % (tableName, column, column, column, column, column))
+  database.commit()
+  return database
+
+def setBulkLoadPragmas(database, cache_kib=200000):
+  '''
+  Trades durability for speed while the tables of <database> are being
+  (re)built from a GTFS feed: the rollback journal is kept in memory,
+  SQLite no longer waits on the disk after each write, and the page cache
+  is raised to <cache_kib> kibibytes.
+  A crash part-way through a bulk load can leave a corrupt database, which
+  is no worse than a half-built one: delete it and run the load again.
+  Use resetPragmas(<database>) once the load is finished.
+  Returns <database>.
+  '''
+  cur = database.cursor()
+  cur.execute('PRAGMA journal_mode = MEMORY')
+  cur.execute('PRAGMA synchronous = OFF')
+  cur.execute('PRAGMA cache_size = -%i' % cache_kib)
+  cur.execute('PRAGMA temp_store = MEMORY')
+  return database
+
+def resetPragmas(database):
+  '''
+  Returns the journal, synchronous and cache settings of <database> to the
+  SQLite defaults after setBulkLoadPragmas().
+  Returns <database>.
+  '''
+  cur = database.cursor()
+  cur.execute('PRAGMA journal_mode = DELETE')
+  cur.execute('PRAGMA synchronous = FULL')
+  cur.execute('PRAGMA cache_size = -2000')
+  cur.execute('PRAGMA temp_store = DEFAULT')
+  return database
+
+def insertRows(database, tableName, rows, batchsize=None):
+  '''
+  Writes the tuples yielded by <rows> (any iterable, usually a generator)
+  into <tableName> of <database>, <batchsize> rows per executemany() call,
+  so only one batch is ever held in memory.
+  All of the batches are written in a single transaction, which is
+  committed once <rows> is exhausted.
+  <batchsize> defaults to BATCHSIZE.
+  Returns the number of rows written.
+  '''
+  if batchsize is None:
+    batchsize = BATCHSIZE
+  cur = database.cursor()
+  rows = iter(rows)
+  count = 0
+  batch = list(islice(rows, batchsize))
+  if len(batch) > 0:
+    query = 'INSERT INTO %s VALUES (%s)' % (tableName, ", ".join(["?"] * len(batch[0])))
+  while len(batch) > 0:
+    cur.executemany(query, batch)
+    count += len(batch)
+    batch = list(islice(rows, batchsize))
+  database.commit()
+  return count
+
+def parseJobs(GTFSLocation, continent, country, city):
+  '''
+  Returns the (tableName, parse function, arguments) of every table that is parsed straight from the GTFS feed at <GTFSLocation>, in the order that the script populates them.
+  '''
+  return [
+    ("routes", parseRoutes, (GTFSLocation,)),
+    ("agency", parseAgency, (GTFSLocation, continent, country, city)),
+    ("calendar", parseCalendar, (GTFSLocation,)),
+    ("calendar_dates", parseCalendarDates, (GTFSLocation,)),
+    ("trips", parseTrips, (GTFSLocation,)),
+    ("shapes", parseShapes, (GTFSLocation,)),
+    ("feed_info", parseFeedInfo, (GTFSLocation,)),
+    ("stops", parseStops, (GTFSLocation,)),
+    ("stop_times", parseStopTimes, (GTFSLocation,)),
+    ]
+
+def parseWorker(queue, tableName, parse, args, batchsize):
+  '''
+  Body of each worker process of populateParallel().
+  Puts (<tableName>, batch) on <queue> for every <batchsize> rows yielded by <parse>(*<args>), then (<tableName>, None) once they are exhausted.
+  If parsing fails, puts (<tableName>, traceback string) instead, so that the writer can stop and report it.
+  '''
+  try:
+    rows = parse(*args)
+    batch = list(islice(rows, batchsize))
+    while len(batch) > 0:
+      queue.put((tableName, batch))
+      batch = list(islice(rows, batchsize))
+    queue.put((tableName, None))
+  except:
+    queue.put((tableName, traceback.format_exc()))
+
+def populateParallel(GTFSLocation, database, continent, country, city, batchsize=None):
+  '''
+  Populates every table of <database> that comes straight from the GTFS feed at <GTFSLocation>, as the populate* functions do one after another, but with each table's file parsed in its own worker process (see parseWorker()).
+  SQLite allows only one writer, so this process is the single writer: it takes the parsed batches off a bounded queue as they arrive and writes them with executemany(), all in one transaction that is committed once every worker has finished.
+  populateStopTimesAmended(), populateTripSummary() and populateServiceDates() are then run, once their inputs are committed.
+  <batchsize> (rows per batch) defaults to BATCHSIZE.
+  Raises RuntimeError if any table fails to parse, or if a worker dies without reporting back (e.g. killed by the OOM killer; the queue is checked every WORKERPOLL seconds). The other workers are then stopped and the transaction rolled back, so that no table is left half written.
+  Returns <database>.
+  '''
+  if batchsize is None:
+    batchsize = BATCHSIZE
+  jobs = parseJobs(GTFSLocation, continent, country, city)
+  queue = multiprocessing.Queue(QUEUEDEPTH * len(jobs))
+  workers = [multiprocessing.Process(target=parseWorker, args=(queue, tableName, parse, args, batchsize)) for tableName, parse, args in jobs]
+  for worker in workers:
+    worker.start()
+
+  cur = database.cursor()
+  start = time.time()
+  counts = dict((tableName, 0) for tableName, parse, args in jobs)
+  queries = {}
+  finished = set()
+  try:
+    while len(finished) < len(workers):
+      try:
+        tableName, batch = queue.get(timeout=WORKERPOLL)
+      except Empty:
+        # A worker that was killed never posts its result; one that finished exits with 0
+        for (workerTable, parse, args), worker in zip(jobs, workers):
+          if workerTable not in finished and worker.exitcode not in [None, 0]:
+            raise RuntimeError("The worker parsing %s exited with code %i without finishing." % (workerTable, worker.exitcode))
+        continue
+      if batch is None:
+        # That table's worker is finished
+        finished.add(tableName)
+        print "%s: %i rows in %.2f seconds (%.0f rows/s)." % (tableName, counts[tableName], time.time() - start, counts[tableName] / max(time.time() - start, 1e-6))
+      elif isinstance(batch, str):
+        raise RuntimeError("Parsing %s failed:\n%s" % (tableName, batch))
       else:
-        raise Exception
+        if tableName not in queries:
+          queries[tableName] = 'INSERT INTO %s VALUES (%s)' % (tableName, ", ".join(["?"] * len(batch[0])))
+        cur.executemany(queries[tableName], batch)
+        counts[tableName] += len(batch)
+    database.commit()
+  except:
+    for worker in workers:
+      worker.terminate()
+    database.rollback()
+    raise
+  for worker in workers:
+    worker.join()
+
+  timeTable(database, "stop_times_amended", populateStopTimesAmended, database)
+  timeTable(database, "trip_summary", populateTripSummary, database)
+  timeTable(database, "service_dates", populateServiceDates, database)
+
+  return database
 
-    cur.execute('INSERT INTO stop_times_amended VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (trip_id, service_id, arrival_time, departure_time, week[0], week[1], week[2], week[3], week[4], week[5], week[6], stop_id, stop_sequence, stop_headsign, pickup_type, pickup_type_text, drop_off_type, drop_off_type_text, shape_dist_traveled))
+def countRows(database, tableName):
+  '''
+  Returns the number of rows in <tableName> of <database> (Integer).
+  '''
+  cur = database.cursor()
+  cur.execute('SELECT count(*) FROM %s' % tableName)
+  return cur.fetchone()[0]
 
+def timeTable(database, tableName, populate, *args, **kwargs):
+  '''
+  Runs <populate>(*<args>, **<kwargs>), one of the populate* functions,
+  and prints how many rows it left in <tableName> of <database> and how
+  many rows per second that represents.
+  Returns (rows, seconds).
+  '''
+  start = time.time()
+  populate(*args, **kwargs)
+  seconds = time.time() - start
+  rows = countRows(database, tableName)
+  print "%s: %i rows in %.2f seconds (%.0f rows/s)." % (tableName, rows, seconds, rows / max(seconds, 1e-6))
+  return (rows, seconds)
+
+def createIndexes(database, tables=None, analyze=True):
+  '''
+  Builds the indexes in INDEXES (and those of each day's intervals
+  table, see intervalsIndexes) on <database>, then runs ANALYZE so the
+  query planner has statistics to choose between them.
+  Building indexes after the tables are populated is much faster than
+  keeping them up to date row by row, so this runs once the populate*
+  functions are finished. It can be run again on an existing database:
+  indexes that already exist are left alone.
+  <tables> is an optional list of table names to limit the indexes to.
+  Returns <database>.
+  '''
+  cur = database.cursor()
+  # Each day's intervals table has indexes like those of intervals
+  cur.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name GLOB "intervals_[0-9]*"')
+  indexes = INDEXES + [index for table in cur.fetchall() for index in intervalsIndexes(table[0])]
+  for name, table, columns in indexes:
+    if tables is None or table in tables:
+      cur.execute('CREATE INDEX IF NOT EXISTS %s ON %s(%s)' % (name, table, columns))
+  if analyze:
+    cur.execute('ANALYZE')
   database.commit()
+  return database
+
+def intervalsTableName(dateInt):
+  '''
+  Returns the name of the table holding the intervals of the day
+  <dateInt> (an Integer, e.g. 20131209), e.g. "intervals_20131209".
+  '''
+  return "intervals_%i" % dateInt
+
+def intervalsIndexes(tableName):
+  '''
+  Returns the (name, table, columns) of the indexes of the intervals
+  table <tableName>, as in INDEXES.
+  '''
+  return [("idx_%s_seconds" % tableName, tableName, "seconds"), ("idx_%s_trip_id" % tableName, tableName, "trip_id")]
+
+def createIntervalsTable(database, tableName):
+  '''
+  Creates the intervals table <tableName> (see intervalsTableName) in
+  <database>, with its indexes, if it does not already exist.
+  Returns True if it was created.
+  '''
+  if hasTable(database, tableName):
+    return False
+  cur = database.cursor()
+  cur.execute('CREATE TABLE %s(%s)' % (tableName, INTERVALS_COLUMNS))
+  for name, table, columns in intervalsIndexes(tableName):
+    cur.execute('CREATE INDEX %s ON %s(%s)' % (name, table, columns))
+  return True
 
 ################################################################################
 ############################### Script #########################################
@@ -1049,26 +1702,31 @@ def populateStopTimesAmended(database):
 
 if __name__ == "__main__":
 
-  # Use SQLlite3 as the database application progamming interface
-  import sqlite3 as dbapi
-
   # Used for command line argument passing
   import argparse
 
   # Cmd line args setup
   parser = argparse.ArgumentParser()
-  parser.add_argument("GTFSpath", help="enter the path to the folder containing input GTFS files (must have trailing slash '/')")
-  parser.add_argument("dbpath", help="enter the path to generate output SQLite db (must have trailing slash '/')")
-  parser.add_argument("continent", help="enter the continent the GTFS feed is from")
-  parser.add_argument("country", help="enter the country the GTFS feed is from")
-  parser.add_argument("city", help="enter the city the GTFS feed is from")
+  parser.add_argument("GTFSpath", nargs="?", help="enter the path to the folder of input GTFS files, or to the GTFS .zip archive")
+  parser.add_argument("dbpath", nargs="?", help="enter the path to generate output SQLite db (must have trailing slash '/')")
+  parser.add_argument("continent", nargs="?", help="enter the continent the GTFS feed is from")
+  parser.add_argument("country", nargs="?", help="enter the country the GTFS feed is from")
+  parser.add_argument("city", nargs="?", help="enter the city the GTFS feed is from")
+  parser.add_argument("--indexdb", help="build the indexes (and any missing arrival_secs/departure_secs columns, trip_summary and service_dates tables) on this existing SQLite db (ending '.db') instead of writing a new database")
+  parser.add_argument("--update", help="update this existing SQLite db (ending '.db') to the feed at GTFSpath, reloading only the tables whose source file has changed")
+  parser.add_argument("--bulk", action="store_true", help="bulk-load mode: relax the journal/synchronous settings and enlarge the cache while the tables are written")
+  parser.add_argument("--parallel", action="store_true", help="parse each table's file in its own worker process, with this process as the single database writer")
+  parser.add_argument("--batchsize", type=int, default=BATCHSIZE, help="rows per executemany() batch (default %i)" % BATCHSIZE)
   args = parser.parse_args()
+  if args.update is not None and args.GTFSpath is None:
+    parser.error("GTFSpath is required to update a database")
+  if args.indexdb is None and args.update is None and args.city is None:
+    parser.error("GTFSpath, dbpath, continent, country and city are required to write a new database")
 
   # Write a new database?
-  writeDB = True
+  writeDB = args.indexdb is None and args.update is None
 
   # Time is used to name your DB to avoid overwrites
-  import time
   now = time.strftime("%Y%m%d_%H%M%S", time.localtime())
 
   # # Which GTFS? Where is this place?
@@ -1083,43 +1741,68 @@ if __name__ == "__main__":
   # db_str = "GTFSSQL_" + city + "_" + now + ".db"
   # db_pathstr = "/media/alphabeta/RESQUILLEUR/Documents/WellingtonTransportViewer/Data/Databases/" + db_str # Path and name of DB
 
-  db_str = "GTFSSQL_" + args.city + "_" + now + ".db"
-  db_pathstr = args.dbpath + db_str
+  if writeDB == True:
+    db_str = "GTFSSQL_" + args.city + "_" + now + ".db"
+    db_pathstr = args.dbpath + db_str
 
   if writeDB == True:
 
     # Initialise database and write (empty) tables according to database schema
     GTFSDB = createGTSFtoSQL_database(db_pathstr)
+    if args.bulk:
+      setBulkLoadPragmas(GTFSDB)
 
-    # Routes (20131104)
-    populateRoutes(args.GTFSpath, GTFSDB)
+    if args.parallel:
+      # One parse worker per table, writing through this process (20261018)
+      populateParallel(args.GTFSpath, GTFSDB, args.continent, args.country, args.city, batchsize=args.batchsize)
 
-    # Agencies (20131104)
-    populateAgency(args.GTFSpath, GTFSDB, args.continent, args.country, args.city)
+    else:
+      # Routes (20131104)
+      timeTable(GTFSDB, "routes", populateRoutes, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
 
-    # Calendar (20131104)
-    populateCalendar(args.GTFSpath, GTFSDB)
+      # Agencies (20131104)
+      timeTable(GTFSDB, "agency", populateAgency, args.GTFSpath, GTFSDB, args.continent, args.country, args.city, batchsize=args.batchsize)
 
-    # Calendar dates (exceptions) (20131106)
-    populateCalendarDates(args.GTFSpath, GTFSDB)
+      # Calendar (20131104)
+      timeTable(GTFSDB, "calendar", populateCalendar, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
 
-    # Trips (20131106)
-    populateTrips(args.GTFSpath, GTFSDB)
+      # Calendar dates (exceptions) (20131106)
+      timeTable(GTFSDB, "calendar_dates", populateCalendarDates, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
 
-    # Shapes (20131106)
-    populateShapes(args.GTFSpath, GTFSDB)
+      # Trips (20131106)
+      timeTable(GTFSDB, "trips", populateTrips, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
 
-    # Feed publisher (20131106)
-    populateFeedInfo(args.GTFSpath, GTFSDB)
+      # Shapes (20131106)
+      timeTable(GTFSDB, "shapes", populateShapes, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
 
-    # Stops (20131106)
-    populateStops(args.GTFSpath, GTFSDB)
+      # Feed publisher (20131106)
+      timeTable(GTFSDB, "feed_info", populateFeedInfo, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
 
-    # Stop times (20131106)
-    populateStopTimes(args.GTFSpath, GTFSDB)
+      # Stops (20131106)
+      timeTable(GTFSDB, "stops", populateStops, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
 
-    # Amended stop times (20131224)
-    populateStopTimesAmended(GTFSDB)
+      # Stop times (20131106)
+      timeTable(GTFSDB, "stop_times", populateStopTimes, args.GTFSpath, GTFSDB, batchsize=args.batchsize)
+
+      # Amended stop times (20131224)
+      timeTable(GTFSDB, "stop_times_amended", populateStopTimesAmended, GTFSDB)
+
+      # Trip summaries (20261018)
+      timeTable(GTFSDB, "trip_summary", populateTripSummary, GTFSDB)
+
+      # Service dates (20261018)
+      timeTable(GTFSDB, "service_dates", populateServiceDates, GTFSDB)
+
+    # Source file hashes, for later updates
+    recordFeedHashes(GTFSDB, args.GTFSpath)
+
+    # Indexes and planner statistics, once the tables are full
+    start = time.time()
+    createIndexes(GTFSDB)
+    print "Indexes built in %.2f seconds." % (time.time() - start)
+
+    if args.bulk:
+      resetPragmas(GTFSDB)
     
     print "TODO Note: Intervals table is not populated by this script."
 
@@ -1129,6 +1812,33 @@ if __name__ == "__main__":
 
     print "No database written."
 
+    if args.indexdb is not None:
+      # Index an existing database
+      GTFSDB = dbapi.connect(args.indexdb)
+      start = time.time()
+      addSecondsColumns(GTFSDB)
+      dropOldTripSummary(GTFSDB)
+      if not hasTable(GTFSDB, "trip_summary"):
+        timeTable(GTFSDB, "trip_summary", populateTripSummary, GTFSDB)
+      if not hasTable(GTFSDB, "service_dates"):
+        timeTable(GTFSDB, "service_dates", populateServiceDates, GTFSDB)
+      createIndexes(GTFSDB)
+      print "Indexes built in %.2f seconds on %s." % (time.time() - start, args.indexdb)
+
+    if args.update is not None:
+      # Update an existing database to a newer feed
+      GTFSDB = dbapi.connect(args.update)
+      if args.bulk:
+        setBulkLoadPragmas(GTFSDB)
+      start = time.time()
+      updated = updateDatabase(args.GTFSpath, GTFSDB, batchsize=args.batchsize)
+      if args.bulk:
+        resetPragmas(GTFSDB)
+      if len(updated) > 0:
+        print "Updated %s in %.2f seconds: %s." % (args.update, time.time() - start, ", ".join(updated))
+      else:
+        print "%s is already up to date." % args.update
+
 
 ## Quick update to an existing table
 #GTFSDB = dbapi.connect("/media/alphabeta/RESQUILLEUR/Documents/WellingtonTransportViewer/Data/Databases/GTFSSQL_Wellington_20131208_215725.db") # Connect/create DB
@@ -0,0 +1,191 @@
+#-------------------------------------------------------------------------------
+# Name:         AB_SyntheticGTFS.py
+# Purpose:      Writes synthetic GTFS feeds of a configurable size, so that
+#               AB_GTFStoSQL.py and AB_Class.py can be timed against the same
+#               reproducible workload (see AB_Benchmark.py).
+#
+#               Each route runs out and back along its own straight shape
+#               between two points near Wellington, with evenly spaced stops.
+#               Trips are spread through the day, and a number of them start
+#               late enough to run past midnight (times beyond 24:00:00, as
+#               the GTFS allows).
+#               Services: 1 runs Monday to Friday, 2 on Saturdays and 3 on
+#               Sundays. Service 1 is cancelled and service 3 added on the
+#               Christmas day inside the feed's date range.
+#
+# Inputs:       The size of the feed (see writeSyntheticFeed).
+# Outputs:      A folder of GTFS .txt files, or a .zip archive of them.
+#
+# Created:            20261018
+#-------------------------------------------------------------------------------
+
+import os
+import csv
+import random
+import zipfile
+import datetime
+
+from cStringIO import StringIO
+from math import cos, radians
+
+# The feed's date range
+STARTDATE = datetime.date(2013, 12, 1)
+ENDDATE = datetime.date(2013, 12, 31)
+
+# Modes the routes cycle through (GTFS route_type): bus, rail, ferry, tram
+ROUTETYPES = [3, 2, 4, 0]
+
+# Roughly the centre of Wellington, and how far (in degrees) the routes spread from it
+CENTRE = (-41.29, 174.78)
+SPREAD = 0.15
+
+# First departure of the day and the gap (seconds) between consecutive stops
+FIRSTDEPARTURE = 5 * 60 * 60
+STOPGAP = 120
+
+# Metres per degree of latitude
+METRESPERDEGREE = 111195.0
+
+def secondsToGTFSTime(seconds):
+  '''
+  Returns <seconds> since midnight as a GTFS "H:MM:SS" time string, which
+  goes past 24 hours for times after midnight (e.g. 90000 -> "25:00:00").
+  '''
+  hours, remainder = divmod(seconds, 3600)
+  return "%i:%02i:%02i" % (hours, remainder // 60, remainder % 60)
+
+def syntheticTables(routes=10, tripsPerRoute=50, stopsPerTrip=20, shapeVertices=100, midnightTrips=5, seed=0):
+  '''
+  Returns a dictionary of {filename: (header, rows)} for a synthetic GTFS
+  feed, where header is a list of column names and rows a list of tuples.
+
+  <routes> routes, each with <tripsPerRoute> trips (alternately outbound
+  and inbound), of <stopsPerTrip> stops along a shape of <shapeVertices>
+  vertices. <midnightTrips> of each route's trips start shortly before
+  midnight and finish after it.
+  <seed> seeds the random placement of the routes, so the same arguments
+  always give the same feed.
+  '''
+  rand = random.Random(seed)
+  tables = {}
+
+  tables["agency.txt"] = (["agency_id", "agency_name", "agency_url", "agency_timezone", "agency_lang", "agency_phone"],
+    [("SYN", "Synthetic Transit", "http://www.example.com", "Pacific/Auckland", "en", "0800 000 000")])
+
+  tables["feed_info.txt"] = (["feed_publisher_name", "feed_publisher_url", "feed_lang", "feed_start_date", "feed_end_date", "feed_version"],
+    [("Synthetic Transit", "http://www.example.com", "en", STARTDATE.strftime("%Y%m%d"), ENDDATE.strftime("%Y%m%d"), "1")])
+
+  tables["calendar.txt"] = (["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "start_date", "end_date"],
+    [(1, 1, 1, 1, 1, 1, 0, 0, STARTDATE.strftime("%Y%m%d"), ENDDATE.strftime("%Y%m%d")),
+     (2, 0, 0, 0, 0, 0, 1, 0, STARTDATE.strftime("%Y%m%d"), ENDDATE.strftime("%Y%m%d")),
+     (3, 0, 0, 0, 0, 0, 0, 1, STARTDATE.strftime("%Y%m%d"), ENDDATE.strftime("%Y%m%d"))])
+
+  # Christmas runs to a Sunday timetable
+  christmas = datetime.date(STARTDATE.year, 12, 25).strftime("%Y%m%d")
+  tables["calendar_dates.txt"] = (["service_id", "date", "exception_type"], [(1, christmas, 2), (3, christmas, 1)])
+
+  routerows, triprows, shaperows, stoprows, stoptimerows = [], [], [], [], []
+  trip_id, stop_id = 1, 1
+  services = [1, 1, 1, 2, 3] # Most trips are weekday trips
+  for r in range(routes):
+    route_id = "R%03i" % (r + 1)
+    route_type = ROUTETYPES[r % len(ROUTETYPES)]
+    routerows.append((route_id, "SYN", str(r + 1), "Synthetic route %i" % (r + 1), "", route_type, "", "", ""))
+
+    # A straight shape between two random points, one way and back
+    start = (CENTRE[0] + rand.uniform(-SPREAD, SPREAD), CENTRE[1] + rand.uniform(-SPREAD, SPREAD))
+    end = (CENTRE[0] + rand.uniform(-SPREAD, SPREAD), CENTRE[1] + rand.uniform(-SPREAD, SPREAD))
+    metresPerDegreeLon = METRESPERDEGREE * cos(radians(CENTRE[0]))
+    length = ((end[0] - start[0]) ** 2 * METRESPERDEGREE ** 2 + (end[1] - start[1]) ** 2 * metresPerDegreeLon ** 2) ** 0.5
+    for direction, (a, b) in enumerate([(start, end), (end, start)]):
+      shape_id = "%s_%i" % (route_id, direction)
+      for v in range(shapeVertices):
+        f = v / float(shapeVertices - 1)
+        shaperows.append((shape_id, round(a[0] + (b[0] - a[0]) * f, 7), round(a[1] + (b[1] - a[1]) * f, 7), v + 1, round(length * f / 1000.0, 4)))
+
+    # Stops evenly along the shape, shared by both directions
+    stopids = []
+    for s in range(stopsPerTrip):
+      f = s / float(stopsPerTrip - 1)
+      stoprows.append((stop_id, 1000 + stop_id, "Stop %i" % stop_id, "", round(start[0] + (end[0] - start[0]) * f, 7), round(start[1] + (end[1] - start[1]) * f, 7), "1", "", 0, ""))
+      stopids.append(stop_id)
+      stop_id += 1
+
+    # Trips spread through the day, then the over-midnight ones
+    duration = (stopsPerTrip - 1) * STOPGAP
+    headway = max((23 * 60 * 60 - FIRSTDEPARTURE - duration) // max(tripsPerRoute - midnightTrips, 1), 60)
+    departures = [FIRSTDEPARTURE + t * headway for t in range(max(tripsPerRoute - midnightTrips, 0))]
+    departures += [24 * 60 * 60 - duration // 2 + t * 60 for t in range(min(midnightTrips, tripsPerRoute))]
+    for t, departure in enumerate(departures):
+      direction = t % 2
+      triprows.append((route_id, services[t % len(services)], trip_id, "Synthetic route %i" % (r + 1), "", direction, "", "%s_%i" % (route_id, direction), ""))
+      sequence = stopids if direction == 0 else stopids[::-1]
+      for s, stop in enumerate(sequence):
+        arrival = departure + s * STOPGAP
+        # A short dwell at the middle stop
+        dwell = 30 if s == stopsPerTrip // 2 else 0
+        distance = round(length * s / float(stopsPerTrip - 1) / 1000.0, 4)
+        stoptimerows.append((trip_id, secondsToGTFSTime(arrival), secondsToGTFSTime(arrival + dwell), stop, s + 1, "", 0, 0, distance))
+      trip_id += 1
+
+  tables["routes.txt"] = (["route_id", "agency_id", "route_short_name", "route_long_name", "route_desc", "route_type", "route_url", "route_color", "route_text_color"], routerows)
+  tables["trips.txt"] = (["route_id", "service_id", "trip_id", "trip_headsign", "trip_short_name", "direction_id", "block_id", "shape_id", "wheelchair_accessible"], triprows)
+  tables["shapes.txt"] = (["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence", "shape_dist_traveled"], shaperows)
+  tables["stops.txt"] = (["stop_id", "stop_code", "stop_name", "stop_desc", "stop_lat", "stop_lon", "zone_id", "stop_url", "location_type", "parent_station"], stoprows)
+  tables["stop_times.txt"] = (["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence", "stop_headsign", "pickup_type", "drop_off_type", "shape_dist_traveled"], stoptimerows)
+
+  return tables
+
+def writeSyntheticFeed(outpath, routes=10, tripsPerRoute=50, stopsPerTrip=20, shapeVertices=100, midnightTrips=5, seed=0):
+  '''
+  Writes a synthetic GTFS feed (see syntheticTables for the arguments) to
+  <outpath>: a .zip archive if <outpath> ends with ".zip", otherwise a
+  folder of .txt files, created if need be.
+  Returns <outpath>, ready to be given to AB_GTFStoSQL.py.
+  '''
+  tables = syntheticTables(routes, tripsPerRoute, stopsPerTrip, shapeVertices, midnightTrips, seed)
+  if outpath.endswith(".zip"):
+    archive = zipfile.ZipFile(outpath, "w", zipfile.ZIP_DEFLATED)
+    for filename, (header, rows) in sorted(tables.items()):
+      f = StringIO()
+      writeCSV(f, header, rows)
+      archive.writestr(filename, f.getvalue())
+    archive.close()
+  else:
+    if not os.path.isdir(outpath):
+      os.makedirs(outpath)
+    for filename, (header, rows) in sorted(tables.items()):
+      with open(os.path.join(outpath, filename), "wb") as f:
+        writeCSV(f, header, rows)
+  return outpath
+
+def writeCSV(f, header, rows):
+  '''
+  Writes <header> and then <rows> to the open file <f> as CSV, with
+  "\r\n" line endings as most agencies publish.
+  '''
+  writer = csv.writer(f)
+  writer.writerow(header)
+  writer.writerows(rows)
+
+################################################################################
+############################### Script #########################################
+################################################################################
+
+if __name__ == "__main__":
+
+  # Used for command line argument passing
+  import argparse
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("outpath", help="enter the folder to write the feed to, or a path ending '.zip' to write an archive")
+  parser.add_argument("--routes", type=int, default=10, help="number of routes (default 10)")
+  parser.add_argument("--trips", type=int, default=50, help="trips per route (default 50)")
+  parser.add_argument("--stops", type=int, default=20, help="stops per trip (default 20)")
+  parser.add_argument("--vertices", type=int, default=100, help="vertices per shape (default 100)")
+  parser.add_argument("--midnight", type=int, default=5, help="trips per route that run past midnight (default 5)")
+  parser.add_argument("--seed", type=int, default=0, help="random seed (default 0)")
+  args = parser.parse_args()
+
+  writeSyntheticFeed(args.outpath, args.routes, args.trips, args.stops, args.vertices, args.midnight, args.seed)
+  print "Synthetic feed written: %s (%i routes, %i trips, %i stop times)." % (args.outpath, args.routes, args.routes * args.trips, args.routes * args.trips * args.stops)
@@ -85,28 +85,24 @@ class DTI_GTFSGraph(object):
         if verbose: print("There are %i trips after mode subset." % len(subsettrips))
         # Optional calendar_dates subset
         if self.date is not None:
-            # Add or remove relevant exceptions
-            def additionsandremovals():
-                exceptions = {"Added": [], "Removed": []}
-                month = self.date.month
-                if month < 10: month = "0" + str(month)
-                day = self.date.day
-                if day < 10: day = "0" + str(day)
-                datestr = str(self.date.year) + "-" + str(month) + "-" + str(day)
-                for exceptiontype in exceptions:
-                    q = Template('SELECT trips.trip_id, calendar_dates.service_id, calendar_dates.exception_text FROM calendar_dates JOIN trips ON trips.service_id = calendar_dates.service_id WHERE calendar_dates.date LIKE "$date%" AND calendar_dates.exception_text = "$exception"')
-                    query = q.substitute(date = datestr, exception = exceptiontype)
-                    self.database.cur.execute(query)
-                    if verbose: print query
-                    exceptions[exceptiontype] = [trip[0] for trip in self.database.cur.fetchall()]
-                return exceptions
-            exceptions =  additionsandremovals()
+            # The trips running on the date, with calendar_dates additions
+            # and removals and the over-midnight rollover already applied
+            def tripsondate():
+                q = Template('SELECT DISTINCT TD.trip_id, TS.route_id, TS.route_type_desc FROM trip_dates AS TD JOIN trip_summary AS TS ON TS.trip_id = TD.trip_id WHERE TD.date_int = $date')
+                query = q.substitute(date = self.date.dateInt)
+                self.database.cur.execute(query)
+                if verbose: print query
+                return self.database.cur.fetchall()
+            dated = tripsondate()
+            datedids = set(trip[0] for trip in dated)
             # Removals
-            subsettrips = [trip for trip in subsettrips if trip not in exceptions["Removed"]]
+            subsettrips = [trip for trip in subsettrips if trip[0] in datedids]
             if verbose: print("There are %i trips after calendar_dates removals." % len(subsettrips))
-            # Additions
-            for trip in exceptions["Added"]:
-                subsettrips.append(trip)
+            # Additions, within the route and mode subsets
+            subsetids = set(trip[0] for trip in subsettrips)
+            for trip in dated:
+                if trip[0] not in subsetids and trip[1] in self.subset.get('routes', [trip[1]]) and trip[2] in self.subset.get('mode', [trip[2]]):
+                    subsettrips.append(trip)
             if verbose: print("There are %i trips after calendar_dates additions." % len(subsettrips))
         # Convert all trip IDs into AB_Class PTTrip objects
         subsettrips = [PTTrip(self.database.database, trip[0], self.date) for trip in subsettrips]